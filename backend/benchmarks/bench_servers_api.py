@@ -0,0 +1,115 @@
+"""/api/servers 吞吐量基准：旧的每请求新建sqlite3连接 vs 连接池数据访问层
+
+在仓库根目录运行：
+    python backend/benchmarks/bench_servers_api.py [--servers 20] [--concurrency 32] [--duration 5]
+
+直接通过ASGI接口驱动应用，不依赖HTTP客户端；同时在事件循环上跑一个
+心跳任务，统计事件循环的最大停顿时间，用于观察同步数据库调用对其它请求的影响。
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def build_legacy_app(db_path: str):
+    from fastapi import FastAPI
+
+    legacy = FastAPI()
+
+    # 与改造前 main.py 中的实现相同：每个请求新建连接且不关闭，在事件循环线程上查询
+    def get_db():
+        db = sqlite3.connect(db_path)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @legacy.get("/api/servers")
+    async def list_servers():
+        db = get_db()
+        servers = db.execute("SELECT id, name, ip, username, status FROM servers").fetchall()
+        return [dict(server) for server in servers]
+
+    return legacy
+
+
+async def asgi_get(app, path: str) -> int:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': [(b'host', b'bench')],
+        'client': ('127.0.0.1', 0), 'server': ('bench', 80),
+    }
+    status = 0
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run(app, concurrency: int, duration: float):
+    done = 0
+    errors = 0
+    max_stall = 0.0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal done, errors
+        while time.perf_counter() < deadline:
+            if await asgi_get(app, '/api/servers') == 200:
+                done += 1
+            else:
+                errors += 1
+
+    async def heartbeat():
+        nonlocal max_stall
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - start - 0.001)
+
+    start = time.perf_counter()
+    await asyncio.gather(heartbeat(), *(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return done / elapsed, errors, max_stall * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    db_path = os.path.join(tmpdir, 'bench.db')
+    os.environ['DB_PATH'] = db_path
+
+    import main as app_module
+    app_module.init_database()
+    app_module.db.executemany(
+        "INSERT INTO servers (name, ip, username, auth_type) VALUES (?, ?, ?, 'password')",
+        [(f"server-{i}", f"10.0.{i // 256}.{i % 256}", "root") for i in range(args.servers)]
+    )
+
+    for name, app in (("before (per-request connect)", build_legacy_app(db_path)),
+                      ("after (pooled Database)", app_module.app)):
+        rps, errors, stall = asyncio.run(run(app, args.concurrency, args.duration))
+        print(f"{name:32s} {rps:10.1f} req/s  errors={errors}  max loop stall={stall:.1f} ms")
+
+    app_module.db.close()
+
+
+if __name__ == '__main__':
+    main()
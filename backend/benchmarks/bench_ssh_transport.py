@@ -0,0 +1,163 @@
+"""SSH传输后端基准：线程池包装的 paramiko vs 协程实现的 asyncssh
+
+在仓库根目录运行（需要安装 asyncssh）：
+    python backend/benchmarks/bench_ssh_transport.py [--commands 2000] [--concurrency 200] [--latency 0.05]
+
+默认在子进程中启动一个本地 asyncssh 测试服务器：每条命令等待 --latency 秒后输出
+--output-bytes 字节，模拟远端命令的执行时间；也可以用 --host/--username/--password
+指向真实服务器（此时执行 --command）。两种后端都复用同一个连接，统计吞吐量、
+延迟分位数、峰值线程数和事件循环最大停顿。
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, latency: float, output_bytes: int, ready) -> None:
+    import asyncssh
+
+    class Server(asyncssh.SSHServer):
+        def begin_auth(self, username):
+            return True
+
+        def password_auth_supported(self):
+            return True
+
+        def validate_password(self, username, password):
+            return True
+
+    async def handle(process):
+        try:
+            await asyncio.sleep(latency)
+            process.stdout.write(b'x' * output_bytes)
+            process.exit(0)
+        except (BrokenPipeError, ConnectionError, asyncssh.Error):
+            # 客户端超时或取消后channel已关闭
+            pass
+
+    async def main():
+        key_path = os.path.join(tempfile.mkdtemp(), 'host_key')
+        asyncssh.generate_private_key('ssh-ed25519').write_private_key(key_path)
+        await asyncssh.create_server(
+            Server, '127.0.0.1', port, server_host_keys=[key_path],
+            process_factory=handle, encoding=None, line_editor=False,
+        )
+        ready.set()
+        await asyncio.Future()
+
+    asyncio.run(main())
+
+
+async def run(transport, server: dict, command: str, commands: int, concurrency: int):
+    latencies = []
+    errors = 0
+    max_stall = 0.0
+    peak_threads = threading.active_count()
+    limit = asyncio.Semaphore(concurrency)
+    finished = False
+
+    # 预热：建立连接
+    await transport.exec(server, command)
+
+    async def one():
+        nonlocal errors, peak_threads
+        async with limit:
+            start = time.perf_counter()
+            try:
+                _, _, exit_code = await transport.exec(server, command, timeout=60)
+                if exit_code != 0:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+            peak_threads = max(peak_threads, threading.active_count())
+
+    async def heartbeat():
+        nonlocal max_stall
+        while not finished:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - start - 0.001)
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(commands)))
+    elapsed = time.perf_counter() - start
+    finished = True
+    await beat
+    await transport.close()
+
+    latencies.sort()
+    return {
+        'rate': commands / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+        'errors': errors,
+        'threads': peak_threads,
+        'stall': max_stall * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--output-bytes', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=64, help='paramiko 线程池大小')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int, default=22)
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--command', default='true')
+    args = parser.parse_args()
+
+    from services.ssh_pool import SSHSessionPool
+    from services.transport import ParamikoTransport, AsyncSSHTransport
+
+    server_process = None
+    if args.host:
+        host, port, command = args.host, args.port, args.command
+    else:
+        host, port, command = '127.0.0.1', free_port(), 'bench'
+        ready = multiprocessing.Event()
+        server_process = multiprocessing.Process(
+            target=serve, args=(port, args.latency, args.output_bytes, ready), daemon=True)
+        server_process.start()
+        if not ready.wait(30):
+            raise RuntimeError("测试服务器启动失败")
+
+    server = {'id': 1, 'ip': host, 'port': port, 'username': args.username,
+              'auth_type': 'password', 'password': args.password, 'key_path': None}
+
+    print(f"commands={args.commands} concurrency={args.concurrency} paramiko workers={args.workers}")
+    try:
+        for name, factory in (
+            ('paramiko (thread pool)', lambda: ParamikoTransport(SSHSessionPool(), max_workers=args.workers)),
+            ('asyncssh (coroutines)', lambda: AsyncSSHTransport()),
+        ):
+            result = asyncio.run(run(factory(), server, command, args.commands, args.concurrency))
+            print(f"{name:24s} {result['rate']:8.1f} cmd/s  p50={result['p50']:7.1f} ms  "
+                  f"p95={result['p95']:7.1f} ms  errors={result['errors']}  "
+                  f"peak threads={result['threads']}  max loop stall={result['stall']:.1f} ms")
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""站点可用性探测基准：一个进程内对大量站点并发探测的吞吐
+
+在仓库根目录运行：
+    python backend/benchmarks/bench_uptime.py [--sites 5000] [--hosts 50] [--latency 0.05] [--rounds 2]
+
+本地启动 --hosts 个桩HTTP服务器（每个监听一个端口，响应前等待 --latency 秒），
+--sites 个站点平均分布在这些端口上，用 HTTPProber 按 UptimeChecker 的方式并发探测 --rounds 轮。
+第一轮需要建立连接，之后的轮次复用 keep-alive 连接。目标：每分钟 5000 个站点。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.uptime import HTTPProber
+
+
+async def stub_server(port: int, latency: float) -> asyncio.AbstractServer:
+    """最简单的 keep-alive HTTP/1.1 服务器：路径 /fail 返回500，其它返回200"""
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                path = head.split(b' ', 2)[1]
+                if latency:
+                    await asyncio.sleep(latency)
+                status = b'500 Internal Server Error' if path == b'/fail' else b'200 OK'
+                body = b'ok\n'
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', port)
+
+
+async def run(sites: int, hosts: int, latency: float, rounds: int, concurrency: int) -> None:
+    servers = [await stub_server(0, latency) for _ in range(hosts)]
+    ports = [server.sockets[0].getsockname()[1] for server in servers]
+    targets = [('http', '127.0.0.1', ports[i % hosts], '/') for i in range(sites)]
+    prober = HTTPProber(per_host=8)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def probe(target):
+        async with limit:
+            return await prober.probe(*target)
+
+    print(f"{sites} 个站点 / {hosts} 个主机，响应延迟 {latency * 1000:.0f}ms，并发上限 {concurrency}")
+    for round_no in range(rounds):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(probe(target) for target in targets))
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for result in results if result['error'])
+        print(f"第{round_no + 1}轮: {elapsed:6.2f}s  {sites / elapsed:8.1f} 次/秒  "
+              f"{sites / elapsed * 60:9.0f} 次/分钟  失败 {failed}  {prober.stats()}")
+
+    await prober.close()
+    # 等待服务端处理完连接关闭
+    await asyncio.sleep(0.2)
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sites', type=int, default=5000)
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.sites, args.hosts, args.latency, args.rounds, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
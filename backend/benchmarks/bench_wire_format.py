@@ -0,0 +1,144 @@
+"""指标传输格式基准：原有JSON vs 列式/增量格式，以及gzip / permessage-deflate 压缩后的大小
+
+在仓库根目录运行：
+    python backend/benchmarks/bench_wire_format.py [--points 1440] [--servers 100] [--ticks 60]
+
+历史数据：模拟一台服务器 --points 条原始样本（与 server_metrics 行结构相同），
+比较字典行数组与 format=columnar 的字节数和编码/解码耗时。
+实时推送：模拟 --servers 台服务器各推送 --ticks 秒，比较每秒完整快照与只发送变化字段的增量，
+压缩按每个连接一个保留上下文的 deflate 流计算（与浏览器协商 permessage-deflate 后的行为一致）。
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.wire import rows_to_columnar, delta_decode
+from services.live_metrics import diff_metrics
+from services.timeseries import TIME_FORMAT
+
+
+def dumps(content) -> bytes:
+    # 与 starlette JSONResponse 的序列化参数一致
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def history_rows(count: int) -> list:
+    start = datetime(2024, 1, 1)
+    cpu = 20.0
+    rows = []
+    for i in range(count):
+        cpu = min(max(cpu + random.uniform(-3, 3), 0), 100)
+        rows.append({
+            'id': 100000 + i,
+            'server_id': 1,
+            'cpu_usage': cpu,
+            'memory_usage': 40 + random.random(),
+            'disk_usage': 63.2,
+            'network_in': random.uniform(1000, 50000),
+            'network_out': random.uniform(1000, 50000),
+            'load_average': f"{random.random():.2f} {random.random():.2f} {random.random():.2f}",
+            'process_count': 180 + random.randint(-3, 3),
+            'uptime': 86400 + i * 60,
+            'collected_at': (start + timedelta(minutes=i)).strftime(TIME_FORMAT),
+        })
+    return rows
+
+
+def decode_columnar(payload: dict) -> list:
+    times = delta_decode(payload['time'])
+    return [{'time': t, **{c: payload['values'][c][i] for c in payload['columns']}}
+            for i, t in enumerate(times)]
+
+
+def bench_history(points: int) -> None:
+    rows = history_rows(points)
+    print(f"历史数据（{points} 条样本）")
+    print(f"{'format':12s} {'raw':>10s} {'gzip':>10s} {'encode':>10s} {'decode':>10s}")
+    for name, encode, decode in (
+        ('json rows', lambda: dumps(rows), json.loads),
+        ('columnar', lambda: dumps(rows_to_columnar(rows, 'collected_at', exclude=('id', 'server_id'))),
+         lambda body: decode_columnar(json.loads(body))),
+    ):
+        start = time.perf_counter()
+        for _ in range(20):
+            body = encode()
+        encode_ms = (time.perf_counter() - start) / 20 * 1000
+        start = time.perf_counter()
+        for _ in range(20):
+            decode(body)
+        decode_ms = (time.perf_counter() - start) / 20 * 1000
+        print(f"{name:12s} {len(body):10d} {len(gzip.compress(body, 6)):10d} "
+              f"{encode_ms:8.2f}ms {decode_ms:8.2f}ms")
+
+
+def live_sample(state: dict, tick: int) -> dict:
+    state['cpu'] = min(max(state['cpu'] + random.uniform(-2, 2), 0), 100)
+    state['rx_total'] += random.randint(0, 20000)
+    state['tx_total'] += random.randint(0, 20000)
+    return {
+        'cpu_usage': round(state['cpu'], 2),
+        'memory_usage': round(state['mem'] + (random.random() < 0.2) * 0.01, 2),
+        'memory_total': 15.52,
+        'memory_used': round(state['mem'] * 0.1552, 2),
+        'disk_usage': 63.2,
+        'disk_total': 97.87,
+        'disk_used': 61.86,
+        'load_average': [0.52, 0.48, 0.41] if tick % 5 else [0.55, 0.49, 0.41],
+        'network': {
+            'rx_bytes': round(random.uniform(0, 20000), 1),
+            'tx_bytes': round(random.uniform(0, 20000), 1),
+            'rx_bytes_total': state['rx_total'],
+            'tx_bytes_total': state['tx_total'],
+        },
+        'processes': {'total': 182, 'threads': 640},
+        'timestamp': (datetime(2024, 1, 1) + timedelta(seconds=tick)).isoformat(),
+    }
+
+
+def bench_live(servers: int, ticks: int) -> None:
+    states = [{'cpu': 20.0, 'mem': 40.0, 'rx_total': 10 ** 9, 'tx_total': 10 ** 9} for _ in range(servers)]
+    totals = {'snapshot': [0, 0], 'delta': [0, 0]}
+    deflaters = {name: zlib.compressobj(6, zlib.DEFLATED, -15) for name in totals}
+    last = [None] * servers
+    for tick in range(ticks):
+        for server_id, state in enumerate(states):
+            data = live_sample(state, tick)
+            messages = {
+                'snapshot': {'type': 'snapshot', 'server_id': server_id, 'data': data},
+                'delta': {'type': 'delta' if last[server_id] else 'snapshot', 'server_id': server_id,
+                          'data': diff_metrics(last[server_id], data)},
+            }
+            last[server_id] = data
+            for name, message in messages.items():
+                body = dumps(message)
+                compressor = deflaters[name]
+                compressed = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                totals[name][0] += len(body)
+                totals[name][1] += len(compressed) - 4  # permessage-deflate 去掉结尾的 00 00 ff ff
+    print(f"\n实时推送（{servers} 台服务器 × {ticks} 秒，单个连接订阅全部）")
+    print(f"{'format':12s} {'raw':>10s} {'deflate':>10s} {'per msg':>10s}")
+    for name, (raw, compressed) in totals.items():
+        print(f"{name:12s} {raw:10d} {compressed:10d} {compressed / (servers * ticks):9.1f}B")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1440)
+    parser.add_argument('--servers', type=int, default=100)
+    parser.add_argument('--ticks', type=int, default=60)
+    args = parser.parse_args()
+    random.seed(1)
+    bench_history(args.points)
+    bench_live(args.servers, args.ticks)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,45 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
-import sqlite3
-from pydantic import BaseModel
-from datetime import datetime
+from starlette.websockets import WebSocketState
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from datetime import datetime, timezone, timedelta
 import os
 import paramiko
 from typing import Optional, Dict, Any, List
 import shutil
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import socket
 import platform
 import getpass
-import psutil
 import logging
 import time
+import json
+import zlib
+
+from services.ssh_pool import SSHSessionPool, SSHConnectError, open_ssh_client
+from services.transport import create_transport
+from services.scheduler import scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from services.sampler import LocalMetricsSampler
+from services.command_stream import OutputCapture, stream_command_events
+from services.fleet import FleetExecutor, parse_tags
+from services.collector import FleetCollector, LOCAL_HOSTS
+from services.uptime import HTTPProber, UptimeChecker, CHECK_INSERT_SQL
+from services.alert_rules import AlertEngine, validate_rule
+from services.nginx import NginxDetector, install_commands, REMOTE_INSTALL_SCRIPT
+from services.nginx_config import NginxConfigEngine, SiteConfigError, site_host
+from services.wire import columnar, rows_to_columnar, json_response, to_epoch
+from models.base import Database
+from services.ingest import IngestPipeline, IngestQueueFull
+from services.timeseries import MetricsStore, METRIC_FIELDS
+from services.service_state import ServiceStateStore
+from services.command_log import CommandLogStore, InvalidCursor
+from services.system_logs import SystemLogStore, INSERT_SQL as SYSTEM_LOG_INSERT_SQL, log_row
+from services.live_metrics import LiveMetricsHub
+from services.jobs import JobRunner, JobError
+from websocket.manager import WebSocketManager
 
 # 设置日志
 logging.basicConfig(level=logging.DEBUG)
@@ -32,16 +55,90 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SSH会话池：按服务器复用已认证的连接
+ssh_pool = SSHSessionPool(
+    max_sessions=int(os.getenv("SSH_POOL_MAX_SESSIONS", "64")),
+    idle_timeout=float(os.getenv("SSH_POOL_IDLE_TIMEOUT", "300")),
+    keepalive_interval=int(os.getenv("SSH_POOL_KEEPALIVE", "30")),
+    max_channels=int(os.getenv("SSH_POOL_MAX_CHANNELS", "8")),
+)
+
+# 远程命令执行后端：auto（即paramiko，短命令更快）、paramiko 或 asyncssh（大量长时间并发命令时使用）
+ssh_transport = create_transport(
+    os.getenv("SSH_TRANSPORT", "auto"),
+    ssh_pool,
+    executor=scheduler.pool('ssh'),
+)
+
+async def ssh_pool_reaper():
+    # 定期回收空闲超时的SSH会话
+    while True:
+        await asyncio.sleep(30)
+        try:
+            await scheduler.run('ssh', ssh_pool.evict_idle, priority=PRIORITY_BACKGROUND)
+            if hasattr(ssh_transport, 'evict_idle'):
+                ssh_transport.evict_idle()
+        except Exception as e:
+            logger.error(f"回收SSH会话失败: {str(e)}")
+
 # 在启动时初始化数据库
 @app.on_event("startup")
 async def startup_event():
     init_database()
     update_servers_table()
+    metrics_store.create_schema()
+    service_state.create_schema()
+    command_log.create_schema()
+    system_logs.create_schema()
+    uptime_checker.create_schema()
+    alert_engine.create_schema()
+    alert_engine.load()
+    alert_engine.start()
+    job_runner.create_schema()
+    interrupted = job_runner.recover()
+    if interrupted:
+        logger.warning(f"{interrupted} 个任务因服务重启而中断")
+    job_runner.start()
+    app.state.job_retention = asyncio.create_task(job_runner.run_retention())
+    app.state.metrics_retention = asyncio.create_task(
+        metrics_store.run_retention(float(os.getenv("METRICS_RETENTION_INTERVAL", "600")))
+    )
+    app.state.service_retention = asyncio.create_task(service_state.run_retention())
+    app.state.log_maintenance = asyncio.create_task(
+        system_logs.run_maintenance(float(os.getenv("SYSTEM_LOG_MAINTENANCE_INTERVAL", "600")))
+    )
+    app.state.ssh_pool_reaper = asyncio.create_task(ssh_pool_reaper())
+    local_sampler.start()
+    ingest.start()
+    log_ingest.start()
+    if COLLECTOR_ENABLED:
+        collector.start()
+    if UPTIME_ENABLED:
+        uptime_checker.start()
+    nginx_detector.start()
+    nginx_config.start()
 
 # 在关闭时清理资源
 @app.on_event("shutdown")
 async def shutdown_event():
-    pass
+    for name in ("ssh_pool_reaper", "metrics_retention", "service_retention", "log_maintenance", "job_retention"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await live_metrics.stop()
+    await local_sampler.stop()
+    await collector.stop()
+    await uptime_checker.stop()
+    await nginx_detector.stop()
+    await nginx_config.stop()
+    await job_runner.stop()
+    await ingest.stop()
+    await log_ingest.stop()
+    # 等待已排队的阻塞任务执行完，超时后取消剩余任务
+    await scheduler.drain(float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10")))
+    await ssh_transport.close()
+    ssh_pool.close_all()
+    db.close()
 
 # 挂载静态文件目录
 app.mount("/js", StaticFiles(directory="frontend/js"), name="javascript")
@@ -58,11 +155,17 @@ async def read_root():
 async def favicon():
     return FileResponse("frontend/static/favicon.ico")
 
-# 数据库连接
-def get_db():
-    db = sqlite3.connect("sites.db")
-    db.row_factory = sqlite3.Row
-    return db
+# 数据库连接（所有路由共用一个连接池化的数据访问层）
+db = Database(
+    os.getenv("DB_PATH", "sites.db"),
+    pool_size=int(os.getenv("DB_POOL_SIZE", "4")),
+    executor=scheduler.pool('db'),
+)
+
+# 命令执行记录：摘要分页、全文搜索，大输出压缩存储
+command_log = CommandLogStore(
+    db, compress_min_bytes=int(os.getenv("COMMAND_LOG_COMPRESS_MIN_BYTES", "4096")),
+)
 
 # 站点模型
 class Site(BaseModel):
@@ -83,156 +186,308 @@ class Server(BaseModel):
     auth_type: str  # 'password' 或 'key'
     password: Optional[str] = None
     key_path: Optional[str] = None
+    tags: Optional[str] = None  # 逗号分隔的分组标签
 
 # 命令执行模型
 class Command(BaseModel):
     command: str
+    timeout: Optional[float] = None
+
+# 批量执行模型：server_ids 与 tag 二选一
+class FleetCommand(BaseModel):
+    command: str
+    server_ids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    concurrency: int = 16
+    timeout: Optional[float] = None
 
 # 配置SSH密钥存储路径
 SSH_KEYS_DIR = "ssh_keys"
 if not os.path.exists(SSH_KEYS_DIR):
     os.makedirs(SSH_KEYS_DIR)
 
-# SSH连接处理函数
+# SSH连接处理函数（新建独立连接，用于测试连接等场景）
 def get_ssh_client(server_data: dict):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
     try:
-        if server_data['auth_type'] == 'key':
-            key_path = server_data['key_path']
-            if not os.path.exists(key_path):
-                raise HTTPException(status_code=400, detail="SSH密钥文件不存在")
-            
-            private_key = paramiko.RSAKey.from_private_key_file(key_path)
-            ssh.connect(
-                server_data['ip'],
-                username=server_data['username'],
-                pkey=private_key
-            )
-        else:
-            ssh.connect(
-                server_data['ip'],
-                username=server_data['username'],
-                password=server_data['password']
-            )
-        return ssh
+        return open_ssh_client(server_data)
+    except SSHConnectError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SSH连接失败: {str(e)}")
 
+# command_logs 只保存输出的开头和结尾，超长输出中间部分省略
+COMMAND_LOG_HEAD_BYTES = int(os.getenv("COMMAND_LOG_HEAD_BYTES", "65536"))
+COMMAND_LOG_TAIL_BYTES = int(os.getenv("COMMAND_LOG_TAIL_BYTES", "65536"))
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", "600"))
+
+def new_output_capture() -> OutputCapture:
+    return OutputCapture(COMMAND_LOG_HEAD_BYTES, COMMAND_LOG_TAIL_BYTES)
+
+def capped_output(text: str) -> str:
+    capture = new_output_capture()
+    capture.feed('stdout', text.encode())
+    return capture.text()
+
 # 更新命令执行函数
-def execute_ssh_command(server_id: int, command: str):
-    db = get_db()
-    server = db.execute("SELECT * FROM servers WHERE id = ?", (server_id,)).fetchone()
+async def execute_ssh_command(server_id: int, command: str):
+    server = await db.afetch_one("SELECT * FROM servers WHERE id = ?", (server_id,))
     if not server:
         raise HTTPException(status_code=404, detail="服务器不存在")
     
     try:
-        ssh = get_ssh_client(dict(server))
-        stdin, stdout, stderr = ssh.exec_command(command)
-        result = stdout.read().decode()
-        error = stderr.read().decode()
+        result, error, _ = await ssh_transport.exec(server, command, timeout=COMMAND_TIMEOUT,
+                                                    priority=PRIORITY_INTERACTIVE)
         
         status = 'success' if not error else 'error'
         
         # 记录命令执行
-        db.execute("""
-            INSERT INTO command_logs (server_id, command, result, status)
-            VALUES (?, ?, ?, ?)
-        """, (server_id, command, result if not error else error, status))
-        db.commit()
+        await command_log.add(server_id, command, capped_output(result if not error else error), status)
         
-        ssh.close()
         return {"status": status, "result": result if not error else error}
     
     except Exception as e:
         error_msg = str(e)
-        db.execute("""
-            INSERT INTO command_logs (server_id, command, result, status)
-            VALUES (?, ?, ?, ?)
-        """, (server_id, command, error_msg, 'error'))
-        db.commit()
+        await command_log.add(server_id, command, error_msg, 'error')
         return {"status": "error", "result": error_msg}
 
 # API路由
 @app.get("/api/sites")
 async def list_sites():
-    db = get_db()
-    sites = db.execute("SELECT * FROM sites").fetchall()
-    return [dict(site) for site in sites]
+    return await db.afetch_all("SELECT * FROM sites")
 
 @app.post("/api/sites")
 async def create_site(site: Site):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
+    # 域名和配置路径都会写进 nginx 配置，创建时就校验，避免保存后每次同步都报错
+    try:
+        site_host(site.dict())
+        if site.config_path:
+            nginx_config.config_file(site.config_path)
+    except SiteConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    site_id = await db.aexecute(
         "INSERT INTO sites (domain, config_path, ssl_enabled) VALUES (?, ?, ?)",
         (site.domain, site.config_path, site.ssl_enabled)
     )
-    db.commit()
-    return {"message": "站点创建成功", "id": cursor.lastrowid}
+    uptime_checker.request_refresh()
+    nginx_config.request_sync()
+    return {"message": "站点创建成功", "id": site_id}
 
 @app.delete("/api/sites/{site_id}")
 async def delete_site(site_id: int):
-    db = get_db()
-    db.execute("DELETE FROM sites WHERE id = ?", (site_id,))
-    db.commit()
+    await db.aexecute("DELETE FROM sites WHERE id = ?", (site_id,))
+    uptime_checker.request_refresh()
+    nginx_config.request_sync()
     return {"message": "站点删除成功"}
 
 # 服务器相关API
 @app.post("/api/servers")
 async def create_server(server: Server):
-    db = get_db()
-    cursor = db.cursor()
-    
     try:
         # 测试SSH连接
-        ssh = get_ssh_client(server.dict())
+        ssh = await scheduler.run('ssh', get_ssh_client, server.dict(), priority=PRIORITY_INTERACTIVE)
         ssh.close()
         
-        cursor.execute("""
-            INSERT INTO servers (name, ip, username, auth_type, password, key_path)
-            VALUES (?, ?, ?, ?, ?, ?)
+        server_id = await db.aexecute("""
+            INSERT INTO servers (name, ip, username, auth_type, password, key_path, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
             server.name,
             server.ip,
             server.username,
             server.auth_type,
             server.password if server.auth_type == 'password' else None,
-            server.key_path if server.auth_type == 'key' else None
+            server.key_path if server.auth_type == 'key' else None,
+            ','.join(parse_tags(server.tags)) or None
         ))
-        db.commit()
-        return {"message": "服务器添加成功", "id": cursor.lastrowid}
+        return {"message": "服务器添加成功", "id": server_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"添加服务器失败: {str(e)}")
 
 @app.get("/api/servers")
 async def list_servers():
-    db = get_db()
-    servers = db.execute("SELECT id, name, ip, username, status FROM servers").fetchall()
-    return [dict(server) for server in servers]
-
-# 创建线程池用于执行同步操作
-executor = ThreadPoolExecutor()
+    return await db.afetch_all("SELECT id, name, ip, username, status, tags FROM servers")
 
-# 修改异步函数，使用线程池执行同步操作
-async def execute_ssh_command_async(server_id: int, command: str) -> Dict[str, Any]:
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, execute_ssh_command, server_id, command)
+# 本机指标后台采样器，状态接口直接读取其缓存快照
+local_sampler = LocalMetricsSampler(
+    interval=float(os.getenv("METRICS_SAMPLE_INTERVAL", "1")),
+    executor=scheduler.executor('subprocess', PRIORITY_BACKGROUND),
+    top_n=int(os.getenv("METRICS_TOP_PROCESSES", "0")),
+)
 
 @app.post("/api/servers/{server_id}/execute")
 async def execute_command_endpoint(server_id: int, command: Command):
-    return await execute_ssh_command_async(server_id, command.command)
+    return await execute_ssh_command(server_id, command.command)
+
+async def stream_ssh_command(server_id: int, command: str, timeout: Optional[float] = None,
+                             cancel=None):
+    """流式执行命令：逐块产出输出事件，结束后把截断后的输出写入 command_logs"""
+    server = await db.afetch_one("SELECT * FROM servers WHERE id = ?", (server_id,))
+    if not server:
+        raise HTTPException(status_code=404, detail="服务器不存在")
+
+    capture = new_output_capture()
+    status = 'cancelled'
+    try:
+        async for event in stream_command_events(ssh_transport, server, command, capture,
+                                                 timeout=min(timeout or COMMAND_TIMEOUT, COMMAND_TIMEOUT),
+                                                 cancel=cancel):
+            if event['type'] == 'exit':
+                status = event['status']
+                event = {**event, 'output_bytes': capture.total, 'truncated': capture.truncated}
+            yield event
+    finally:
+        await command_log.add(server_id, command, capture.text(), status)
+
+@app.post("/api/servers/{server_id}/execute/stream")
+async def execute_command_stream(server_id: int, command: Command):
+    # 先检查服务器是否存在，以便返回正常的404
+    if not await db.afetch_value("SELECT 1 FROM servers WHERE id = ?", (server_id,)):
+        raise HTTPException(status_code=404, detail="服务器不存在")
+
+    async def body():
+        # 客户端断开时生成器被关闭，命令随之取消
+        async for event in stream_ssh_command(server_id, command.command, command.timeout):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.websocket("/ws/servers/{server_id}/execute")
+async def execute_command_websocket(websocket: WebSocket, server_id: int):
+    """交互式命令执行
+
+    客户端发送 {"command": "...", "timeout": 600}，服务端推送
+    {"type": "output", "stream": "stdout"|"stderr", "data": "..."}，
+    结束时推送 {"type": "exit", "status": ..., "exit_code": ...}；
+    执行期间发送 {"type": "cancel"} 或断开连接会取消命令。
+    """
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                request = await websocket.receive_json()
+            except WebSocketDisconnect:
+                break
+            command = request.get('command') if isinstance(request, dict) else None
+            if not command:
+                await websocket.send_json({'type': 'error', 'detail': '缺少命令'})
+                continue
+
+            cancel = asyncio.Event()
+
+            async def watch_cancel():
+                # 执行期间继续读取客户端消息，收到cancel或连接断开时取消命令
+                try:
+                    while True:
+                        message = await websocket.receive_json()
+                        if isinstance(message, dict) and message.get('type') == 'cancel':
+                            break
+                except Exception:
+                    pass
+                cancel.set()
+
+            watcher = asyncio.create_task(watch_cancel())
+            events = stream_ssh_command(server_id, command, request.get('timeout'), cancel)
+            try:
+                async for event in events:
+                    await websocket.send_json(event)
+            except HTTPException as e:
+                await websocket.send_json({'type': 'error', 'detail': e.detail})
+            finally:
+                # 发送失败（连接已断开）时也要立即结束命令并写入日志
+                await events.aclose()
+                watcher.cancel()
+                try:
+                    await watcher
+                except asyncio.CancelledError:
+                    pass
+            if websocket.client_state != WebSocketState.CONNECTED:
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"命令执行WebSocket异常: {str(e)}")
+    finally:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+# 批量执行：并发上限和每台主机的超时
+async def select_servers(server_ids: Optional[List[int]], tag: Optional[str]) -> List[dict]:
+    # 按 id 列表或分组标签选择服务器
+    if server_ids:
+        placeholders = ",".join("?" * len(server_ids))
+        servers = await db.afetch_all(f"SELECT * FROM servers WHERE id IN ({placeholders})", tuple(server_ids))
+    elif tag:
+        servers = [server for server in await db.afetch_all("SELECT * FROM servers")
+                   if tag in parse_tags(server.get('tags'))]
+    else:
+        raise HTTPException(status_code=400, detail="请指定 server_ids 或 tag")
+    if not servers:
+        raise HTTPException(status_code=404, detail="没有匹配的服务器")
+    return servers
+
+fleet = FleetExecutor(ssh_transport, max_concurrency=int(os.getenv("FLEET_MAX_CONCURRENCY", "64")))
+
+@app.post("/api/fleet/execute")
+async def execute_fleet_command(request: FleetCommand):
+    """在多台服务器上并发执行命令，以NDJSON逐行返回每台主机的结果，最后一行为汇总"""
+    servers = await select_servers(request.server_ids, request.tag)
+    if request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency 必须大于0")
+
+    found = {server['id'] for server in servers}
+    missing = [server_id for server_id in request.server_ids or [] if server_id not in found]
+    timeout = min(request.timeout or COMMAND_TIMEOUT, COMMAND_TIMEOUT)
+
+    async def body():
+        logs = []
+        try:
+            async for event in fleet.run(servers, request.command, request.concurrency, timeout):
+                if event['type'] == 'result':
+                    logs.append((event['server_id'], request.command, event['output'], event['status']))
+                else:
+                    event['missing'] = missing
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            # 所有主机的执行记录一次性写入
+            if logs:
+                await command_log.aadd_many(logs)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.get("/api/fleet/stats")
+async def get_fleet_stats():
+    return fleet.stats()
+
+@app.get("/api/scheduler/stats")
+async def get_scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/api/ssh-pool/stats")
+async def get_ssh_pool_stats():
+    return {**ssh_pool.stats(), 'transport': ssh_transport.stats()}
 
 @app.get("/api/servers/{server_id}/logs")
-async def get_command_logs(server_id: int):
-    db = get_db()
-    logs = db.execute("""
-        SELECT * FROM command_logs 
-        WHERE server_id = ? 
-        ORDER BY executed_at DESC
-    """, (server_id,)).fetchall()
-    return [dict(log) for log in logs]
+async def get_command_logs(
+    server_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    # 只返回摘要，按 next_cursor 翻页；完整输出通过 /logs/{log_id} 获取
+    try:
+        return await command_log.page(server_id, limit=limit, cursor=cursor, status=status, q=q)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/servers/{server_id}/logs/{log_id}")
+async def get_command_log(server_id: int, log_id: int):
+    log = await command_log.get(server_id, log_id)
+    if not log:
+        raise HTTPException(status_code=404, detail="命令记录不存在")
+    return log
 
 # 添加SSH密钥上传接口
 @app.post("/api/upload-key")
@@ -258,19 +513,14 @@ async def upload_ssh_key(file: UploadFile = File(...)):
 
 # 更新数据库schema
 def update_servers_table():
-    db = get_db()
-    try:
-        db.execute("""
-            ALTER TABLE servers 
-            ADD COLUMN auth_type TEXT DEFAULT 'password'
-        """)
-        db.execute("""
-            ALTER TABLE servers 
-            ADD COLUMN key_path TEXT
-        """)
-        db.commit()
-    except:
-        pass  # 列已存在
+    # 每列单独添加，某一列已存在不影响其它列
+    for column in ("auth_type TEXT DEFAULT 'password'", "password TEXT", "key_path TEXT", "tags TEXT",
+                   "collect_interval INTEGER"):
+        try:
+            with db.transaction() as conn:
+                conn.execute(f"ALTER TABLE servers ADD COLUMN {column}")
+        except:
+            pass  # 列已存在
 
 # 获取本机信息
 def get_local_machine_info():
@@ -290,11 +540,8 @@ def get_local_machine_info():
 
 # 初始化数据库
 def init_database():
-    db = get_db()
-    cursor = db.cursor()
-    
     # 创建所有必需的表
-    cursor.executescript("""
+    db.executescript("""
         -- 创建站点表
         CREATE TABLE IF NOT EXISTS sites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -314,6 +561,17 @@ def init_database():
             status TEXT DEFAULT 'inactive'
         );
 
+        -- 创建命令执行记录表
+        CREATE TABLE IF NOT EXISTS command_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id INTEGER,
+            command TEXT NOT NULL,
+            result TEXT,
+            status TEXT,
+            executed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (server_id) REFERENCES servers (id)
+        );
+
         -- 创建服务器监控数据表
         CREATE TABLE IF NOT EXISTS server_metrics (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -329,6 +587,8 @@ def init_database():
             collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (server_id) REFERENCES servers (id)
         );
+        CREATE INDEX IF NOT EXISTS idx_server_metrics_server_time
+            ON server_metrics (server_id, collected_at);
 
         -- 创建服务运行状态表
         CREATE TABLE IF NOT EXISTS service_status (
@@ -365,36 +625,35 @@ def init_database():
             FOREIGN KEY (site_id) REFERENCES sites (id)
         );
     """)
-    db.commit()
 
     try:
         # 检查是否已有服务器数据
-        servers = cursor.execute("SELECT COUNT(*) FROM servers").fetchone()[0]
+        servers = db.fetch_value("SELECT COUNT(*) FROM servers")
         
         if servers == 0:
             # 获取本机信息并添加为第一个服务器
             try:
                 local_info = get_local_machine_info()
                 if local_info:
-                    cursor.execute("""
-                        INSERT INTO servers (name, ip, username, auth_type, status)
-                        VALUES (?, ?, ?, ?, 'active')
-                    """, (
-                        local_info["name"],
-                        local_info["ip"],
-                        local_info["username"],
-                        local_info["auth_type"]
-                    ))
-                    
-                    # 添加系统信息到监控数据
-                    cursor.execute("""
-                        INSERT INTO server_metrics (
-                            server_id, cpu_usage, memory_usage, disk_usage,
-                            network_in, network_out, load_average, process_count, uptime
-                        ) VALUES (?, 0, 0, 0, 0, 0, '0.0, 0.0, 0.0', 0, 0)
-                    """, (cursor.lastrowid,))
+                    with db.transaction() as conn:
+                        cursor = conn.execute("""
+                            INSERT INTO servers (name, ip, username, auth_type, status)
+                            VALUES (?, ?, ?, ?, 'active')
+                        """, (
+                            local_info["name"],
+                            local_info["ip"],
+                            local_info["username"],
+                            local_info["auth_type"]
+                        ))
+                        
+                        # 添加系统信息到监控数据
+                        conn.execute("""
+                            INSERT INTO server_metrics (
+                                server_id, cpu_usage, memory_usage, disk_usage,
+                                network_in, network_out, load_average, process_count, uptime
+                            ) VALUES (?, 0, 0, 0, 0, 0, '0.0, 0.0, 0.0', 0, 0)
+                        """, (cursor.lastrowid,))
                     
-                    db.commit()
                     print("已添加本机作为初始服务器")
             except Exception as e:
                 print(f"获取本机信息失败: {str(e)}")
@@ -414,6 +673,32 @@ class Metrics(BaseModel):
     process_count: int
     uptime: int
 
+# 批量上报的单条样本，collected_at 为客户端采集时间（可选，ISO字符串或时间戳）
+class MetricsSample(Metrics):
+    collected_at: Optional[datetime] = None
+
+metrics_samples_adapter = TypeAdapter(List[MetricsSample])
+
+# 批量上报限制
+BULK_MAX_SAMPLES = int(os.getenv("BULK_MAX_SAMPLES", "10000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(32 * 1024 * 1024)))
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # 不带时区的时间按UTC处理（与 to_db_timestamp 一致），带时区的统一换算到UTC
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def to_db_timestamp(value: Optional[datetime]) -> Optional[str]:
+    # 统一转换为与 CURRENT_TIMESTAMP 相同的UTC格式，保证排序和范围查询一致
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
 class ServiceStatus(BaseModel):
     server_id: int
     service_name: str
@@ -423,253 +708,624 @@ class ServiceStatus(BaseModel):
     memory_usage: float
     cpu_usage: float
 
+class ServiceStatusReport(BaseModel):
+    services: List[ServiceStatus]
+
 class SystemLog(BaseModel):
     server_id: int
-    log_type: str
+    log_type: Optional[str] = None
     message: str
-    severity: str
+    severity: str = 'info'
+
+class SystemLogReport(BaseModel):
+    # 逐条校验，格式错误的条目单独拒绝，不影响同一请求中的其它日志
+    logs: List[Dict[str, Any]]
+
+# 监控数据时序存储：汇总表、保留策略和按精度查询
+metrics_store = MetricsStore(db, retention={
+    level: int(float(os.getenv(f"METRICS_RETENTION_{level.upper()}_DAYS", days)) * 86400)
+    for level, days in (("raw", "2"), ("1m", "14"), ("1h", "180"), ("1d", "1825"))
+})
+
+# 监控数据批量写入管道：接口只入队，后台按批次合并写入
+ingest = IngestPipeline(
+    db,
+    max_batch=int(os.getenv("INGEST_MAX_BATCH", "500")),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5")),
+    max_queue=int(os.getenv("INGEST_MAX_QUEUE", "20000")),
+)
+ingest.register("metrics", """
+    INSERT INTO server_metrics 
+    (server_id, cpu_usage, memory_usage, disk_usage, network_in, 
+     network_out, load_average, process_count, uptime, collected_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+""", hook=metrics_store.apply_rollups)
+# 服务状态：按 (server_id, service_name) 更新当前状态，状态变化写入变更记录
+service_state = ServiceStateStore(db, retention_days=int(os.getenv("SERVICE_HISTORY_RETENTION_DAYS", "90")))
+ingest.register("services", None, hook=service_state.apply)
+
+# 系统日志：独立的写入队列，单个事务的行数有上限，日志积压时不会长时间占用写连接
+system_logs = SystemLogStore(
+    db,
+    retention_days=float(os.getenv("SYSTEM_LOG_RETENTION_DAYS", "30")),
+    max_lines_per_server=int(os.getenv("SYSTEM_LOG_MAX_LINES_PER_SERVER", "1000000")),
+    compress_after=float(os.getenv("SYSTEM_LOG_COMPRESS_AFTER", "86400")),
+)
+log_ingest = IngestPipeline(
+    db,
+    max_batch=int(os.getenv("LOG_INGEST_MAX_BATCH", "2000")),
+    flush_interval=float(os.getenv("LOG_INGEST_FLUSH_INTERVAL", "1.0")),
+    max_queue=int(os.getenv("LOG_INGEST_MAX_QUEUE", "100000")),
+    flush_limit=int(os.getenv("LOG_INGEST_FLUSH_LIMIT", "5000")),
+)
+log_ingest.register("logs", SYSTEM_LOG_INSERT_SQL)
+
+# 服务器端定时采集：对未安装agent的服务器通过SSH拉取指标，经批量写入管道入库
+COLLECTOR_ENABLED = os.getenv("COLLECTOR_ENABLED", "1") == "1"
+collector = FleetCollector(
+    db, ssh_transport, ingest,
+    default_interval=float(os.getenv("COLLECTOR_INTERVAL", "60")),
+    jitter=float(os.getenv("COLLECTOR_JITTER", "0.1")),
+    max_backoff=float(os.getenv("COLLECTOR_MAX_BACKOFF", "900")),
+    max_concurrency=int(os.getenv("COLLECTOR_CONCURRENCY", "32")),
+    timeout=float(os.getenv("COLLECTOR_TIMEOUT", "20")),
+)
+
+# 站点可用性检查：定时探测 sites 表中的域名，结果批量写入 monitoring_logs，状态变化时产生告警
+UPTIME_ENABLED = os.getenv("UPTIME_ENABLED", "1") == "1"
+ingest.register("site_checks", CHECK_INSERT_SQL)
+uptime_checker = UptimeChecker(
+    db, ingest,
+    HTTPProber(
+        connect_timeout=float(os.getenv("UPTIME_CONNECT_TIMEOUT", "5")),
+        timeout=float(os.getenv("UPTIME_TIMEOUT", "10")),
+        per_host=int(os.getenv("UPTIME_PER_HOST", "4")),
+        verify_tls=os.getenv("UPTIME_VERIFY_TLS", "1") == "1",
+    ),
+    interval=float(os.getenv("UPTIME_INTERVAL", "60")),
+    max_concurrency=int(os.getenv("UPTIME_CONCURRENCY", "500")),
+    fail_threshold=int(os.getenv("UPTIME_FAIL_THRESHOLD", "2")),
+    recover_threshold=int(os.getenv("UPTIME_RECOVER_THRESHOLD", "2")),
+    alert_cooldown=float(os.getenv("UPTIME_ALERT_COOLDOWN", "600")),
+)
+
+@app.get("/api/monitor/uptime/stats")
+async def get_uptime_stats():
+    return uptime_checker.stats()
+
+@app.get("/api/sites/{site_id}/uptime")
+async def get_site_uptime(site_id: int):
+    state = uptime_checker.site_state(site_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="该站点不在检查计划中")
+    return state
+
+@app.post("/api/sites/{site_id}/check")
+async def check_site_now(site_id: int):
+    site = uptime_checker.get_site(site_id)
+    if site is None:
+        raise HTTPException(status_code=404, detail="该站点不在检查计划中")
+    return await uptime_checker.check(site)
+
+@app.get("/api/sites/{site_id}/checks")
+async def get_site_checks(site_id: int, limit: int = Query(100, ge=1, le=1000)):
+    return await db.afetch_all("""
+        SELECT * FROM monitoring_logs WHERE site_id = ?
+        ORDER BY checked_at DESC, id DESC LIMIT ?
+    """, (site_id, limit))
+
+@app.get("/api/alerts")
+async def list_alerts(
+    status: Optional[str] = None,
+    server_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if server_id is not None:
+        conditions.append("server_id = ?")
+        params.append(server_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return await db.afetch_all(f"SELECT * FROM alerts {where} ORDER BY id DESC LIMIT ?", (*params, limit))
+
+@app.get("/api/monitor/collector/stats")
+async def get_collector_stats():
+    return collector.stats()
+
+@app.get("/api/servers/{server_id}/collector")
+async def get_server_collector_state(server_id: int):
+    state = collector.target_state(server_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="该服务器不在采集计划中")
+    return state
+
+def metrics_row(metrics: Metrics, collected_at: Optional[datetime] = None) -> tuple:
+    return (
+        metrics.server_id, metrics.cpu_usage, metrics.memory_usage,
+        metrics.disk_usage, metrics.network_in, metrics.network_out,
+        metrics.load_average, metrics.process_count, metrics.uptime,
+        to_db_timestamp(collected_at or datetime.now(timezone.utc))
+    )
+
+async def submit_ingest(kind: str, rows: list):
+    try:
+        await ingest.submit(kind, rows)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"写入队列繁忙，请稍后重试: {str(e)}")
 
 # 监控相关API路由
 @app.post("/api/monitor/metrics")
 async def update_metrics(metrics: Metrics):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO server_metrics 
-        (server_id, cpu_usage, memory_usage, disk_usage, network_in, 
-         network_out, load_average, process_count, uptime)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        metrics.server_id, metrics.cpu_usage, metrics.memory_usage,
-        metrics.disk_usage, metrics.network_in, metrics.network_out,
-        metrics.load_average, metrics.process_count, metrics.uptime
-    ))
-    db.commit()
+    await submit_ingest("metrics", [metrics_row(metrics)])
     return {"message": "指标更新成功"}
 
+def read_bulk_body(body: bytes, content_encoding: str) -> bytes:
+    # 支持gzip压缩的请求体，解压后大小受 BULK_MAX_BYTES 限制
+    if 'gzip' in content_encoding or body[:2] == b'\x1f\x8b':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, BULK_MAX_BYTES + 1)
+        if len(body) > BULK_MAX_BYTES or decompressor.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="请求数据过大")
+    elif len(body) > BULK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="请求数据过大")
+    return body
+
+def parse_bulk_samples(body: bytes, content_type: str) -> list:
+    # JSON数组或按行分隔的JSON（NDJSON）
+    text = body.decode('utf-8')
+    stripped = text.lstrip()
+    try:
+        if 'ndjson' in content_type or 'jsonlines' in content_type or not stripped.startswith('['):
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        return json.loads(text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"数据格式错误: {str(e)}")
+
+async def existing_server_ids(server_ids) -> set:
+    # 按批查询，避免超过SQLite单条语句的参数个数上限
+    ids, found = sorted(set(server_ids)), set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = await db.afetch_all(
+            f"SELECT id FROM servers WHERE id IN ({','.join('?' * len(chunk))})", tuple(chunk))
+        found.update(row['id'] for row in rows)
+    return found
+
+@app.post("/api/monitor/metrics/bulk")
+async def update_metrics_bulk(request: Request):
+    body = read_bulk_body(await request.body(), request.headers.get('content-encoding', ''))
+    raw_samples = parse_bulk_samples(body, request.headers.get('content-type', ''))
+    if len(raw_samples) > BULK_MAX_SAMPLES:
+        raise HTTPException(status_code=413, detail=f"单次最多上报 {BULK_MAX_SAMPLES} 条数据")
+
+    # 一次性校验全部样本，任意一条不合法则整批拒绝
+    try:
+        samples = metrics_samples_adapter.validate_python(raw_samples)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    # 不存在的服务器ID同样整批拒绝，并指出出错的样本位置
+    known = await existing_server_ids(sample.server_id for sample in samples)
+    unknown = [
+        {"loc": [index, "server_id"], "msg": f"服务器不存在: {sample.server_id}",
+         "type": "value_error", "input": sample.server_id}
+        for index, sample in enumerate(samples) if sample.server_id not in known
+    ]
+    if unknown:
+        raise RequestValidationError(unknown)
+
+    # 同一次提交的行会在同一个事务中写入
+    await submit_ingest("metrics", [metrics_row(sample, sample.collected_at) for sample in samples])
+    return {
+        "message": "指标批量更新成功",
+        "accepted": len(samples),
+        "servers": len({sample.server_id for sample in samples})
+    }
+
 @app.post("/api/monitor/services")
-async def update_services(data: dict):
-    db = get_db()
-    cursor = db.cursor()
-    for service in data['services']:
-        cursor.execute("""
-            INSERT INTO service_status 
-            (server_id, service_name, status, port, pid, memory_usage, cpu_usage)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            service['server_id'], service['service_name'], service['status'],
-            service['port'], service['pid'], service['memory_usage'], 
-            service['cpu_usage']
-        ))
-    db.commit()
+async def update_services(report: ServiceStatusReport):
+    # 请求体经模型校验后才入队，格式错误的数据返回422，不会进入共享的写入队列
+    await submit_ingest("services", [(
+        service.server_id, service.service_name, service.status,
+        service.port, service.pid, service.memory_usage,
+        service.cpu_usage
+    ) for service in report.services])
     return {"message": "服务状态更新成功"}
 
+@app.get("/api/monitor/ingest/stats")
+async def get_ingest_stats():
+    return ingest.stats()
+
 @app.post("/api/monitor/logs")
-async def update_logs(data: dict):
-    db = get_db()
-    cursor = db.cursor()
-    for log in data['logs']:
-        cursor.execute("""
-            INSERT INTO system_logs 
-            (server_id, log_type, message, severity)
-            VALUES (?, ?, ?, ?)
-        """, (
-            log['server_id'], log['log_type'], 
-            log['message'], log['severity']
-        ))
-    db.commit()
-    return {"message": "系统日志更新成功"}
+async def update_logs(report: SystemLogReport):
+    created_at = to_db_timestamp(datetime.now(timezone.utc))
+    rows, rejected = [], []
+    for index, entry in enumerate(report.logs):
+        try:
+            log = SystemLog.model_validate(entry, strict=True)
+            rows.append(log_row(log.model_dump(), created_at))
+        except ValidationError as e:
+            rejected.append({"index": index, "error": "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+            )})
+        except ValueError as e:
+            rejected.append({"index": index, "error": str(e)})
+    if not rows:
+        raise HTTPException(status_code=422, detail={"message": "日志格式错误", "rejected": rejected})
+    try:
+        await log_ingest.submit("logs", rows)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"日志写入队列繁忙，请稍后重试: {str(e)}")
+    system_logs.publish(rows)
+    return {"message": "系统日志更新成功", "accepted": len(rows), "rejected": rejected}
+
+@app.get("/api/monitor/logs/stats")
+async def get_log_stats():
+    return {'ingest': log_ingest.stats(), **system_logs.stats()}
+
+# 历史查询最多返回的数据点数
+METRICS_MAX_POINTS = int(os.getenv("METRICS_MAX_POINTS", "2000"))
+METRICS_AGGREGATES = ('avg', 'min', 'max', 'p95')
+
+def parse_step(step: Optional[str]) -> Optional[int]:
+    # 步长支持秒数或带单位的写法：30s、5m、1h、1d
+    if not step:
+        return None
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    try:
+        if step[-1] in units:
+            return int(step[:-1]) * units[step[-1]]
+        return int(step)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的步长: {step}")
+
+def parse_choices(value: Optional[str], allowed: tuple, default: tuple) -> list:
+    if not value:
+        return list(default)
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    invalid = [item for item in items if item not in allowed]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"不支持的参数: {', '.join(invalid)}")
+    return items
 
 # 获取服务器监控数据
 @app.get("/api/servers/{server_id}/metrics")
-async def get_server_metrics(server_id: int):
-    db = get_db()
-    metrics = db.execute("""
-        SELECT * FROM server_metrics 
-        WHERE server_id = ? 
-        ORDER BY collected_at DESC 
-        LIMIT 100
-    """, (server_id,)).fetchall()
-    return [dict(metric) for metric in metrics]
+async def get_server_metrics(
+    request: Request,
+    server_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    step: Optional[str] = None,
+    fields: Optional[str] = None,
+    agg: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    # format=columnar 返回列式紧凑格式（时间增量编码、每列一个数组），默认保持原有格式
+    if format not in (None, "json", "columnar"):
+        raise HTTPException(status_code=400, detail="format 只支持 json 或 columnar")
+    compact = format == "columnar"
+
+    # 参数总是校验，不支持的字段或聚合方式返回400
+    field_list = parse_choices(fields, METRIC_FIELDS, METRIC_FIELDS)
+    agg_list = parse_choices(agg, METRICS_AGGREGATES, ('avg',))
+
+    # 没有任何范围和投影参数时保持原有行为：返回最近100条原始数据；
+    # 只指定了 fields/step/agg 时按默认的最近一小时聚合，只返回请求的列
+    if start is None and end is None and not (fields or step or agg):
+        rows = await db.afetch_all("""
+            SELECT * FROM server_metrics 
+            WHERE server_id = ? 
+            ORDER BY collected_at DESC 
+            LIMIT 100
+        """, (server_id,))
+        if compact:
+            rows.reverse()
+            return json_response(request, rows_to_columnar(rows, "collected_at", exclude=("id", "server_id")))
+        return json_response(request, rows)
+
+    end = as_utc(end) or datetime.now(timezone.utc)
+    start = as_utc(start) or end - timedelta(hours=1)
+    span = (end - start).total_seconds()
+    if span <= 0:
+        raise HTTPException(status_code=400, detail="时间范围无效")
+
+    # 未指定步长时按最多500个点自动计算；步长过小时放大到 METRICS_MAX_POINTS 以内
+    step_seconds = parse_step(step) or max(int(-(-span // 500)), 1)
+    step_seconds = max(step_seconds, int(-(-span // METRICS_MAX_POINTS)), 1)
+
+    result = await db.run(
+        metrics_store.aggregate, server_id,
+        to_db_timestamp(start), to_db_timestamp(end), step_seconds, field_list, agg_list
+    )
+    if compact:
+        result.update(columnar(result.pop("columns"), result.pop("points"), "time"))
+    return json_response(request, {"from": to_db_timestamp(start), "to": to_db_timestamp(end), **result})
 
 @app.get("/api/servers/{server_id}/services")
-async def get_server_services(server_id: int):
-    db = get_db()
-    services = db.execute("""
+async def get_server_services(request: Request, server_id: int):
+    # 当前状态表每个服务只有一行
+    return json_response(request, await db.afetch_all("""
         SELECT * FROM service_status 
         WHERE server_id = ? 
-        ORDER BY updated_at DESC
-    """, (server_id,)).fetchall()
-    return [dict(service) for service in services]
+        ORDER BY service_name
+    """, (server_id,)))
 
-@app.get("/api/servers/{server_id}/logs")
-async def get_server_logs(server_id: int):
-    db = get_db()
-    logs = db.execute("""
-        SELECT * FROM system_logs 
-        WHERE server_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT 1000
-    """, (server_id,)).fetchall()
-    return [dict(log) for log in logs]
+@app.get("/api/servers/{server_id}/services/history")
+async def get_server_service_history(
+    request: Request,
+    server_id: int,
+    service: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # 只包含状态变化（如 running -> stopped），按时间倒序
+    if service:
+        rows = await db.afetch_all("""
+            SELECT * FROM service_status_changes
+            WHERE server_id = ? AND service_name = ?
+            ORDER BY changed_at DESC, id DESC LIMIT ?
+        """, (server_id, service, limit))
+    else:
+        rows = await db.afetch_all("""
+            SELECT * FROM service_status_changes
+            WHERE server_id = ?
+            ORDER BY changed_at DESC, id DESC LIMIT ?
+        """, (server_id, limit))
+    return json_response(request, rows)
+
+# /api/servers/{server_id}/logs 为命令执行记录，系统日志使用单独的路径
+@app.get("/api/servers/{server_id}/system-logs")
+async def get_server_logs(
+    server_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    before_id: Optional[int] = None,
+    severity: Optional[str] = None,
+    log_type: Optional[str] = None,
+):
+    # 按 id 倒序分页，使用返回的 next_cursor 作为 before_id 获取更早的日志
+    return await system_logs.page(server_id, limit=limit, before_id=before_id,
+                                  severity=severity, log_type=log_type)
+
+@app.get("/api/servers/{server_id}/system-logs/tail")
+async def tail_server_logs(
+    server_id: int,
+    backlog: int = Query(50, ge=0, le=1000),
+    severity: Optional[str] = None,
+):
+    async def body():
+        async for event in system_logs.tail(server_id, backlog=backlog, severity=severity):
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+def metrics_from_row(row: dict) -> dict:
+    # server_metrics 中的一行转换为与采样器快照相同结构的指标
+    return {
+        'cpu_usage': row['cpu_usage'],
+        'memory_usage': row['memory_usage'],
+        'disk_usage': row['disk_usage'],
+        'load_average': [float(x) for x in (row['load_average'] or '').replace(',', ' ').split()],
+        'network': {'rx_bytes': row['network_in'], 'tx_bytes': row['network_out']},
+        'processes': {'total': row['process_count']},
+        'uptime': row['uptime'],
+        'timestamp': row['collected_at'],
+    }
+
+async def server_snapshot(server_id: int) -> Optional[dict]:
+    """服务器的最新指标快照，服务器不存在时返回 None
+
+    本机读取后台采样器的缓存；其它服务器读取采集器最近一次的结果，
+    采集器尚未采集（或未启用）时读取 server_metrics 中的最新一行。
+    """
+    server = await db.afetch_one("SELECT ip FROM servers WHERE id = ?", (server_id,))
+    if server is None:
+        return None
+    if server['ip'] in LOCAL_HOSTS:
+        return local_sampler.snapshot()
+
+    latest = collector.latest(server_id)
+    if latest is not None:
+        metrics, sampled_at, interval = latest
+    else:
+        row = await db.afetch_one("""
+            SELECT * FROM server_metrics WHERE server_id = ?
+            ORDER BY collected_at DESC LIMIT 1
+        """, (server_id,))
+        if row is None:
+            return {'server_info': {'status': 'pending'}, 'metrics': None,
+                    'sampled_at': None, 'age': None, 'stale': True}
+        metrics, sampled_at = metrics_from_row(row), to_epoch(row['collected_at'])
+        interval = collector.default_interval
+    age = max(time.time() - sampled_at, 0)
+    return {
+        'server_info': {'status': 'active'},
+        'metrics': metrics,
+        'sampled_at': datetime.fromtimestamp(sampled_at, timezone.utc).isoformat(),
+        'age': round(age, 3),
+        'stale': age > interval * 3,
+    }
 
 # 添加新的状获取路由
 @app.get("/api/servers/{server_id}/status")
 async def get_server_status(server_id: int):
+    # 返回最新指标快照，附带 sampled_at/age/stale 新鲜度信息
+    snapshot = await server_snapshot(server_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="服务器不存在")
+    return snapshot
+
+# 实时指标WebSocket：客户端订阅一组服务器ID，每台服务器只有一个共享采样任务
+ws_manager = WebSocketManager()
+
+async def sample_live_metrics(server_id: int):
+    # 与状态接口保持一致
+    snapshot = await server_snapshot(server_id)
+    return snapshot['metrics'] if snapshot else None
+
+live_metrics = LiveMetricsHub(ws_manager, sample_live_metrics, interval=local_sampler.interval)
+
+# 指标告警规则：作为 metrics 写入钩子对每个样本增量求值
+async def publish_alert(event: dict):
+    # 订阅全部告警的连接和订阅了该服务器的连接都能收到
+    await ws_manager.publish('alerts', event)
+    await ws_manager.publish(event['server_id'], event)
+
+alert_engine = AlertEngine(db, publish=publish_alert, warmup=int(os.getenv("ALERT_ANOMALY_WARMUP", "30")))
+ingest.add_hook("metrics", alert_engine.apply)
+
+class AlertRule(BaseModel):
+    name: str
+    metric: str
+    kind: str = 'threshold'
+    operator: str = '>'
+    value: float
+    duration: int = 0
+    server_id: Optional[int] = None
+    severity: str = 'warning'
+    enabled: bool = True
+
+@app.get("/api/alert-rules")
+async def list_alert_rules():
+    return await db.afetch_all("SELECT * FROM alert_rules ORDER BY id")
+
+@app.post("/api/alert-rules")
+async def create_alert_rule(rule: AlertRule):
+    error = validate_rule(rule.dict())
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    rule_id = await db.aexecute("""
+        INSERT INTO alert_rules (name, metric, kind, operator, value, duration, server_id, severity, enabled)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (rule.name, rule.metric, rule.kind, rule.operator, rule.value, rule.duration,
+          rule.server_id, rule.severity, int(rule.enabled)))
+    await db.run(alert_engine.load)
+    return {"message": "告警规则创建成功", "id": rule_id}
+
+@app.put("/api/alert-rules/{rule_id}")
+async def update_alert_rule(rule_id: int, rule: AlertRule):
+    error = validate_rule(rule.dict())
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    updated = await db.aexecute_rowcount("""
+        UPDATE alert_rules SET name = ?, metric = ?, kind = ?, operator = ?, value = ?, duration = ?,
+        server_id = ?, severity = ?, enabled = ? WHERE id = ?
+    """, (rule.name, rule.metric, rule.kind, rule.operator, rule.value, rule.duration,
+          rule.server_id, rule.severity, int(rule.enabled), rule_id))
+    if not updated:
+        raise HTTPException(status_code=404, detail="告警规则不存在")
+    await db.run(alert_engine.load)
+    return {"message": "告警规则更新成功"}
+
+@app.delete("/api/alert-rules/{rule_id}")
+async def delete_alert_rule(rule_id: int):
+    await db.aexecute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
+    await db.run(alert_engine.load)
+    return {"message": "告警规则删除成功"}
+
+@app.get("/api/monitor/alerts/stats")
+async def get_alert_engine_stats():
+    return alert_engine.stats()
+
+@app.websocket("/ws/alerts")
+async def alerts_websocket(websocket: WebSocket):
+    # 只推送不接收，客户端消息被忽略
+    await ws_manager.connect(websocket, topics=['alerts'])
     try:
-        # 这里可以根据server_id获取特定服务器的信息
-        metrics = get_server_metrics()
-        print(f"API返回的指标数据: {metrics}")  # 添加日志
-        return metrics
-    except Exception as e:
-        print(f"获取服务器状态失败: {str(e)}")
-        print(f"错误堆栈: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=str(e))
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await ws_manager.disconnect(websocket)
+
+@app.websocket("/ws/metrics")
+async def metrics_websocket(websocket: WebSocket):
+    await live_metrics.handle(websocket)
+
+@app.get("/api/monitor/live/stats")
+async def get_live_metrics_stats():
+    return live_metrics.stats()
+
+# Nginx 状态检测：PATH查找 + pid文件，结果短时间缓存，pid文件或可执行文件变化时立即失效
+nginx_detector = NginxDetector(
+    ttl=float(os.getenv("NGINX_STATUS_TTL", "5")),
+    poll_interval=float(os.getenv("NGINX_WATCH_INTERVAL", "1")),
+)
+
+# 站点配置生成：站点增删后合并为一次写文件 + nginx -t + reload，也可推送到远程服务器
+nginx_config = NginxConfigEngine(
+    db,
+    conf_dir=os.getenv("NGINX_CONF_DIR", "/etc/nginx/conf.d"),
+    resolve_binary=lambda: os.getenv("NGINX_BIN") or nginx_detector.find_binary(),
+    executor=scheduler.executor('subprocess', PRIORITY_BACKGROUND),
+    transport=ssh_transport,
+    debounce=float(os.getenv("NGINX_RELOAD_DEBOUNCE", "2")),
+    max_delay=float(os.getenv("NGINX_RELOAD_MAX_DELAY", "30")),
+    site_root=os.getenv("NGINX_SITE_ROOT", "/var/www"),
+    cert_dir=os.getenv("NGINX_SSL_CERT_DIR", "/etc/letsencrypt/live"),
+    remote_conf_dir=os.getenv("NGINX_REMOTE_CONF_DIR") or None,
+    remote_sudo=os.getenv("NGINX_REMOTE_SUDO", "0") == "1",
+)
+
+class NginxPush(BaseModel):
+    server_ids: List[int]
+    concurrency: int = 8
 
-def get_server_metrics():
+@app.get("/api/nginx/config/stats")
+async def nginx_config_stats():
+    return nginx_config.stats()
+
+@app.post("/api/nginx/config/sync")
+async def sync_nginx_config():
     try:
-        # 获取CPU使用率
-        cpu_usage = psutil.cpu_percent(interval=1)
-        print(f"CPU使用率: {cpu_usage}")
-        
-        # 获取内存使用情况
-        memory = psutil.virtual_memory()
-        memory_usage = memory.percent
-        print(f"内存使用情况: {memory_usage}")
-        
-        # 获取磁盘使用情况
-        disk = psutil.disk_usage('/')
-        disk_usage = disk.percent
-        print(f"磁盘使用情况: {disk_usage}")
-        
-        # 获取系统负载
-        load_average = psutil.getloadavg()
-        print(f"系统负载: {load_average}")
-        
-        # 获取网络IO统计
-        net_io = psutil.net_io_counters()
-        
-        # 计算速率（与上次获取的差值）
-        current_time = time.time()
-        if hasattr(get_server_metrics, 'last_net_io'):
-            time_delta = current_time - get_server_metrics.last_time
-            rx_speed = (net_io.bytes_recv - get_server_metrics.last_net_io.bytes_recv) / time_delta
-            tx_speed = (net_io.bytes_sent - get_server_metrics.last_net_io.bytes_sent) / time_delta
-        else:
-            rx_speed = 0
-            tx_speed = 0
-
-        # 保存本次数据用于下次计算
-        get_server_metrics.last_net_io = net_io
-        get_server_metrics.last_time = current_time
-
-        network = {
-            'rx_bytes': rx_speed,  # 当前接收速率
-            'tx_bytes': tx_speed,  # 当前发送速率
-            'rx_bytes_total': net_io.bytes_recv,  # 总接收量
-            'tx_bytes_total': net_io.bytes_sent   # 总发送量
-        }
-        
-        # 获取进程信息
-        try:
-            processes = {
-                'total': len(psutil.pids()),
-                'threads': sum(p.num_threads() for p in psutil.process_iter(['num_threads']))
-            }
-            print(f"进程信息: {processes}")
-        except Exception as e:
-            print(f"获取进程信息失败: {str(e)}")
-            processes = {'total': 0, 'threads': 0}
-        
-        metrics = {
-            'server_info': {
-                'status': 'active'
-            },
-            'metrics': {
-                'cpu_usage': round(cpu_usage, 2),
-                'memory_usage': round(memory_usage, 2),
-                'memory_total': round(memory.total / (1024 * 1024 * 1024), 2),
-                'memory_used': round(memory.used / (1024 * 1024 * 1024), 2),
-                'disk_usage': round(disk_usage, 2),
-                'disk_total': round(disk.total / (1024 * 1024 * 1024), 2),
-                'disk_used': round(disk.used / (1024 * 1024 * 1024), 2),
-                'load_average': load_average,
-                'network': network,
-                'processes': processes,
-                'timestamp': datetime.now().isoformat()
-            }
-        }
-        print(f"返回的完整指标: {metrics}")
-        return metrics
-        
+        return await nginx_config.sync()
     except Exception as e:
-        import traceback
-        print(f"获取系统信息时出错: {str(e)}")
-        print(f"错误堆栈: {traceback.format_exc()}")
-        return {
-            'server_info': {
-                'status': 'error'
-            },
-            'metrics': {
-                'cpu_usage': 0,
-                'memory_usage': 0,
-                'disk_usage': 0,
-                'load_average': [0, 0, 0],
-                'network': {
-                    'rx_bytes': 0,
-                    'tx_bytes': 0,
-                    'rx_bytes_total': 0,
-                    'tx_bytes_total': 0
-                },
-                'processes': {'total': 0, 'threads': 0}
-            }
-        }
+        raise HTTPException(status_code=500, detail=f"同步 Nginx 配置失败: {str(e)}")
 
-# 修改 check_nginx 函数，添加更多错误处理和日志
-def check_nginx():
+@app.get("/api/sites/{site_id}/config")
+async def get_site_config(site_id: int):
+    site = await db.afetch_one("SELECT * FROM sites WHERE id = ?", (site_id,))
+    if not site:
+        raise HTTPException(status_code=404, detail="站点不存在")
     try:
-        # 方法1：检查进程
-        nginx_running = False
-        for proc in psutil.process_iter(['name']):
-            if proc.info['name'] == 'nginx':
-                nginx_running = True
-                break
+        return {"path": nginx_config.site_path(site), "content": nginx_config.render(site)}
+    except SiteConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # 方法2：检查命令是否存在
-        nginx_installed = os.system('which nginx >/dev/null 2>&1') == 0
+@app.post("/api/nginx/config/push")
+async def push_nginx_config(push: NginxPush):
+    if not push.server_ids:
+        raise HTTPException(status_code=400, detail="请指定服务器")
+    placeholders = ','.join('?' * len(push.server_ids))
+    servers = await db.afetch_all(f"SELECT * FROM servers WHERE id IN ({placeholders})", tuple(push.server_ids))
+    if not servers:
+        raise HTTPException(status_code=404, detail="服务器不存在")
+    sites = await db.afetch_all("SELECT * FROM sites ORDER BY id")
+    limit = asyncio.Semaphore(max(1, push.concurrency))
 
-        # 方法3：检查服务状态
-        service_status = os.system('systemctl is-active --quiet nginx') == 0
+    async def push_one(server):
+        async with limit:
+            try:
+                result = await nginx_config.push(server, sites)
+            except Exception as e:
+                result = {'server_id': server['id'], 'status': 'error', 'message': str(e)}
+        status = 'error' if result['status'] in ('invalid', 'error') else 'success'
+        await command_log.add(server['id'], 'nginx config push',
+                              json.dumps(result, ensure_ascii=False), status)
+        return result
 
-        logger.info(f"Nginx 检查结果: installed={nginx_installed}, running={nginx_running}, service={service_status}")
-        
-        return nginx_installed and (nginx_running or service_status)
-    except Exception as e:
-        logger.error(f"检查 Nginx 状态时出错: {str(e)}")
-        return False
+    return await asyncio.gather(*(push_one(server) for server in servers))
+
+@app.get("/api/nginx/stats")
+async def nginx_detector_stats():
+    return nginx_detector.stats()
 
-# 修改 API 端点，添加更多信息
 @app.get("/api/check-nginx")
 async def check_nginx_status():
     try:
-        nginx_installed = check_nginx()
-        logger.info(f"Nginx 状态检查: {nginx_installed}")
-        
-        if nginx_installed:
-            # 获取 Nginx 版本信息
-            version = os.popen('nginx -v 2>&1').read().strip()
-            return {
-                "installed": True,
-                "status": "running",
-                "version": version,
-                "message": "Nginx 已安装并运行"
-            }
-        else:
-            return {
-                "installed": False,
-                "status": "not_installed",
-                "message": "Nginx 未安装"
-            }
+        # 缓存命中时直接返回；刷新只有几次 stat 和读文件，不创建子进程
+        return nginx_detector.status()
     except Exception as e:
         logger.error(f"Nginx 状态检查失败: {str(e)}")
         return {
@@ -679,36 +1335,122 @@ async def check_nginx_status():
         }
 
 # 添加新的函数来检查和安装 Nginx
-def install_nginx():
+# 后台任务：耗时操作提交为任务立即返回任务 id，可轮询状态和日志，或通过 WebSocket 订阅
+async def publish_job(event: dict):
+    await ws_manager.publish('jobs', event)
+
+job_runner = JobRunner(
+    db, transport=ssh_transport, publish=publish_job,
+    max_concurrency=int(os.getenv("JOB_MAX_CONCURRENCY", "4")),
+    max_log_bytes=int(os.getenv("JOB_MAX_LOG_BYTES", str(1024 * 1024))),
+    keep_days=float(os.getenv("JOB_RETENTION_DAYS", "30")),
+)
+INSTALL_TIMEOUT = float(os.getenv("NGINX_INSTALL_TIMEOUT", "1800"))
+
+class RemoteInstall(BaseModel):
+    server_ids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    concurrency: int = 16
+
+async def install_nginx(job):
+    commands = install_commands()
+    if commands is None:
+        raise JobError("不支持的操作系统")
     try:
-        # 检测系统类型
-        if os.path.exists('/etc/debian_version'):  # Debian/Ubuntu
-            os.system('sudo apt-get update')
-            os.system('sudo apt-get install -y nginx')
-        elif os.path.exists('/etc/redhat-release'):  # CentOS/RHEL
-            os.system('sudo yum install -y epel-release')
-            os.system('sudo yum install -y nginx')
-        elif os.path.exists('/etc/arch-release'):  # Arch Linux
-            os.system('sudo pacman -S --noconfirm nginx')
-        else:
-            return False, "不支持的操作系统"
-        
-        # 启动 Nginx 服务
-        os.system('sudo systemctl start nginx')
-        os.system('sudo systemctl enable nginx')
-        
-        return True, "Nginx 安装成功"
-    except Exception as e:
-        return False, str(e)
+        for index, (label, command) in enumerate(commands):
+            job.progress(index / len(commands), f"{label}...")
+            exit_code = await job.run_local(command, timeout=INSTALL_TIMEOUT)
+            if exit_code != 0:
+                raise JobError(f"{label}失败（退出码 {exit_code}）")
+    finally:
+        nginx_detector.invalidate()
+    job.progress(1.0, "Nginx 安装成功")
+    return {"nginx": nginx_detector.status()}
+
+async def install_nginx_remote(job, servers: List[dict], concurrency: int):
+    async def install(server):
+        exit_code = await job.run_remote(server, REMOTE_INSTALL_SCRIPT, timeout=INSTALL_TIMEOUT)
+        status = 'success' if exit_code == 0 else 'error'
+        await command_log.add(server['id'], 'install nginx', f"任务 {job.id}，退出码 {exit_code}", status)
+        return {'server_id': server['id'], 'status': status, 'exit_code': exit_code}
 
-# 添加新的 API 端点
-@app.post("/api/install-nginx")
+    results = await job.for_each(servers, install, concurrency=concurrency, label=lambda server: server['name'])
+    failed = [result for result in results if result['status'] != 'success']
+    if failed:
+        raise JobError(f"{len(failed)}/{len(results)} 台服务器安装失败", {'results': results})
+    job.progress(1.0, f"{len(results)} 台服务器安装成功")
+    return {'results': results}
+
+@app.post("/api/install-nginx", status_code=202)
 async def install_nginx_service():
-    success, message = install_nginx()
-    if success:
-        return {"status": "success", "message": message}
-    else:
-        raise HTTPException(status_code=500, detail=message)
+    # 安装需要几分钟，提交为后台任务立即返回；已有安装任务在执行时返回该任务
+    job_id = job_runner.find_active('install_nginx')
+    if job_id is None:
+        job_id = await job_runner.submit('install_nginx', install_nginx)
+    return {"status": "accepted", "job_id": job_id, "message": "Nginx 安装任务已提交"}
+
+@app.post("/api/servers/install-nginx", status_code=202)
+async def install_nginx_on_servers(request: RemoteInstall):
+    servers = await select_servers(request.server_ids, request.tag)
+    if request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency 必须大于0")
+    job_id = await job_runner.submit(
+        'install_nginx_remote',
+        lambda job: install_nginx_remote(job, servers, request.concurrency),
+        params={'server_ids': [server['id'] for server in servers], 'concurrency': request.concurrency},
+    )
+    return {"status": "accepted", "job_id": job_id, "message": f"已提交 {len(servers)} 台服务器的安装任务"}
+
+@app.get("/api/jobs")
+async def list_jobs(status: Optional[str] = None, kind: Optional[str] = None,
+                    limit: int = Query(50, ge=1, le=500)):
+    return await job_runner.list(status=status, kind=kind, limit=limit)
+
+@app.get("/api/jobs/stats")
+async def get_job_stats():
+    return job_runner.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@app.get("/api/jobs/{job_id}/logs")
+async def get_job_logs(job_id: int, after: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=5000)):
+    """增量读取任务日志：下一次请求把返回的 next_seq 作为 after"""
+    return await job_runner.logs(job_id, after, limit)
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    if not await job_runner.cancel(job_id):
+        raise HTTPException(status_code=409, detail="任务不存在或已结束")
+    return {"message": "任务已取消"}
+
+@app.websocket("/ws/jobs")
+async def jobs_websocket(websocket: WebSocket):
+    # 所有任务的状态变化
+    await ws_manager.connect(websocket, topics=['jobs'])
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await ws_manager.disconnect(websocket)
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_websocket(websocket: WebSocket, job_id: int, after: int = 0):
+    # 单个任务的日志、进度和状态，任务结束后关闭连接
+    await websocket.accept()
+    try:
+        async for event in job_runner.follow(job_id, after):
+            await websocket.send_json(event)
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        # 客户端已断开
+        pass
 
 if __name__ == "__main__":
     import uvicorn
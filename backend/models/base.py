@@ -1,104 +1,328 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 import sqlite3
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import queue
+import threading
 import paramiko
 import json
 from datetime import datetime
 
+from services.ssh_pool import open_ssh_client
+
 class Database:
-    def __init__(self, db_path: str):
+    """SQLite数据访问层
+
+    - 一个写连接（SQLite同一时刻只允许一个写者）+ 有界的读连接池
+    - WAL模式，读写互不阻塞；synchronous=NORMAL、mmap、较大的page cache
+    - 连接长期复用，sqlite3模块按连接缓存预编译语句，相同SQL不会重复解析
+    - 提供 a* 异步方法，在专用线程池中执行，不阻塞事件循环
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, executor: Optional[ThreadPoolExecutor] = None,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kb: int = 64 * 1024,
+                 busy_timeout: float = 5.0):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout = busy_timeout
+        # 写者 + 读者各占一个线程
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=pool_size + 1, thread_name_prefix="db"
+        )
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=pool_size)
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
 
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """从读连接池借出一个连接，用完归还"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._reader_lock:
+                if self._reader_count < self.pool_size:
+                    self._reader_count += 1
+                    conn = self._connect()
+            if conn is None:
+                conn = self._readers.get()
         try:
             yield conn
         finally:
-            conn.close()
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
 
-    def execute(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-            return cursor.lastrowid
+    @contextmanager
+    def transaction(self):
+        """独占写连接并在一个事务中执行，正常退出时提交，异常时回滚"""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def execute(self, query: str, params: tuple = ()) -> Optional[int]:
+        with self.transaction() as conn:
+            return conn.execute(query, params).lastrowid
+
+    def execute_rowcount(self, query: str, params: tuple = ()) -> int:
+        with self.transaction() as conn:
+            return conn.execute(query, params).rowcount
+
+    def executemany(self, query: str, seq_of_params) -> int:
+        with self.transaction() as conn:
+            return conn.executemany(query, seq_of_params).rowcount
+
+    def executescript(self, script: str) -> None:
+        with self.transaction() as conn:
+            conn.executescript(script)
 
     def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            row = cursor.fetchone()
+            row = conn.execute(query, params).fetchone()
             return dict(row) if row else None
 
     def fetch_all(self, query: str, params: tuple = ()) -> list[Dict[str, Any]]:
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows] 
+            rows = conn.execute(query, params).fetchall()
+            return [dict(row) for row in rows]
+
+    def fetch_value(self, query: str, params: tuple = ()) -> Any:
+        with self.get_connection() as conn:
+            row = conn.execute(query, params).fetchone()
+            return row[0] if row else None
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在数据库线程池中执行任意同步函数"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def aexecute(self, query: str, params: tuple = ()) -> Optional[int]:
+        return await self.run(self.execute, query, params)
+
+    async def aexecute_rowcount(self, query: str, params: tuple = ()) -> int:
+        return await self.run(self.execute_rowcount, query, params)
+
+    async def aexecutemany(self, query: str, seq_of_params) -> int:
+        return await self.run(self.executemany, query, list(seq_of_params))
+
+    async def afetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
+        return await self.run(self.fetch_one, query, params)
+
+    async def afetch_all(self, query: str, params: tuple = ()) -> list[Dict[str, Any]]:
+        return await self.run(self.fetch_all, query, params)
+
+    async def afetch_value(self, query: str, params: tuple = ()) -> Any:
+        return await self.run(self.fetch_value, query, params)
+
+    def close(self) -> None:
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._reader_lock:
+            self._reader_count = 0
+
+# 单次通道采集脚本：只读取/proc和statvfs，不调用top/ps/free/df等重量级命令
+COLLECT_SCRIPT = (
+    "for f in stat meminfo loadavg uptime net/dev; do echo \"@$f\"; cat /proc/$f; done; "
+    "echo @statvfs; stat -f -c '%S %b %f %a' /; "
+    "echo @procs; set -- /proc/[0-9]*; echo $#"
+)
+
+
+def split_sections(output: str) -> Dict[str, list]:
+    """按 @name 标记拆分采集脚本的输出"""
+    sections: Dict[str, list] = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith('@'):
+            current = line[1:].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return sections
+
+
+def parse_cpu_times(lines: list) -> tuple:
+    """解析/proc/stat的cpu汇总行，返回 (total, idle) jiffies"""
+    for line in lines:
+        if line.startswith('cpu '):
+            values = [int(x) for x in line.split()[1:]]
+            # guest/guest_nice 已计入 user/nice
+            total = sum(values[:8])
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            return total, idle
+    raise ValueError("/proc/stat 缺少cpu行")
+
+
+def parse_snapshot(output: str) -> Dict[str, Any]:
+    """将采集脚本的输出解析为原始计数器"""
+    sections = split_sections(output)
+
+    cpu_total, cpu_idle = parse_cpu_times(sections.get('stat', []))
+
+    meminfo = {}
+    for line in sections.get('meminfo', []):
+        name, _, rest = line.partition(':')
+        if rest:
+            meminfo[name] = int(rest.split()[0])
+    mem_total = meminfo.get('MemTotal', 0)
+    mem_available = meminfo.get(
+        'MemAvailable',
+        meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+    )
+
+    loadavg = sections.get('loadavg', ['0 0 0 0/0 0'])[0].split()
+    threads = int(loadavg[3].split('/')[1]) if len(loadavg) > 3 else 0
+
+    uptime = sections.get('uptime', ['0'])[0].split()
+    uptime = int(float(uptime[0])) if uptime else 0
+
+    # 汇总除lo外所有网卡，不再写死eth0
+    rx_bytes = tx_bytes = 0
+    interfaces = []
+    for line in sections.get('net/dev', []):
+        name, sep, rest = line.partition(':')
+        if not sep:
+            continue
+        name = name.strip()
+        fields = rest.split()
+        if name == 'lo' or len(fields) < 9:
+            continue
+        interfaces.append(name)
+        rx_bytes += int(fields[0])
+        tx_bytes += int(fields[8])
+
+    block_size, blocks, free, avail = (int(x) for x in sections.get('statvfs', ['0 0 0 0'])[0].split())
+    used = blocks - free
+    # 与df的Use%计算方式一致
+    disk_usage = used * 100.0 / (used + avail) if used + avail else 0.0
+
+    procs = sections.get('procs', ['0'])[0].strip()
+
+    return {
+        'cpu_total': cpu_total,
+        'cpu_idle': cpu_idle,
+        'memory_total': mem_total * 1024,
+        'memory_used': (mem_total - mem_available) * 1024,
+        'memory_usage': (mem_total - mem_available) * 100.0 / mem_total if mem_total else 0.0,
+        'disk_total': blocks * block_size,
+        'disk_used': used * block_size,
+        'disk_usage': disk_usage,
+        'load_average': [float(x) for x in loadavg[:3]],
+        'rx_bytes': rx_bytes,
+        'tx_bytes': tx_bytes,
+        'interfaces': interfaces,
+        'process_count': int(procs) if procs.isdigit() else 0,
+        'thread_count': threads,
+        'uptime': uptime,
+    }
+
 
 class ServerMetrics:
-    def __init__(self, host, username, password=None, key_path=None):
+    def __init__(self, host, username, password=None, key_path=None,
+                 server_id=None, ssh_pool=None):
         self.host = host
         self.username = username
         self.password = password
         self.key_path = key_path
-        
-    def get_metrics(self):
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
+        self.server_id = server_id
+        self.ssh_pool = ssh_pool
+        # 上一次采样的CPU计数器，用于按差值计算CPU使用率
+        self._last_cpu = None
+
+    def _server_data(self) -> Dict[str, Any]:
+        return {
+            'id': self.server_id,
+            'ip': self.host,
+            'username': self.username,
+            'auth_type': 'key' if self.key_path else 'password',
+            'password': self.password,
+            'key_path': self.key_path,
+        }
+
+    def collect(self) -> str:
+        """通过一个channel执行采集脚本，返回原始输出"""
+        server_data = self._server_data()
+        if self.ssh_pool is not None:
+            output, _ = self.ssh_pool.exec_command(server_data, COLLECT_SCRIPT)
+            return output
+
+        ssh = open_ssh_client(server_data)
         try:
-            if self.key_path:
-                key = paramiko.RSAKey.from_private_key_file(self.key_path)
-                ssh.connect(self.host, username=self.username, pkey=key)
-            else:
-                ssh.connect(self.host, username=self.username, password=self.password)
-            
-            # 执行命令获取系统信息
-            commands = {
-                'cpu': "top -bn1 | grep 'Cpu(s)' | awk '{print $2}'",
-                'memory': "free | grep Mem | awk '{print $3/$2 * 100.0}'",
-                'disk': "df -h / | tail -1 | awk '{print $5}' | sed 's/%//'",
-                'load': "cat /proc/loadavg",
-                'network': "cat /proc/net/dev | grep eth0",
-                'processes': "ps aux | wc -l; ps -eLf | wc -l"
-            }
-            
-            metrics = {}
-            for key, cmd in commands.items():
-                stdin, stdout, stderr = ssh.exec_command(cmd)
-                metrics[key] = stdout.read().decode().strip()
-            
-            # 解析网络数据
-            network_data = metrics['network'].split()
-            rx_bytes = int(network_data[1])
-            tx_bytes = int(network_data[9])
-            
-            # 解析进程数据
-            processes_data = metrics['processes'].split('\n')
-            total_processes = int(processes_data[0]) - 1  # 减去header
-            total_threads = int(processes_data[1]) - 1
-            
-            return {
-                'metrics': {
-                    'cpu_usage': float(metrics['cpu']),
-                    'memory_usage': float(metrics['memory']),
-                    'disk_usage': float(metrics['disk']),
-                    'load_average': [float(x) for x in metrics['load'].split()[:3]],
-                    'network': {
-                        'rx_bytes': rx_bytes,
-                        'tx_bytes': tx_bytes
-                    },
-                    'processes': {
-                        'total': total_processes,
-                        'threads': total_threads
-                    },
-                    'timestamp': datetime.now().isoformat()
-                }
-            }
-            
+            stdin, stdout, stderr = ssh.exec_command(COLLECT_SCRIPT)
+            return stdout.read().decode()
         finally:
-            ssh.close() 
\ No newline at end of file
+            ssh.close()
+
+    def cpu_usage(self, total: int, idle: int) -> float:
+        """根据两次采样之间的jiffies差值计算CPU使用率；首次采样使用开机以来的平均值"""
+        last = self._last_cpu
+        self._last_cpu = (total, idle)
+        if last is not None and total > last[0]:
+            total_delta = total - last[0]
+            idle_delta = idle - last[1]
+        else:
+            total_delta, idle_delta = total, idle
+        if total_delta <= 0:
+            return 0.0
+        return round((total_delta - idle_delta) * 100.0 / total_delta, 2)
+
+    def get_metrics(self):
+        return self.parse(self.collect())
+
+    def parse(self, output: str) -> Dict[str, Any]:
+        """解析采集脚本的输出；CPU使用率依赖上一次 parse 的计数器"""
+        snapshot = parse_snapshot(output)
+        return {
+            'metrics': {
+                'cpu_usage': self.cpu_usage(snapshot['cpu_total'], snapshot['cpu_idle']),
+                'memory_usage': round(snapshot['memory_usage'], 2),
+                'disk_usage': round(snapshot['disk_usage'], 2),
+                'load_average': snapshot['load_average'],
+                'network': {
+                    'rx_bytes': snapshot['rx_bytes'],
+                    'tx_bytes': snapshot['tx_bytes'],
+                    'interfaces': snapshot['interfaces']
+                },
+                'processes': {
+                    'total': snapshot['process_count'],
+                    'threads': snapshot['thread_count']
+                },
+                'uptime': snapshot['uptime'],
+                'timestamp': datetime.now().isoformat()
+            }
+        }
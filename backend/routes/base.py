@@ -1,17 +1,14 @@
 from fastapi import APIRouter, HTTPException
 from typing import Callable, Any
 import functools
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
-executor = ThreadPoolExecutor()
+from services.scheduler import scheduler, PRIORITY_INTERACTIVE
 
-def async_route(func: Callable) -> Callable:
-    """装饰器：将同步操作转换为异步操作"""
+def async_route(func: Callable, pool: str = 'db') -> Callable:
+    """装饰器：将同步操作转换为异步操作（在统一调度器的线程池中执行）"""
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+        return await scheduler.run(pool, func, *args, priority=PRIORITY_INTERACTIVE, **kwargs)
     return wrapper
 
 class BaseRouter:
@@ -0,0 +1,378 @@
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Callable, Awaitable
+import asyncio
+import copy
+import logging
+import math
+import operator
+import threading
+
+from services.timeseries import METRIC_FIELDS, ROW_SERVER_ID, ROW_FIELDS, ROW_COLLECTED_AT, TIME_FORMAT, utc_now
+from services.wire import to_epoch
+from services.ingest import AfterCommit
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ('threshold', 'sustained', 'rate', 'anomaly')
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+ALERT_RULES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'threshold',
+    operator TEXT NOT NULL DEFAULT '>',
+    value FLOAT NOT NULL,
+    duration INTEGER DEFAULT 0,
+    server_id INTEGER,
+    severity TEXT DEFAULT 'warning',
+    enabled INTEGER DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+)
+"""
+
+# alerts 表原本只有站点告警，指标告警需要的附加列
+ALERT_COLUMNS = (
+    ('server_id', 'INTEGER'),
+    ('rule_id', 'INTEGER'),
+    ('severity', 'TEXT'),
+    ('value', 'FLOAT'),
+    ('resolved_at', 'TIMESTAMP'),
+)
+
+
+def validate_rule(rule: Dict[str, Any]) -> Optional[str]:
+    """返回错误信息，规则合法时返回 None"""
+    if rule['metric'] not in METRIC_FIELDS:
+        return f"不支持的指标: {rule['metric']}，可选: {', '.join(METRIC_FIELDS)}"
+    if rule['kind'] not in RULE_KINDS:
+        return f"不支持的规则类型: {rule['kind']}，可选: {', '.join(RULE_KINDS)}"
+    if rule['operator'] not in OPERATORS:
+        return f"不支持的比较运算符: {rule['operator']}"
+    if (rule.get('duration') or 0) < 0:
+        return "duration 不能为负数"
+    if rule['kind'] in ('sustained', 'anomaly') and not rule.get('duration'):
+        return f"{rule['kind']} 规则需要设置 duration（秒）"
+    return None
+
+
+class _Rule:
+    __slots__ = ('id', 'name', 'metric', 'kind', 'operator', 'compare', 'value', 'duration',
+                 'server_id', 'severity')
+
+    def __init__(self, row: Dict[str, Any]):
+        self.id = row['id']
+        self.name = row['name']
+        self.metric = row['metric']
+        self.kind = row['kind']
+        self.operator = row['operator']
+        self.compare = OPERATORS[row['operator']]
+        self.value = row['value']
+        self.duration = row['duration'] or 0
+        self.server_id = row['server_id']
+        self.severity = row['severity'] or 'warning'
+
+    def signature(self) -> Tuple:
+        return (self.metric, self.kind, self.operator, self.value, self.duration, self.server_id)
+
+
+class _State:
+    """每个 (规则, 服务器) 的滚动状态，大小固定，与样本数量和时间窗口无关"""
+    __slots__ = ('since', 'last_value', 'last_time', 'rate', 'mean', 'var', 'samples', 'alert_id')
+
+    def __init__(self):
+        self.since: Optional[float] = None
+        self.last_value: Optional[float] = None
+        self.last_time: Optional[float] = None
+        self.rate: Optional[float] = None
+        self.mean: Optional[float] = None
+        self.var = 0.0
+        self.samples = 0
+        self.alert_id: Optional[int] = None
+
+
+class _Pending:
+    """一次写入钩子调用暂存的状态变化和事件，事务提交后才生效"""
+    __slots__ = ('states', 'events', 'samples', 'fired', 'resolved')
+
+    def __init__(self):
+        self.states: Dict[Tuple[int, int], Tuple[_Rule, _State]] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.samples = 0
+        self.fired = 0
+        self.resolved = 0
+
+
+def decay(dt: float, duration: float) -> float:
+    """时间常数为 duration 秒的指数加权系数，样本间隔不均匀时也成立"""
+    return 1 - math.exp(-dt / duration) if duration > 0 else 1.0
+
+
+class AlertEngine:
+    """指标告警规则的流式求值
+
+    作为 metrics 写入管道的钩子，对每个新样本增量求值，不回查历史数据：
+    - threshold：样本值满足 operator value 时触发
+    - sustained：条件持续满足 duration 秒后触发（只记录开始满足的时间）
+    - rate：每分钟变化量的指数加权平均（时间常数 duration 秒，0 表示只看相邻两个样本）满足条件时触发
+    - anomaly：与指数加权均值的偏离超过 value 个标准差时触发（时间常数 duration 秒，前 warmup 个样本只学习）
+    每个 (规则, 服务器) 同时最多一条 active 告警，条件不再满足时标记为 resolved；
+    触发和恢复都写入 alerts 表（与样本同一事务），并通过 publish 推送给WebSocket订阅者。
+    求值在状态副本上进行，滚动状态、计数和推送都在事务提交后才生效，回滚时整体丢弃；
+    同一事务中后续的钩子调用（如逐行重试）能看到之前尚未提交的暂存状态。
+    提交回调在写锁释放后执行，可能与 load() 并发，规则和状态由 _lock 保护。
+    """
+
+    def __init__(self, db, publish: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 warmup: int = 30):
+        self.db = db
+        self.publish = publish
+        self.warmup = warmup
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 保护 _rules/_global/_by_server/_states
+        self._lock = threading.Lock()
+        self._global: List[_Rule] = []
+        self._by_server: Dict[int, List[_Rule]] = {}
+        self._rules: Dict[int, _Rule] = {}
+        self._states: Dict[Tuple[int, int], _State] = {}
+        # 已执行但所在事务尚未提交的钩子调用，按调用顺序
+        self._uncommitted: List[_Pending] = []
+
+        self.samples = 0
+        self.fired = 0
+        self.resolved = 0
+
+    def create_schema(self) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(ALERT_RULES_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(alerts)")}
+            for column, definition in ALERT_COLUMNS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE alerts ADD COLUMN {column} {definition}")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alerts_rule_server
+                ON alerts (rule_id, server_id, status)
+            """)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_event_loop()
+
+    # ---- 规则 ----
+
+    def load(self) -> None:
+        """重新加载规则；参数未变化的规则保留滚动状态，已删除或停用的规则的 active 告警被关闭"""
+        with self.db.transaction() as conn:
+            rules = {row['id']: _Rule(dict(row)) for row in conn.execute(
+                "SELECT * FROM alert_rules WHERE enabled = 1")}
+            active = conn.execute("""
+                SELECT id, rule_id, server_id FROM alerts
+                WHERE rule_id IS NOT NULL AND status = 'active'
+            """).fetchall()
+            by_server: Dict[int, List[_Rule]] = {}
+            for rule in rules.values():
+                if rule.server_id is not None:
+                    by_server.setdefault(rule.server_id, []).append(rule)
+
+            # 清理状态和切换规则在同一个锁内完成，提交回调不会把旧规则的状态写回
+            with self._lock:
+                for rule_id, rule in rules.items():
+                    previous = self._rules.get(rule_id)
+                    if previous is not None and previous.signature() != rule.signature():
+                        self._drop_states(conn, rule_id)
+                for rule_id in set(self._rules) - set(rules):
+                    self._drop_states(conn, rule_id)
+
+                # 重启后恢复去重状态，避免对仍在告警的服务器重复产生告警
+                for alert_id, rule_id, server_id in active:
+                    if rule_id not in rules:
+                        self._resolve(conn, alert_id)
+                        continue
+                    state = self._states.get((rule_id, server_id))
+                    if state is None:
+                        state = self._states[(rule_id, server_id)] = _State()
+                    state.alert_id = alert_id
+
+                self._global = [rule for rule in rules.values() if rule.server_id is None]
+                self._by_server = by_server
+                self._rules = rules
+
+    def _drop_states(self, conn, rule_id: int) -> None:
+        # 调用方需持有 self._lock
+        for key in [key for key in self._states if key[0] == rule_id]:
+            state = self._states.pop(key)
+            if state.alert_id is not None:
+                self._resolve(conn, state.alert_id)
+
+    @staticmethod
+    def _resolve(conn, alert_id: int) -> None:
+        conn.execute("UPDATE alerts SET status = 'resolved', resolved_at = ? WHERE id = ?",
+                     (utc_now().strftime(TIME_FORMAT), alert_id))
+
+    # ---- 求值 ----
+
+    def _evaluate(self, rule: _Rule, state: _State, value: float, t: float) -> Optional[bool]:
+        """返回是否满足告警条件，数据不足时返回 None"""
+        if rule.kind == 'threshold':
+            return rule.compare(value, rule.value)
+
+        if rule.kind == 'sustained':
+            if not rule.compare(value, rule.value):
+                state.since = None
+                return False
+            if state.since is None:
+                state.since = t
+            return t - state.since >= rule.duration
+
+        if state.last_time is not None and t <= state.last_time:
+            # 乱序或重复的样本不参与变化率和统计量计算
+            return None
+        dt = t - state.last_time if state.last_time is not None else None
+
+        if rule.kind == 'rate':
+            previous = state.last_value
+            state.last_value, state.last_time = value, t
+            if dt is None:
+                return None
+            rate = (value - previous) / dt * 60
+            if state.rate is None:
+                state.rate = rate
+            else:
+                state.rate += decay(dt, rule.duration) * (rate - state.rate)
+            return rule.compare(state.rate, rule.value)
+
+        # anomaly：先用更新前的均值和方差计算偏离，异常值不会掩盖自己
+        state.last_time = t
+        if state.mean is None:
+            state.mean = value
+            state.samples = 1
+            return None
+        deviation = value - state.mean
+        std = max(math.sqrt(state.var), abs(state.mean) * 0.01, 1e-6)
+        z = abs(deviation) / std
+        alpha = decay(dt, rule.duration)
+        increment = alpha * deviation
+        state.mean += increment
+        state.var = (1 - alpha) * (state.var + deviation * increment)
+        state.samples += 1
+        if state.samples <= self.warmup:
+            return None
+        return rule.compare(z, rule.value)
+
+    def _staged_state(self, pending: _Pending, rule: _Rule, server_id: int) -> _State:
+        """取 (规则, 服务器) 的状态副本：优先使用尚未提交的暂存状态"""
+        key = (rule.id, server_id)
+        staged = pending.states.get(key)
+        if staged is not None:
+            return staged[1]
+        for layer in reversed(self._uncommitted):
+            if key in layer.states:
+                state = copy.copy(layer.states[key][1])
+                break
+        else:
+            with self._lock:
+                base = self._states.get(key)
+                state = copy.copy(base) if base is not None else _State()
+        pending.states[key] = (rule, state)
+        return state
+
+    def apply(self, conn, rows: Iterable[Tuple]) -> Optional[AfterCommit]:
+        """IngestPipeline 的写入钩子：逐个样本求值，告警与样本在同一事务中写入
+
+        返回的 AfterCommit 在提交后应用状态变化并推送事件，回滚时丢弃。
+        """
+        if not self._rules:
+            return None
+        pending = _Pending()
+        events = pending.events
+        now = utc_now().strftime(TIME_FORMAT)
+        for row in rows:
+            server_id = row[ROW_SERVER_ID]
+            rules = self._global + self._by_server.get(server_id, [])
+            if not rules:
+                continue
+            t = to_epoch(row[ROW_COLLECTED_AT])
+            pending.samples += 1
+            for rule in rules:
+                value = row[ROW_FIELDS[rule.metric]]
+                if value is None:
+                    continue
+                state = self._staged_state(pending, rule, server_id)
+                firing = self._evaluate(rule, state, value, t)
+                if firing and state.alert_id is None:
+                    message = (f"{rule.name}: 服务器 {server_id} {rule.metric}={value:.2f} "
+                               f"({rule.kind} {rule.operator} {rule.value})")
+                    state.alert_id = conn.execute("""
+                        INSERT INTO alerts (type, message, status, created_at, server_id, rule_id, severity, value)
+                        VALUES ('metric', ?, 'active', ?, ?, ?, ?, ?)
+                    """, (message, now, server_id, rule.id, rule.severity, value)).lastrowid
+                    pending.fired += 1
+                    events.append({'type': 'alert', 'event': 'fired', 'id': state.alert_id,
+                                   'server_id': server_id, 'rule_id': rule.id, 'severity': rule.severity,
+                                   'metric': rule.metric, 'value': value, 'message': message})
+                elif firing is False and state.alert_id is not None:
+                    self._resolve(conn, state.alert_id)
+                    pending.resolved += 1
+                    events.append({'type': 'alert', 'event': 'resolved', 'id': state.alert_id,
+                                   'server_id': server_id, 'rule_id': rule.id, 'severity': rule.severity,
+                                   'metric': rule.metric, 'value': value})
+                    state.alert_id = None
+        if not pending.samples:
+            return None
+        self._uncommitted.append(pending)
+        return AfterCommit(lambda: self._commit(pending), lambda: self._discard(pending))
+
+    def _commit(self, pending: _Pending) -> None:
+        self._discard(pending)
+        with self._lock:
+            for key, (rule, state) in pending.states.items():
+                # 事务执行期间规则被修改或删除（load 已清理其状态），暂存状态作废
+                current = self._rules.get(rule.id)
+                if current is not None and current.signature() == rule.signature():
+                    self._states[key] = state
+            self.samples += pending.samples
+            self.fired += pending.fired
+            self.resolved += pending.resolved
+        if pending.events:
+            self._emit(pending.events)
+
+    def _discard(self, pending: _Pending) -> None:
+        try:
+            self._uncommitted.remove(pending)
+        except ValueError:
+            pass
+
+    def _emit(self, events: List[Dict[str, Any]]) -> None:
+        # 提交回调在数据库线程中执行，推送交给事件循环
+        if self.publish is None or self._loop is None:
+            return
+
+        async def publish_all():
+            for event in events:
+                try:
+                    await self.publish(event)
+                except Exception as e:
+                    logger.error(f"推送告警失败: {str(e)}")
+
+        try:
+            asyncio.run_coroutine_threadsafe(publish_all(), self._loop)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出中）
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'rules': len(self._rules),
+                'states': len(self._states),
+                'active': sum(1 for state in self._states.values() if state.alert_id is not None),
+                'samples': self.samples,
+                'fired': self.fired,
+                'resolved': self.resolved,
+            }
@@ -0,0 +1,272 @@
+from typing import Dict, Any, Optional, List, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from models.base import ServerMetrics, COLLECT_SCRIPT
+from services.ingest import IngestQueueFull
+from services.scheduler import PRIORITY_BACKGROUND
+from services.timeseries import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+# 本机由 LocalMetricsSampler 采样，不通过SSH采集
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class _Target:
+    def __init__(self, server: Dict[str, Any], interval: float):
+        self.server = server
+        self.interval = interval
+        self.metrics = ServerMetrics(
+            server['ip'], server['username'], server.get('password'), server.get('key_path'),
+            server_id=server['id'],
+        )
+        self.next_due = 0.0
+        self.failures = 0
+        self.status = server.get('status')
+        self.last_network: Optional[Tuple[int, int, float]] = None
+        self.last_error: Optional[str] = None
+        # 最近一次成功采集的指标及其Unix时间
+        self.latest: Optional[Dict[str, Any]] = None
+        self.latest_at: Optional[float] = None
+
+
+class FleetCollector:
+    """对 servers 表中的所有服务器定时采集指标（无需安装agent）
+
+    - 每台服务器有自己的采集间隔（servers.collect_interval，未设置时用 default_interval），
+      每次调度在间隔上叠加 ±jitter 的随机抖动，首次采集时间在一个间隔内随机分布，避免同时发起
+    - 连续失败时按 2^n 退避，最长 max_backoff 秒，恢复后回到正常间隔
+    - 全局并发由信号量限制；命令经传输后端在后台优先级通道执行，复用池化的SSH会话
+    - 结果通过批量写入管道写入 server_metrics，servers.status 只在状态变化时更新
+    """
+
+    def __init__(self, db, transport, ingest, default_interval: float = 60, jitter: float = 0.1,
+                 max_backoff: float = 900, max_concurrency: int = 32, timeout: float = 20,
+                 refresh_interval: float = 60, unreachable_after: int = 2):
+        self.db = db
+        self.transport = transport
+        self.ingest = ingest
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        self.unreachable_after = unreachable_after
+
+        self._targets: Dict[int, _Target] = {}
+        self._due: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._tasks: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.polls = 0
+        self.failures = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+        self._total_poll_ms = 0.0
+
+    def _schedule(self, target: _Target, now: float, delay: Optional[float] = None) -> None:
+        if delay is None:
+            if target.failures:
+                delay = min(target.interval * 2 ** target.failures, self.max_backoff)
+            else:
+                delay = target.interval
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        target.next_due = now + delay
+        heapq.heappush(self._due, (target.next_due, next(self._seq), target.server['id']))
+
+    async def refresh(self) -> None:
+        """同步服务器列表：新增的加入调度，删除的移除，连接信息变化的更新"""
+        servers = await self.db.afetch_all("SELECT * FROM servers")
+        now = time.monotonic()
+        seen = set()
+        for server in servers:
+            if server['ip'] in LOCAL_HOSTS:
+                continue
+            seen.add(server['id'])
+            interval = float(server.get('collect_interval') or self.default_interval)
+            target = self._targets.get(server['id'])
+            if target is None:
+                target = self._targets[server['id']] = _Target(server, interval)
+                self._schedule(target, now, delay=random.uniform(0, interval))
+                continue
+            if (server['ip'], server['username'], server.get('password'), server.get('key_path')) != (
+                    target.server['ip'], target.server['username'],
+                    target.server.get('password'), target.server.get('key_path')):
+                target.metrics = _Target(server, interval).metrics
+                target.failures = 0
+            target.server = server
+            target.interval = interval
+        for server_id in list(self._targets):
+            if server_id not in seen:
+                del self._targets[server_id]
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        limit = asyncio.Semaphore(self.max_concurrency)
+        next_refresh = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_refresh:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"刷新采集服务器列表失败: {str(e)}")
+                next_refresh = now + self.refresh_interval
+
+            # 丢弃已删除服务器或已被重新调度的过期条目
+            while self._due:
+                due, _, server_id = self._due[0]
+                target = self._targets.get(server_id)
+                if target is not None and target.next_due == due:
+                    break
+                heapq.heappop(self._due)
+
+            wait_until = min(self._due[0][0], next_refresh) if self._due else next_refresh
+            delay = wait_until - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not self._due or self._due[0][0] > time.monotonic():
+                continue
+            due, _, server_id = heapq.heappop(self._due)
+            await limit.acquire()
+            self.max_lag = max(self.max_lag, time.monotonic() - due)
+            task = asyncio.create_task(self._poll(self._targets[server_id], limit))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _poll(self, target: _Target, limit: asyncio.Semaphore) -> None:
+        start = time.perf_counter()
+        try:
+            output, _, _ = await asyncio.wait_for(
+                self.transport.exec(target.server, COLLECT_SCRIPT, timeout=self.timeout,
+                                    priority=PRIORITY_BACKGROUND),
+                self.timeout * 2,
+            )
+            metrics = target.metrics.parse(output)['metrics']
+            row = self._row(target, metrics)
+            # 网络字段与本机采样器一致：rx/tx_bytes 为速率，*_total 为累计量
+            target.latest = {**metrics, 'network': {
+                'rx_bytes': row[4], 'tx_bytes': row[5],
+                'rx_bytes_total': metrics['network']['rx_bytes'],
+                'tx_bytes_total': metrics['network']['tx_bytes'],
+            }}
+            target.latest_at = time.time()
+            target.failures = 0
+            target.last_error = None
+        except asyncio.CancelledError:
+            limit.release()
+            raise
+        except Exception as e:
+            row = None
+            target.failures += 1
+            target.last_error = str(e) or type(e).__name__
+            self.failures += 1
+            logger.warning(f"采集服务器 {target.server['id']} 指标失败（第{target.failures}次）: {target.last_error}")
+        finally:
+            self.polls += 1
+            self._total_poll_ms += (time.perf_counter() - start) * 1000
+
+        limit.release()
+        if self._targets.get(target.server['id']) is target:
+            self._schedule(target, time.monotonic())
+            self._wakeup.set()
+
+        try:
+            if row is not None:
+                await self.ingest.submit('metrics', [row])
+        except IngestQueueFull:
+            self.dropped += 1
+            logger.warning(f"写入队列已满，丢弃服务器 {target.server['id']} 的一次采样")
+
+        if row is not None:
+            status = 'active'
+        elif target.failures >= self.unreachable_after:
+            status = 'unreachable'
+        else:
+            status = target.status
+        if status != target.status:
+            target.status = status
+            try:
+                await self.db.aexecute("UPDATE servers SET status = ? WHERE id = ?",
+                                       (status, target.server['id']))
+            except Exception as e:
+                logger.error(f"更新服务器状态失败: {str(e)}")
+
+    def _row(self, target: _Target, metrics: Dict[str, Any]) -> tuple:
+        # 网络流量按两次采样之间的字节差计算速率（字节/秒），首次采样为0
+        now = time.monotonic()
+        rx, tx = metrics['network']['rx_bytes'], metrics['network']['tx_bytes']
+        network_in = network_out = 0.0
+        last = target.last_network
+        if last is not None and now > last[2] and rx >= last[0] and tx >= last[1]:
+            network_in = round((rx - last[0]) / (now - last[2]), 2)
+            network_out = round((tx - last[1]) / (now - last[2]), 2)
+        target.last_network = (rx, tx, now)
+        return (
+            target.server['id'], metrics['cpu_usage'], metrics['memory_usage'], metrics['disk_usage'],
+            network_in, network_out, ' '.join(str(x) for x in metrics['load_average']),
+            metrics['processes']['total'], metrics['uptime'], utc_now().strftime(TIME_FORMAT),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'targets': len(self._targets),
+            'in_flight': len(self._tasks),
+            'polls': self.polls,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'backing_off': sum(1 for t in self._targets.values() if t.failures),
+            'unreachable': sum(1 for t in self._targets.values() if t.status == 'unreachable'),
+            'avg_poll_ms': round(self._total_poll_ms / self.polls, 3) if self.polls else 0,
+            'max_lag_ms': round(self.max_lag * 1000, 3),
+        }
+
+    def latest(self, server_id: int) -> Optional[Tuple[Dict[str, Any], float, float]]:
+        """最近一次成功采集的 (指标, Unix时间, 采集间隔)，尚未采集成功时返回 None"""
+        target = self._targets.get(server_id)
+        if target is None or target.latest is None:
+            return None
+        return target.latest, target.latest_at, target.interval
+
+    def target_state(self, server_id: int) -> Optional[Dict[str, Any]]:
+        target = self._targets.get(server_id)
+        if target is None:
+            return None
+        return {
+            'interval': target.interval,
+            'next_in': round(target.next_due - time.monotonic(), 3),
+            'failures': target.failures,
+            'status': target.status,
+            'last_error': target.last_error,
+        }
@@ -0,0 +1,219 @@
+from typing import Dict, Any, Optional, Iterable, Tuple, List
+import logging
+import sqlite3
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 列表中每条记录只返回输出的前 PREVIEW_CHARS 个字符
+PREVIEW_CHARS = 200
+
+# 列表接口返回的列（不含完整输出）
+SUMMARY_COLUMNS = "id, server_id, command, status, executed_at, output_bytes, preview"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    return f"{row['executed_at']},{row['id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    executed_at, _, log_id = cursor.rpartition(',')
+    try:
+        return executed_at, int(log_id)
+    except ValueError:
+        raise InvalidCursor("无效的分页游标")
+
+
+def fts_query(text: str) -> str:
+    """用户输入的每个词按字面匹配（加引号），避免 FTS5 语法错误，词之间为 AND"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+class CommandLogStore:
+    """命令执行记录存储
+
+    - 列表只返回摘要（命令、状态、输出大小、前 PREVIEW_CHARS 个字符），完整输出按 id 单独获取
+    - 按 (executed_at, id) 游标分页，走 (server_id, executed_at) 索引，翻页代价与页数无关
+    - 超过 compress_min_bytes 的输出用 zlib 压缩存入 result_compressed，result 置空
+    - command_logs_fts 为无内容(contentless)的 FTS5 索引，覆盖命令和输出，rowid 与 command_logs.id 相同
+    """
+
+    def __init__(self, db, compress_min_bytes: int = 4096, compress_level: int = 6,
+                 migrate_batch: int = 500):
+        self.db = db
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.migrate_batch = migrate_batch
+        self.fts_enabled = True
+
+    # ---- 表结构 ----
+
+    def create_schema(self) -> None:
+        with self.db.transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(command_logs)")}
+            for column, definition in (('output_bytes', 'INTEGER'), ('preview', 'TEXT'),
+                                       ('result_compressed', 'BLOB')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE command_logs ADD COLUMN {column} {definition}")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_command_logs_server_time
+                ON command_logs (server_id, executed_at)
+            """)
+
+            try:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'command_logs_fts'"
+                ).fetchone()
+                if not exists:
+                    conn.execute("""
+                        CREATE VIRTUAL TABLE command_logs_fts
+                        USING fts5(command, output, content='')
+                    """)
+            except sqlite3.OperationalError as e:
+                # SQLite 未编译 FTS5 时只支持按命令 LIKE 搜索
+                self.fts_enabled = False
+                exists = True
+                logger.warning(f"FTS5 不可用，命令记录搜索退化为LIKE: {str(e)}")
+
+        if not exists:
+            self._reindex()
+        self._migrate()
+
+    def _in_batches(self, sql: str, handle) -> int:
+        """按 id 键集分页读取（sql 以 id > ? 为条件、ORDER BY id LIMIT ?），每批调用 handle(conn, rows) 并提交
+
+        不会一次把所有输出读入内存，也不会长时间占用写连接。返回处理的行数。
+        """
+        last_id = total = 0
+        while True:
+            with self.db.transaction() as conn:
+                rows = conn.execute(sql, (last_id, self.migrate_batch)).fetchall()
+                if rows:
+                    handle(conn, rows)
+            if not rows:
+                return total
+            total += len(rows)
+            last_id = rows[-1][0]
+
+    def _migrate(self) -> None:
+        """为旧记录补充摘要字段，压缩大输出，并建立全文索引
+
+        output_bytes 为空的记录即未迁移的旧记录，中途退出后下次启动从剩余的记录继续。
+        """
+        def migrate(conn, rows) -> None:
+            for log_id, command, result in rows:
+                result = result or ''
+                stored, compressed = self._pack(result)
+                conn.execute("""
+                    UPDATE command_logs SET output_bytes = ?, preview = ?, result = ?, result_compressed = ?
+                    WHERE id = ?
+                """, (len(result.encode()), result[:PREVIEW_CHARS], stored, compressed, log_id))
+                if self.fts_enabled:
+                    conn.execute("INSERT INTO command_logs_fts (rowid, command, output) VALUES (?, ?, ?)",
+                                 (log_id, command, result))
+
+        total = self._in_batches("""
+            SELECT id, command, result FROM command_logs
+            WHERE id > ? AND output_bytes IS NULL ORDER BY id LIMIT ?
+        """, migrate)
+        if total:
+            logger.info(f"已迁移命令执行记录: {total}")
+
+    def _reindex(self) -> None:
+        """为已迁移的记录重建全文索引（未迁移的记录在 _migrate 中建立索引）"""
+        def index(conn, rows) -> None:
+            conn.executemany("INSERT INTO command_logs_fts (rowid, command, output) VALUES (?, ?, ?)",
+                             [(log_id, command, self._unpack(result, compressed))
+                              for log_id, command, result, compressed in rows])
+
+        self._in_batches("""
+            SELECT id, command, result, result_compressed FROM command_logs
+            WHERE id > ? AND output_bytes IS NOT NULL ORDER BY id LIMIT ?
+        """, index)
+
+    # ---- 写入 ----
+
+    def _pack(self, output: str) -> Tuple[Optional[str], Optional[bytes]]:
+        data = output.encode()
+        if len(data) < self.compress_min_bytes:
+            return output, None
+        return None, zlib.compress(data, self.compress_level)
+
+    @staticmethod
+    def _unpack(result: Optional[str], compressed: Optional[bytes]) -> str:
+        if compressed is not None:
+            return zlib.decompress(compressed).decode(errors='replace')
+        return result or ''
+
+    def add_many(self, entries: Iterable[Tuple[int, str, str, str]]) -> int:
+        """写入 (server_id, command, output, status)，记录与全文索引在同一事务中"""
+        count = 0
+        with self.db.transaction() as conn:
+            for server_id, command, output, status in entries:
+                output = output or ''
+                stored, compressed = self._pack(output)
+                log_id = conn.execute("""
+                    INSERT INTO command_logs
+                    (server_id, command, result, status, output_bytes, preview, result_compressed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (server_id, command, stored, status, len(output.encode()),
+                      output[:PREVIEW_CHARS], compressed)).lastrowid
+                if self.fts_enabled:
+                    conn.execute("INSERT INTO command_logs_fts (rowid, command, output) VALUES (?, ?, ?)",
+                                 (log_id, command, output))
+                count += 1
+        return count
+
+    async def add(self, server_id: int, command: str, output: str, status: str) -> None:
+        await self.db.run(self.add_many, [(server_id, command, output, status)])
+
+    async def aadd_many(self, entries: Iterable[Tuple[int, str, str, str]]) -> int:
+        return await self.db.run(self.add_many, list(entries))
+
+    # ---- 查询 ----
+
+    async def page(self, server_id: int, limit: int = 50, cursor: Optional[str] = None,
+                   status: Optional[str] = None, q: Optional[str] = None) -> Dict[str, Any]:
+        """按时间倒序分页返回摘要；q 不为空时全文搜索命令和输出"""
+        conditions = ["l.server_id = ?"]
+        params: List[Any] = [server_id]
+        if cursor:
+            conditions.append("(l.executed_at, l.id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        if status:
+            conditions.append("l.status = ?")
+            params.append(status)
+
+        source = "command_logs l"
+        if q and q.strip():
+            if self.fts_enabled:
+                source = "command_logs_fts f JOIN command_logs l ON l.id = f.rowid"
+                conditions.append("command_logs_fts MATCH ?")
+                params.append(fts_query(q))
+            else:
+                conditions.append("l.command LIKE ?")
+                params.append(f"%{q.strip()}%")
+
+        columns = ', '.join(f"l.{column.strip()}" for column in SUMMARY_COLUMNS.split(','))
+        rows = await self.db.afetch_all(f"""
+            SELECT {columns} FROM {source}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY l.executed_at DESC, l.id DESC
+            LIMIT ?
+        """, (*params, limit + 1))
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {'items': rows[:limit], 'next_cursor': next_cursor}
+
+    async def get(self, server_id: int, log_id: int) -> Optional[Dict[str, Any]]:
+        row = await self.db.afetch_one("""
+            SELECT * FROM command_logs WHERE id = ? AND server_id = ?
+        """, (log_id, server_id))
+        if row is None:
+            return None
+        row['result'] = self._unpack(row['result'], row.pop('result_compressed'))
+        return row
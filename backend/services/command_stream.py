@@ -0,0 +1,106 @@
+from typing import Dict, Any, Optional, AsyncIterator
+import asyncio
+import codecs
+import logging
+
+from services.ssh_pool import CommandTimeout
+from services.scheduler import PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+class OutputCapture:
+    """只保留输出的开头和结尾各一部分，用于写入 command_logs"""
+
+    def __init__(self, head_bytes: int = 64 * 1024, tail_bytes: int = 64 * 1024):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.has_stderr = False
+
+    def feed(self, stream: str, data: bytes) -> None:
+        self.total += len(data)
+        if stream == 'stderr':
+            self.has_stderr = True
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def truncated(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode('utf-8', errors='replace')
+        if not self.tail:
+            return head
+        tail = self.tail.decode('utf-8', errors='replace')
+        if self.truncated:
+            return f"{head}\n... [省略 {self.truncated} 字节] ...\n{tail}"
+        return head + tail
+
+
+async def stream_command_events(transport, server_data: Dict[str, Any], command: str,
+                                capture: OutputCapture, timeout: Optional[float] = None,
+                                cancel: Optional[asyncio.Event] = None,
+                                max_pending: int = 256,
+                                priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[Dict[str, Any]]:
+    """通过传输后端执行命令，把输出块以事件形式逐个产出
+
+    事件：{'type': 'output', 'stream': 'stdout'|'stderr', 'data': str}
+    最后一个事件：{'type': 'exit', 'status': 'success'|'error'|'timeout'|'cancelled', 'exit_code': int|None}
+    事件队列有上限，消费者跟不上时读取随之暂停，避免输出堆积在内存中。
+    cancel 被设置或调用方提前停止迭代时取消命令。
+    """
+    events: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    decoders = {
+        'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+        'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+    }
+
+    async def on_output(stream: str, data: bytes) -> None:
+        capture.feed(stream, data)
+        text = decoders[stream].decode(data)
+        if text:
+            await events.put({'type': 'output', 'stream': stream, 'data': text})
+
+    execution = asyncio.ensure_future(transport.run(server_data, command, on_output, timeout, priority))
+
+    async def produce() -> None:
+        exit_code = None
+        try:
+            exit_code = await execution
+            status = 'success' if exit_code == 0 else 'error'
+        except CommandTimeout:
+            status = 'timeout'
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        except Exception as e:
+            capture.feed('stderr', str(e).encode())
+            await events.put({'type': 'output', 'stream': 'stderr', 'data': str(e)})
+            status = 'error'
+        await events.put({'type': 'exit', 'status': status, 'exit_code': exit_code})
+
+    producer = asyncio.ensure_future(produce())
+    watcher = asyncio.ensure_future(cancel.wait()) if cancel is not None else None
+    if watcher is not None:
+        watcher.add_done_callback(lambda _: execution.cancel())
+    try:
+        while True:
+            event = await events.get()
+            yield event
+            if event['type'] == 'exit':
+                break
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        execution.cancel()
+        producer.cancel()
+        await asyncio.gather(execution, producer, return_exceptions=True)
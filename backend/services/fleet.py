@@ -0,0 +1,112 @@
+from typing import Dict, Any, List, Optional, AsyncIterator
+import asyncio
+import logging
+import time
+
+from services.ssh_pool import CommandTimeout
+from services.command_stream import OutputCapture
+
+logger = logging.getLogger(__name__)
+
+
+def parse_tags(tags: Optional[str]) -> List[str]:
+    """servers.tags 为逗号分隔的标签列表"""
+    return [tag.strip() for tag in (tags or '').split(',') if tag.strip()]
+
+
+class FleetExecutor:
+    """在多台服务器上并发执行同一条命令
+
+    并发数由信号量限制（不超过 max_concurrency），每台主机有独立的超时；
+    结果按完成顺序逐个产出，最后产出汇总。命令经由传输后端执行，会话复用，重复执行不再重新握手。
+    """
+
+    def __init__(self, transport, max_concurrency: int = 64,
+                 head_bytes: int = 8192, tail_bytes: int = 8192):
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.runs = 0
+        self.hosts = 0
+        self.running = 0
+
+    async def _run_host(self, server: Dict[str, Any], command: str,
+                        timeout: Optional[float]) -> Dict[str, Any]:
+        capture = OutputCapture(self.head_bytes, self.tail_bytes)
+
+        async def on_output(stream: str, data: bytes) -> None:
+            capture.feed(stream, data)
+
+        exit_code = None
+        start = time.perf_counter()
+        try:
+            exit_code = await self.transport.run(server, command, on_output, timeout)
+            status = 'success' if exit_code == 0 else 'error'
+        except CommandTimeout:
+            status = 'timeout'
+        except Exception as e:
+            capture.feed('stderr', str(e).encode())
+            status = 'error'
+        return {
+            'type': 'result',
+            'server_id': server['id'],
+            'name': server.get('name'),
+            'ip': server.get('ip'),
+            'status': status,
+            'exit_code': exit_code,
+            'output': capture.text(),
+            'truncated': capture.truncated,
+            'duration': round(time.perf_counter() - start, 3),
+        }
+
+    async def run(self, servers: List[Dict[str, Any]], command: str,
+                  concurrency: int = 16, timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """按完成顺序产出每台主机的结果，最后产出 {'type': 'summary', ...}
+
+        调用方提前停止迭代（如客户端断开）时，未开始的主机不再执行，执行中的命令被取消。
+        """
+        limit = asyncio.Semaphore(max(1, min(concurrency, self.max_concurrency)))
+        self.runs += 1
+
+        async def run_one(server: Dict[str, Any]) -> Dict[str, Any]:
+            async with limit:
+                self.running += 1
+                try:
+                    return await self._run_host(server, command, timeout)
+                finally:
+                    self.running -= 1
+
+        start = time.perf_counter()
+        counts: Dict[str, int] = {}
+        slowest = None
+        tasks = [asyncio.ensure_future(run_one(server)) for server in servers]
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                self.hosts += 1
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                if slowest is None or result['duration'] > slowest['duration']:
+                    slowest = result
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        yield {
+            'type': 'summary',
+            'total': len(servers),
+            'statuses': counts,
+            'success': counts.get('success', 0),
+            'failed': len(servers) - counts.get('success', 0),
+            'duration': round(time.perf_counter() - start, 3),
+            'slowest': {'server_id': slowest['server_id'], 'duration': slowest['duration']} if slowest else None,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'runs': self.runs,
+            'hosts': self.hosts,
+            'running': self.running,
+            'max_concurrency': self.max_concurrency,
+        }
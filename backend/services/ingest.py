@@ -0,0 +1,300 @@
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Callable
+import asyncio
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """写入队列已满，调用方应返回429让客户端稍后重试"""
+
+
+def is_transient(error: Exception) -> bool:
+    """数据库被锁或繁忙：稍后重试即可成功，不是数据本身的问题"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+class AfterCommit:
+    """写入钩子返回的提交后操作：事务提交后调用 commit；
+    钩子所在的 SAVEPOINT 或整个事务回滚时调用 discard，用于丢弃钩子暂存的内存状态"""
+
+    __slots__ = ('commit', 'discard')
+
+    def __init__(self, commit: Callable[[], None], discard: Optional[Callable[[], None]] = None):
+        self.commit = commit
+        self.discard = discard
+
+    def __call__(self) -> None:
+        self.commit()
+
+
+def discard_callbacks(callbacks: Iterable[Callable]) -> None:
+    for callback in reversed(list(callbacks)):
+        discard = getattr(callback, 'discard', None)
+        if discard is None:
+            continue
+        try:
+            discard()
+        except Exception as e:
+            logger.error(f"回滚后回调失败: {str(e)}")
+
+
+class IngestPipeline:
+    """批量合并写入的数据接入管道
+
+    接口层只把行放进内存队列并立即返回；后台任务在积累到 max_batch 行
+    或距上次刷新超过 flush_interval 秒时，把所有待写入的行按类型分组，
+    用 executemany 在同一个事务中写入（一次fsync）。
+    每种类型在各自的 SAVEPOINT 中写入，某种类型失败时只回滚该类型并逐行重试，
+    只丢弃出错的行（计入 rows_failed）；数据库被锁等临时错误时整批放回队列，下次刷新重试。
+    队列满时最多等待 put_timeout 秒，仍然没有空间则抛出 IngestQueueFull。
+    flush_limit 限制单个事务写入的行数，积压时分多个事务写入，
+    两次事务之间写连接可以被其它管道使用。
+    """
+
+    def __init__(self, db, max_batch: int = 500, flush_interval: float = 0.5,
+                 max_queue: int = 20000, put_timeout: float = 0.5,
+                 flush_limit: Optional[int] = None):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.put_timeout = put_timeout
+        self.flush_limit = flush_limit
+
+        self._statements: Dict[str, str] = {}
+        self._hooks: Dict[str, List[Callable]] = {}
+        self._pending: Dict[str, List[Tuple]] = {}
+        # 队列深度包含待写入和正在写入的行
+        self._depth = 0
+        # asyncio原语在事件循环内创建（见 _loop_primitives）
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.rejected = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def _loop_primitives(self) -> None:
+        if self._flush_lock is None:
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+
+    def register(self, kind: str, sql: Optional[str], hook: Optional[Callable] = None) -> None:
+        """登记一种数据类型及其INSERT语句
+
+        hook(conn, rows) 在同一个写事务中、INSERT之后调用，用于维护派生数据；
+        sql 为 None 时由 hook 负责全部写入。hook 可以返回一个无参函数，
+        该函数只在事务提交后调用（用于更新内存状态、推送通知），回滚时被丢弃；
+        返回 AfterCommit 时回滚还会调用其 discard。
+        """
+        self._statements[kind] = sql
+        if hook is not None:
+            self.add_hook(kind, hook)
+
+    def add_hook(self, kind: str, hook: Callable) -> None:
+        """为已登记的数据类型追加写入钩子，按登记顺序在同一事务中调用"""
+        self._hooks.setdefault(kind, []).append(hook)
+
+    async def submit(self, kind: str, rows: Iterable[Tuple]) -> int:
+        if kind not in self._statements:
+            raise KeyError(f"未登记的数据类型: {kind}")
+        rows = list(rows)
+        if not rows:
+            return 0
+        self._loop_primitives()
+        if len(rows) > self.max_queue:
+            self.rejected += len(rows)
+            raise IngestQueueFull("单次提交的数据超过队列容量")
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.put_timeout
+        while self._depth + len(rows) > self.max_queue:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.rejected += len(rows)
+                raise IngestQueueFull("写入队列已满")
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        self._pending.setdefault(kind, []).extend(rows)
+        self._depth += len(rows)
+        if self._depth >= self.max_batch:
+            self._wakeup.set()
+        return len(rows)
+
+    def start(self) -> None:
+        self._loop_primitives()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务并写入剩余数据"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"批量写入失败: {str(e)}")
+
+    async def flush(self) -> int:
+        self._loop_primitives()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch = self._take()
+            count = sum(len(rows) for rows in batch.values())
+            written = failed = None
+            start = time.perf_counter()
+            try:
+                written, failed = await self.db.run(self._write, batch)
+            except Exception as e:
+                if is_transient(e):
+                    # 放回队列头部保持原有顺序，下一次刷新重试（不立即唤醒，避免在锁上空转）
+                    for kind, rows in batch.items():
+                        self._pending[kind] = rows + self._pending.get(kind, [])
+                    self.retries += 1
+                    logger.warning(f"批量写入暂时失败，稍后重试: {str(e)}")
+                    return 0
+                written, failed = 0, count
+                raise
+            finally:
+                if written is not None:
+                    self._finish_batch(count, written, failed, start)
+            return count
+
+    def _finish_batch(self, count: int, written: int, failed: int, start: float) -> None:
+        elapsed = (time.perf_counter() - start) * 1000
+        self.rows_written += written
+        self.rows_failed += failed
+        self._depth -= count
+        self._space.set()
+        self.batches += 1
+        self.last_batch_size = count
+        self.max_batch_size = max(self.max_batch_size, count)
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self._total_flush_ms += elapsed
+        # 还有积压时立即开始下一批
+        if self._depth >= self.max_batch:
+            self._wakeup.set()
+
+    def _take(self) -> Dict[str, List[Tuple]]:
+        if self.flush_limit is None or self._depth <= self.flush_limit:
+            batch, self._pending = self._pending, {}
+            return batch
+        batch = {}
+        remaining = self.flush_limit
+        for kind in list(self._pending):
+            rows = self._pending[kind]
+            batch[kind], rest = rows[:remaining], rows[remaining:]
+            remaining -= len(batch[kind])
+            if rest:
+                self._pending[kind] = rest
+            else:
+                del self._pending[kind]
+            if not remaining:
+                break
+        return batch
+
+    def _write(self, batch: Dict[str, List[Tuple]]) -> Tuple[int, int]:
+        """写入一批数据，返回 (写入行数, 丢弃行数)"""
+        written = failed = 0
+        after_commit: List[Callable] = []
+        try:
+            with self.db.transaction() as conn:
+                if not conn.in_transaction:
+                    # 显式开始事务，SAVEPOINT 才不会在 RELEASE 时提交
+                    conn.execute("BEGIN IMMEDIATE")
+                for kind, rows in batch.items():
+                    try:
+                        after_commit += self._apply(conn, kind, rows)
+                        written += len(rows)
+                        continue
+                    except Exception as e:
+                        if is_transient(e):
+                            raise
+                        logger.error(f"批量写入 {kind} 失败，改为逐行写入: {str(e)}")
+                    for row in rows:
+                        try:
+                            after_commit += self._apply(conn, kind, [row])
+                            written += 1
+                        except Exception as e:
+                            if is_transient(e):
+                                raise
+                            failed += 1
+                            logger.error(f"丢弃无法写入的 {kind} 数据 {row!r}: {str(e)}")
+        except BaseException:
+            discard_callbacks(after_commit)
+            raise
+        for callback in after_commit:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"写入后回调失败: {str(e)}")
+        return written, failed
+
+    def _apply(self, conn, kind: str, rows: List[Tuple]) -> List[Callable]:
+        conn.execute("SAVEPOINT ingest_kind")
+        callbacks = []
+        try:
+            if self._statements[kind]:
+                conn.executemany(self._statements[kind], rows)
+            for hook in self._hooks.get(kind, ()):
+                callback = hook(conn, rows)
+                if callback is not None:
+                    callbacks.append(callback)
+        except BaseException:
+            discard_callbacks(callbacks)
+            conn.execute("ROLLBACK TO SAVEPOINT ingest_kind")
+            conn.execute("RELEASE SAVEPOINT ingest_kind")
+            raise
+        conn.execute("RELEASE SAVEPOINT ingest_kind")
+        return callbacks
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self._depth,
+            'max_queue': self.max_queue,
+            'batches': self.batches,
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'avg_batch_size': round(self.rows_written / self.batches, 2) if self.batches else 0,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self._total_flush_ms / self.batches, 3) if self.batches else 0,
+        }
@@ -0,0 +1,547 @@
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable, AsyncIterator, Set
+import asyncio
+import codecs
+import json
+import logging
+import os
+import signal
+from datetime import timedelta
+
+from services.ingest import is_transient
+from services.scheduler import PRIORITY_BACKGROUND
+from services.ssh_pool import CommandTimeout
+from services.timeseries import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    params TEXT,
+    progress FLOAT DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    log_seq INTEGER DEFAULT 0,
+    created_at TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+
+CREATE TABLE IF NOT EXISTS job_logs (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    server_id INTEGER,
+    stream TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at TIMESTAMP,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+"""
+
+FINISHED = ('success', 'error', 'cancelled', 'interrupted')
+
+JOB_COLUMNS = ('id', 'kind', 'status', 'params', 'progress', 'message', 'result', 'log_seq',
+               'created_at', 'started_at', 'finished_at')
+
+
+class JobError(Exception):
+    """任务函数抛出此异常表示任务失败，异常信息作为任务的 message，result 仍会保存"""
+
+    def __init__(self, message: str, result: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.result = result
+
+
+def job_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    job = dict(row)
+    for key in ('params', 'result'):
+        if job.get(key):
+            job[key] = json.loads(job[key])
+    return job
+
+
+class _Follower:
+    __slots__ = ('queue', 'overflow')
+
+    def __init__(self, max_queue: int):
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.overflow = False
+
+
+class JobContext:
+    """传给任务函数的句柄：写日志、报告进度、执行本机或远程命令"""
+
+    def __init__(self, runner: "JobRunner", job_id: int, kind: str, params: Dict[str, Any]):
+        self.runner = runner
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.progress_value = 0.0
+        self.message: Optional[str] = None
+        self.log_seq = 0
+        self.log_bytes = 0
+        self.log_truncated = False
+
+    def log(self, data: str, stream: str = 'stdout', server_id: Optional[int] = None) -> None:
+        if data:
+            self.runner._log(self, stream, data, server_id)
+
+    def progress(self, value: float, message: Optional[str] = None) -> None:
+        self.progress_value = min(max(value, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        self.runner._progress(self)
+
+    async def run_local(self, command: str, timeout: Optional[float] = None) -> int:
+        """在子进程中执行 shell 命令，输出逐块写入任务日志，返回退出码
+
+        超时抛出 CommandTimeout；任务被取消时整个进程组被终止。
+        """
+        self.log(f"$ {command}\n", 'command')
+        process = await asyncio.create_subprocess_shell(
+            command, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+
+        async def pump(reader: asyncio.StreamReader, stream: str) -> None:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                data = await reader.read(8192)
+                if not data:
+                    break
+                self.log(decoder.decode(data), stream)
+            self.log(decoder.decode(b'', final=True), stream)
+
+        tasks = [asyncio.ensure_future(pump(process.stdout, 'stdout')),
+                 asyncio.ensure_future(pump(process.stderr, 'stderr')),
+                 asyncio.ensure_future(process.wait())]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                raise CommandTimeout("命令执行超时")
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+        return process.returncode
+
+    async def run_remote(self, server: Dict[str, Any], command: str,
+                         timeout: Optional[float] = None) -> int:
+        """通过SSH传输后端在远程服务器执行命令，输出带 server_id 写入任务日志，返回退出码"""
+        decoders = {
+            'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+            'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+        }
+
+        async def on_output(stream: str, data: bytes) -> None:
+            self.log(decoders[stream].decode(data), stream, server['id'])
+
+        return await self.runner.transport.run(server, command, on_output, timeout, PRIORITY_BACKGROUND)
+
+    async def for_each(self, items: List[Any], func: Callable[[Any], Awaitable[Dict[str, Any]]],
+                       concurrency: int = 16, label: Callable[[Any], str] = str) -> List[Dict[str, Any]]:
+        """并发处理多个对象（如多台服务器），按完成数量更新进度；单个对象失败不影响其它对象"""
+        limit = asyncio.Semaphore(max(1, concurrency))
+        done = 0
+        results: List[Dict[str, Any]] = []
+
+        async def run_one(item: Any) -> None:
+            nonlocal done
+            async with limit:
+                try:
+                    result = await func(item)
+                except asyncio.CancelledError:
+                    raise
+                except CommandTimeout:
+                    result = {'status': 'timeout', 'error': "命令执行超时"}
+                except Exception as e:
+                    result = {'status': 'error', 'error': str(e)}
+            results.append({'target': label(item), **result})
+            done += 1
+            self.progress(done / len(items), f"{done}/{len(items)} 已完成")
+
+        await asyncio.gather(*(run_one(item) for item in items))
+        return results
+
+
+class JobRunner:
+    """后台任务执行器
+
+    submit() 立即写入 jobs 表并返回任务 id，任务函数在事件循环中异步执行（阻塞操作放到子进程或SSH传输中），
+    最多同时执行 max_concurrency 个任务，其余排队。
+    - 日志和进度先缓存在内存中，每 flush_interval 秒批量写入 job_logs / jobs，每个任务最多保存 max_log_bytes 字节日志
+    - follow() 先产出已有日志再实时产出新事件；订阅者跟不上时从数据库补齐，不丢日志也不阻塞任务
+    - 任务状态变化通过 publish 推送（WebSocket 'jobs' 主题）
+    - 进程重启时仍处于 queued/running 的任务标记为 interrupted
+    """
+
+    def __init__(self, db, transport=None,
+                 publish: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 max_concurrency: int = 4, flush_interval: float = 0.5,
+                 max_log_bytes: int = 1024 * 1024, follower_queue: int = 1000,
+                 keep_days: float = 30):
+        self.db = db
+        self.transport = transport
+        self.publish = publish
+        self.max_concurrency = max_concurrency
+        self.flush_interval = flush_interval
+        self.max_log_bytes = max_log_bytes
+        self.follower_queue = follower_queue
+        self.keep_days = keep_days
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._active: Dict[int, Tuple[JobContext, asyncio.Task]] = {}
+        self._pending_logs: List[Tuple] = []
+        self._flushing_logs: List[Tuple] = []
+        self._dirty: Set[int] = set()
+        self._followers: Dict[int, Set[_Follower]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+        self.submitted = 0
+        self.finished: Dict[str, int] = {}
+        self.log_rows = 0
+        self.flush_retries = 0
+
+    def create_schema(self) -> None:
+        self.db.executescript(JOB_SCHEMA)
+
+    def recover(self) -> int:
+        """把上次进程退出时未完成的任务标记为 interrupted"""
+        with self.db.transaction() as conn:
+            return conn.execute("""
+                UPDATE jobs SET status = 'interrupted', message = '服务重启，任务中断', finished_at = ?
+                WHERE status IN ('queued', 'running')
+            """, (utc_now().strftime(TIME_FORMAT),)).rowcount
+
+    def start(self) -> None:
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        for _, task in list(self._active.values()):
+            task.cancel()
+        if self._active:
+            await asyncio.gather(*(task for _, task in self._active.values()), return_exceptions=True)
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    # ---- 提交和执行 ----
+
+    async def submit(self, kind: str, func: Callable[[JobContext], Awaitable[Optional[Dict[str, Any]]]],
+                     params: Optional[Dict[str, Any]] = None) -> int:
+        params = params or {}
+        now = utc_now().strftime(TIME_FORMAT)
+        job_id = await self.db.aexecute(
+            "INSERT INTO jobs (kind, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+            (kind, json.dumps(params, ensure_ascii=False), now))
+        ctx = JobContext(self, job_id, kind, params)
+        task = asyncio.create_task(self._run(ctx, func))
+        self._active[job_id] = (ctx, task)
+        self.submitted += 1
+        await self._notify(ctx, {'type': 'status', 'status': 'queued'})
+        return job_id
+
+    def find_active(self, kind: str) -> Optional[int]:
+        """返回同类型未完成任务的 id，用于避免重复提交"""
+        for job_id, (ctx, _) in self._active.items():
+            if ctx.kind == kind:
+                return job_id
+        return None
+
+    async def _run(self, ctx: JobContext, func) -> None:
+        result = None
+        try:
+            async with self._slots:
+                await self.db.aexecute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                                       (utc_now().strftime(TIME_FORMAT), ctx.id))
+                ctx.status = 'running'
+                await self._notify(ctx, {'type': 'status', 'status': 'running'})
+                result = await func(ctx)
+            status = 'success'
+            if ctx.message is None:
+                ctx.message = "任务完成"
+            ctx.progress_value = 1.0
+        except asyncio.CancelledError:
+            status, ctx.message = 'cancelled', "任务已取消"
+        except JobError as e:
+            status, ctx.message, result = 'error', str(e), e.result
+        except Exception as e:
+            logger.exception(f"任务 {ctx.id} ({ctx.kind}) 执行出错")
+            status, ctx.message = 'error', f"任务执行出错: {str(e)}"
+            ctx.log(f"{ctx.message}\n", 'stderr')
+
+        self._active.pop(ctx.id, None)
+        self.finished[status] = self.finished.get(status, 0) + 1
+        try:
+            # 先写完日志再写最终状态，看到任务结束时日志一定已经完整
+            await self.flush()
+            await self.db.aexecute("""
+                UPDATE jobs SET status = ?, progress = ?, message = ?, result = ?, log_seq = ?, finished_at = ?
+                WHERE id = ?
+            """, (status, ctx.progress_value, ctx.message,
+                  json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                  ctx.log_seq, utc_now().strftime(TIME_FORMAT), ctx.id))
+        except Exception as e:
+            logger.error(f"保存任务 {ctx.id} 状态失败: {str(e)}")
+        await self._notify(ctx, {'type': 'status', 'status': status, 'message': ctx.message,
+                                 'progress': ctx.progress_value, 'result': result})
+
+    async def cancel(self, job_id: int) -> bool:
+        active = self._active.get(job_id)
+        if active is None:
+            return False
+        active[1].cancel()
+        return True
+
+    # ---- 日志和进度 ----
+
+    def _log(self, ctx: JobContext, stream: str, data: str, server_id: Optional[int]) -> None:
+        ctx.log_seq += 1
+        event = {'type': 'log', 'seq': ctx.log_seq, 'stream': stream, 'server_id': server_id, 'data': data}
+        if ctx.log_bytes < self.max_log_bytes:
+            ctx.log_bytes += len(data)
+            self._pending_logs.append((ctx.id, ctx.log_seq, server_id, stream, data,
+                                       utc_now().strftime(TIME_FORMAT)))
+        elif not ctx.log_truncated:
+            # 超出上限后只实时推送，不再保存
+            ctx.log_truncated = True
+            self._pending_logs.append((ctx.id, ctx.log_seq, None, 'system',
+                                       f"[日志超过 {self.max_log_bytes} 字节，后续输出未保存]\n",
+                                       utc_now().strftime(TIME_FORMAT)))
+        self._dirty.add(ctx.id)
+        self._push(ctx.id, event)
+
+    def _progress(self, ctx: JobContext) -> None:
+        self._dirty.add(ctx.id)
+        self._push(ctx.id, {'type': 'progress', 'progress': ctx.progress_value, 'message': ctx.message})
+
+    def _push(self, job_id: int, event: Dict[str, Any]) -> None:
+        for follower in self._followers.get(job_id, ()):
+            if follower.overflow:
+                continue
+            try:
+                follower.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                follower.overflow = True
+
+    async def _notify(self, ctx: JobContext, event: Dict[str, Any]) -> None:
+        self._push(ctx.id, event)
+        if self.publish is not None:
+            try:
+                await self.publish({'type': 'job', 'id': ctx.id, 'kind': ctx.kind,
+                                    'status': event['status'], 'message': event.get('message')})
+            except Exception as e:
+                logger.error(f"推送任务状态失败: {str(e)}")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending_logs and not self._dirty:
+                return
+            rows, self._pending_logs = self._pending_logs, []
+            self._flushing_logs = rows
+            dirty, self._dirty = self._dirty, set()
+            updates = []
+            for job_id in dirty:
+                active = self._active.get(job_id)
+                if active is not None:
+                    ctx = active[0]
+                    updates.append((ctx.progress_value, ctx.message, ctx.log_seq, job_id))
+            try:
+                await self.db.run(self._write, rows, updates)
+                self.log_rows += len(rows)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                # 放回队列头部保持原有顺序，进度重新标记为待写入，下一次刷新重试（日志按 (job_id, seq) 去重）
+                self._pending_logs = rows + self._pending_logs
+                self._dirty |= dirty
+                self.flush_retries += 1
+                logger.warning(f"写入任务日志暂时失败，稍后重试: {str(e)}")
+            finally:
+                self._flushing_logs = []
+
+    def _write(self, rows: List[Tuple], updates: List[Tuple]) -> None:
+        with self.db.transaction() as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO job_logs (job_id, seq, server_id, stream, data, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany("UPDATE jobs SET progress = ?, message = ?, log_seq = ? WHERE id = ?", updates)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"写入任务日志失败: {str(e)}")
+
+    # ---- 查询 ----
+
+    async def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = await self.db.afetch_one(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,))
+        if row is None:
+            return None
+        job = job_row(row)
+        active = self._active.get(job_id)
+        if active is not None:
+            # 运行中的任务用内存中的最新进度
+            ctx = active[0]
+            job.update(progress=ctx.progress_value, message=ctx.message, log_seq=ctx.log_seq)
+        return job
+
+    async def list(self, status: Optional[str] = None, kind: Optional[str] = None,
+                   limit: int = 50) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if kind:
+            conditions.append("kind = ?")
+            params.append(kind)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.db.afetch_all(f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM jobs {where} ORDER BY id DESC LIMIT ?
+        """, (*params, limit))
+        jobs = [job_row(row) for row in rows]
+        for job in jobs:
+            active = self._active.get(job['id'])
+            if active is not None:
+                job.update(progress=active[0].progress_value, message=active[0].message)
+        return jobs
+
+    async def logs(self, job_id: int, after_seq: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """seq 大于 after_seq 的日志（包括尚未写入数据库的部分），next_seq 用于下一次轮询"""
+        rows = await self.db.afetch_all("""
+            SELECT seq, server_id, stream, data, created_at FROM job_logs
+            WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?
+        """, (job_id, after_seq, limit))
+        items = [dict(row) for row in rows]
+        if len(items) < limit:
+            last = items[-1]['seq'] if items else after_seq
+            for row in (*self._flushing_logs, *self._pending_logs):
+                if row[0] == job_id and row[1] > last:
+                    items.append({'seq': row[1], 'server_id': row[2], 'stream': row[3],
+                                  'data': row[4], 'created_at': row[5]})
+            items = items[:limit]
+        return {'items': items, 'next_seq': items[-1]['seq'] if items else after_seq}
+
+    async def follow(self, job_id: int, after_seq: int = 0,
+                     keepalive: float = 15) -> AsyncIterator[Dict[str, Any]]:
+        """先产出 after_seq 之后的已有日志，再实时产出 log / progress / status 事件，任务结束后停止
+
+        先订阅再读取历史，按 seq 去重；订阅者队列溢出时改为从数据库补齐。
+        """
+        follower = _Follower(self.follower_queue)
+        self._followers.setdefault(job_id, set()).add(follower)
+        last_seq = after_seq
+        try:
+            while True:
+                page = await self.logs(job_id, last_seq)
+                for item in page['items']:
+                    yield {'type': 'log', **item}
+                last_seq = page['next_seq']
+                if len(page['items']) < 1000:
+                    break
+
+            if job_id not in self._active:
+                job = await self.get(job_id)
+                if job is not None:
+                    yield {'type': 'status', 'status': job['status'], 'message': job['message'],
+                           'progress': job['progress'], 'result': job['result']}
+                return
+
+            while True:
+                if follower.overflow:
+                    # 跟不上实时推送：清空队列，从数据库和内存缓冲中补齐
+                    while not follower.queue.empty():
+                        follower.queue.get_nowait()
+                    follower.overflow = False
+                    page = await self.logs(job_id, last_seq)
+                    for item in page['items']:
+                        yield {'type': 'log', **item}
+                    last_seq = page['next_seq']
+                    if job_id not in self._active:
+                        job = await self.get(job_id)
+                        yield {'type': 'status', 'status': job['status'], 'message': job['message'],
+                               'progress': job['progress'], 'result': job['result']}
+                        return
+                    continue
+                try:
+                    event = await asyncio.wait_for(follower.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield {'type': 'keepalive'}
+                    continue
+                if event['type'] == 'log':
+                    if event['seq'] <= last_seq:
+                        continue
+                    last_seq = event['seq']
+                yield event
+                if event['type'] == 'status' and event['status'] in FINISHED:
+                    return
+        finally:
+            followers = self._followers.get(job_id)
+            if followers is not None:
+                followers.discard(follower)
+                if not followers:
+                    del self._followers[job_id]
+
+    # ---- 清理 ----
+
+    async def prune(self) -> int:
+        cutoff_text = (utc_now() - timedelta(days=self.keep_days)).strftime(TIME_FORMAT)
+
+        def delete() -> int:
+            with self.db.transaction() as conn:
+                conn.execute("""
+                    DELETE FROM job_logs WHERE job_id IN (
+                        SELECT id FROM jobs WHERE finished_at < ?
+                    )
+                """, (cutoff_text,))
+                return conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff_text,)).rowcount
+
+        return await self.db.run(delete)
+
+    async def run_retention(self, interval: float = 3600) -> None:
+        while True:
+            try:
+                removed = await self.prune()
+                if removed:
+                    logger.info(f"清理过期任务记录: {removed}")
+            except Exception as e:
+                logger.error(f"清理任务记录失败: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for ctx, _ in self._active.values() if ctx.status == 'running')
+        return {
+            'active': len(self._active),
+            'running': running,
+            'max_concurrency': self.max_concurrency,
+            'submitted': self.submitted,
+            'finished': dict(self.finished),
+            'pending_logs': len(self._pending_logs),
+            'log_rows': self.log_rows,
+            'flush_retries': self.flush_retries,
+            'followers': sum(len(followers) for followers in self._followers.values()),
+        }
@@ -0,0 +1,92 @@
+from typing import Dict, Any, Optional, Callable, Awaitable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def diff_metrics(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> Dict[str, Any]:
+    """返回 new 相对 old 变化的字段，嵌套字典递归比较"""
+    if old is None:
+        return new
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = diff_metrics(previous, value)
+            if nested:
+                delta[key] = nested
+        elif value != previous:
+            delta[key] = value
+    return delta
+
+
+class LiveMetricsHub:
+    """实时指标推送中心
+
+    每个被订阅的服务器只运行一个采样任务，结果推送给所有订阅者：
+    新订阅者先收到一次完整快照（snapshot），之后只收到变化的字段（delta）。
+    没有订阅者时采样任务自动退出。
+    """
+
+    def __init__(self, manager, sample: Callable[[int], Awaitable[Optional[Dict[str, Any]]]],
+                 interval: float = 1.0):
+        self.manager = manager
+        self.sample = sample
+        self.interval = interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._latest: Dict[int, Dict[str, Any]] = {}
+
+    async def handle(self, websocket) -> None:
+        await self.manager.handle_subscriber(websocket, on_subscribe=self.on_subscribe)
+
+    async def on_subscribe(self, websocket, server_ids) -> None:
+        for server_id in server_ids:
+            latest = self._latest.get(server_id)
+            if latest is not None:
+                await self.manager.send_message(
+                    websocket, {'type': 'snapshot', 'server_id': server_id, 'data': latest},
+                    conflate_key=('metrics', server_id)
+                )
+            task = self._tasks.get(server_id)
+            if task is None or task.done():
+                self._tasks[server_id] = asyncio.create_task(self._run(server_id))
+
+    async def _run(self, server_id: int) -> None:
+        try:
+            while self.manager.subscriber_count(server_id):
+                try:
+                    data = await self.sample(server_id)
+                except Exception as e:
+                    logger.error(f"采集服务器 {server_id} 实时指标失败: {str(e)}")
+                    data = None
+                if data is not None:
+                    previous = self._latest.get(server_id)
+                    delta = diff_metrics(previous, data)
+                    self._latest[server_id] = data
+                    if delta:
+                        # 慢客户端未发出的增量会与新增量合并，只保留最新状态
+                        await self.manager.publish(server_id, {
+                            'type': 'snapshot' if previous is None else 'delta',
+                            'server_id': server_id,
+                            'data': delta
+                        }, conflate_key=('metrics', server_id))
+                await asyncio.sleep(self.interval)
+        finally:
+            self._tasks.pop(server_id, None)
+            self._latest.pop(server_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'samplers': len(self._tasks),
+            'websocket': self.manager.stats(),
+            'subscriptions': {
+                server_id: self.manager.subscriber_count(server_id) for server_id in self._tasks
+            }
+        }
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,275 @@
+from typing import Dict, Any, Optional, Tuple, List
+import asyncio
+import logging
+import mmap
+import os
+import re
+import shutil
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# 除 PATH 外，常见的 nginx 安装位置（systemd 服务的 PATH 中往往没有 sbin）
+NGINX_SEARCH_PATH = ('/usr/sbin', '/usr/local/sbin', '/usr/local/nginx/sbin', '/sbin')
+
+# 远程安装脚本：按包管理器安装并启动 nginx，非 root 用户使用免密 sudo
+REMOTE_INSTALL_SCRIPT = """
+set -e
+if [ "$(id -u)" -eq 0 ]; then SUDO=""; else SUDO="sudo -n"; fi
+if command -v apt-get >/dev/null 2>&1; then
+    $SUDO apt-get update
+    $SUDO env DEBIAN_FRONTEND=noninteractive apt-get install -y nginx
+elif command -v dnf >/dev/null 2>&1; then
+    $SUDO dnf install -y nginx
+elif command -v yum >/dev/null 2>&1; then
+    $SUDO yum install -y epel-release || true
+    $SUDO yum install -y nginx
+elif command -v pacman >/dev/null 2>&1; then
+    $SUDO pacman -S --noconfirm nginx
+else
+    echo "不支持的操作系统" >&2
+    exit 2
+fi
+$SUDO systemctl enable --now nginx
+nginx -v 2>&1 || true
+"""
+
+NGINX_PID_FILES = ('/run/nginx.pid', '/var/run/nginx.pid', '/usr/local/nginx/logs/nginx.pid')
+
+# nginx 可执行文件中内嵌的版本字符串，如 "nginx/1.24.0"
+VERSION_PATTERN = re.compile(rb'nginx version: (?:nginx|openresty)/[0-9][0-9.]*|(?:nginx|openresty)/[0-9]+\.[0-9]+\.[0-9]+')
+
+
+def read_binary_version(path: str) -> Optional[str]:
+    """从可执行文件中读取版本字符串，不需要执行 nginx -v"""
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            match = VERSION_PATTERN.search(data)
+    except (OSError, ValueError):
+        return None
+    if match is None:
+        return None
+    version = match.group().decode()
+    return version if version.startswith('nginx version:') else f"nginx version: {version}"
+
+
+def install_commands() -> Optional[List[Tuple[str, str]]]:
+    """本机安装 nginx 的命令列表 [(说明, 命令)]，不支持的系统返回 None"""
+    sudo = '' if os.geteuid() == 0 else 'sudo -n '
+    if os.path.exists('/etc/debian_version'):  # Debian/Ubuntu
+        install = [("更新软件源", f"{sudo}apt-get update"),
+                   ("安装 nginx", f"{sudo}env DEBIAN_FRONTEND=noninteractive apt-get install -y nginx")]
+    elif os.path.exists('/etc/redhat-release'):  # CentOS/RHEL
+        install = [("安装 epel-release", f"{sudo}yum install -y epel-release"),
+                   ("安装 nginx", f"{sudo}yum install -y nginx")]
+    elif os.path.exists('/etc/arch-release'):  # Arch Linux
+        install = [("安装 nginx", f"{sudo}pacman -S --noconfirm nginx")]
+    else:
+        return None
+    return install + [("启动 nginx", f"{sudo}systemctl start nginx"),
+                      ("设置开机启动", f"{sudo}systemctl enable nginx")]
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程存在但属于其它用户（nginx master 通常是 root）
+        pass
+    try:
+        with open(f'/proc/{pid}/comm') as f:
+            return f.read().strip() == 'nginx'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+
+
+class NginxDetector:
+    """不创建子进程的 nginx 状态检测
+
+    - 可执行文件通过 PATH（加上常见的 sbin 目录）查找，版本从可执行文件内嵌的字符串读取，
+      按 (路径, mtime, 大小) 缓存，升级后自动重新读取
+    - 运行状态读取 pid 文件并用 kill(pid, 0) + /proc/<pid>/comm 确认；没有 pid 文件时
+      由后台 watch() 在线程中扫描进程列表（请求路径上从不扫描），找到的 master pid
+      缓存下来，之后只检查该 pid；没找到时 scan_interval 秒内不再扫描（缓存失效时除外）
+    - 结果缓存 ttl 秒；后台 watch() 每 poll_interval 秒 stat 一次 pid 文件和可执行文件，
+      变化（启动/停止/重装）时立即使缓存失效
+    """
+
+    def __init__(self, ttl: float = 5, poll_interval: float = 1, scan_interval: float = 60,
+                 pid_files: Tuple[str, ...] = NGINX_PID_FILES,
+                 search_path: Tuple[str, ...] = NGINX_SEARCH_PATH):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self._last_scan = 0.0
+        self.pid_files = pid_files
+        self.search_path = search_path
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._expires = 0.0
+        self._cached_pid: Optional[int] = None
+        self._version: Optional[Tuple[Tuple, Optional[str]]] = None
+        self._fingerprint: Optional[Tuple] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.refreshes = 0
+        self.invalidations = 0
+        self.process_scans = 0
+
+    # ---- 检测 ----
+
+    def find_binary(self) -> Optional[str]:
+        path = os.pathsep.join([os.environ.get('PATH', ''), *self.search_path])
+        return shutil.which('nginx', path=path)
+
+    def version(self, binary: str) -> Optional[str]:
+        try:
+            st = os.stat(binary)
+        except OSError:
+            return None
+        key = (binary, st.st_mtime_ns, st.st_size)
+        if self._version is None or self._version[0] != key:
+            self._version = (key, read_binary_version(binary))
+        return self._version[1]
+
+    def _read_pid_file(self) -> Tuple[Optional[str], Optional[int]]:
+        for pid_file in self.pid_files:
+            try:
+                with open(pid_file) as f:
+                    return pid_file, int(f.read().strip())
+            except (OSError, ValueError):
+                continue
+        return None, None
+
+    def _scan_processes(self) -> Optional[int]:
+        self.process_scans += 1
+        for proc in psutil.process_iter(['name', 'ppid', 'pid']):
+            info = proc.info
+            if info['name'] == 'nginx':
+                # 优先返回 master（其父进程不是 nginx）
+                try:
+                    parent = psutil.Process(info['ppid']).name() if info['ppid'] else ''
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    parent = ''
+                if parent != 'nginx':
+                    return info['pid']
+        return None
+
+    def find_pid(self) -> Tuple[Optional[int], str]:
+        """返回 (pid, 来源)，来源为 pid 文件路径或 'cache'（后台扫描得到的 pid）"""
+        pid_file, pid = self._read_pid_file()
+        if pid is not None and pid_alive(pid):
+            self._cached_pid = pid
+            return pid, pid_file
+        if pid_file is None and self._cached_pid is not None and pid_alive(self._cached_pid):
+            return self._cached_pid, 'cache'
+        # 没有 pid 文件时不在这里扫描进程列表，由 watch() 在后台扫描后填充 _cached_pid
+        self._cached_pid = None
+        return None, ''
+
+    async def _scan_if_needed(self) -> None:
+        """没有 pid 文件且缓存的 pid 已失效时，在线程中扫描进程列表（受 scan_interval 限制）"""
+        if self._read_pid_file()[0] is not None:
+            return
+        if self._cached_pid is not None and pid_alive(self._cached_pid):
+            return
+        if time.monotonic() - self._last_scan < self.scan_interval:
+            return
+        self._last_scan = time.monotonic()
+        pid = await asyncio.to_thread(self._scan_processes)
+        if pid != self._cached_pid:
+            self._cached_pid = pid
+            self._expires = 0.0
+
+    def detect(self) -> Dict[str, Any]:
+        binary = self.find_binary()
+        pid, source = self.find_pid()
+        running = pid is not None
+        # installed 保持原接口含义：已安装且正在运行
+        if binary and running:
+            status, message = 'running', "Nginx 已安装并运行"
+        elif binary:
+            status, message = 'stopped', "Nginx 已安装但未运行"
+        elif running:
+            status, message = 'running', "Nginx 正在运行（未在PATH中找到可执行文件）"
+        else:
+            status, message = 'not_installed', "Nginx 未安装"
+        return {
+            'installed': running and binary is not None,
+            'status': status,
+            'version': self.version(binary) if binary else None,
+            'message': message,
+            'binary': binary,
+            'pid': pid,
+            'pid_source': source or None,
+        }
+
+    # ---- 缓存 ----
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        if self._snapshot is not None and now < self._expires:
+            self.hits += 1
+            return self._snapshot
+        self.refreshes += 1
+        self._snapshot = self.detect()
+        self._expires = now + self.ttl
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        self.invalidations += 1
+        self._expires = 0.0
+        self._last_scan = 0.0
+
+    def _fingerprint_files(self) -> Tuple:
+        result: List[Any] = []
+        for path in (*self.pid_files, (self._snapshot or {}).get('binary')):
+            if not path:
+                continue
+            try:
+                st = os.stat(path)
+                result.append((path, st.st_mtime_ns, st.st_ino, st.st_size))
+            except OSError:
+                result.append((path, None))
+        return tuple(result)
+
+    async def watch(self) -> None:
+        """轮询 stat pid 文件和可执行文件，变化时使缓存失效；没有 pid 文件时按需在线程中扫描进程列表"""
+        while True:
+            try:
+                fingerprint = self._fingerprint_files()
+                if self._fingerprint is not None and fingerprint != self._fingerprint:
+                    self.invalidate()
+                self._fingerprint = fingerprint
+                await self._scan_if_needed()
+            except Exception as e:
+                logger.error(f"检查 Nginx 文件变化失败: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'invalidations': self.invalidations,
+            'process_scans': self.process_scans,
+            'cached_pid': self._cached_pid,
+        }
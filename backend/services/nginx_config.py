@@ -0,0 +1,597 @@
+from typing import Dict, Any, Optional, List, Tuple, Callable, Iterable
+import asyncio
+import base64
+import glob
+import hashlib
+import logging
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import time
+import uuid
+
+from services.uptime import site_target
+
+logger = logging.getLogger(__name__)
+
+# 生成的配置文件第一行，用于识别由本系统管理的文件（删除站点时只清理带此标记的文件）
+MANAGED_MARKER = "# managed by copy-www-admin"
+
+HOST_PATTERN = re.compile(r'^(\*\.)?[A-Za-z0-9]([A-Za-z0-9-]*[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9-]*[A-Za-z0-9])?)*$')
+IPV6_PATTERN = re.compile(r'^[0-9A-Fa-f:.]+$')
+
+
+class SiteConfigError(Exception):
+    pass
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def site_host(site: Dict[str, Any]) -> Tuple[str, int, bool]:
+    """返回 (server_name, 端口, 是否启用SSL)，域名不合法时抛出 SiteConfigError"""
+    try:
+        scheme, host, port, _ = site_target(site['domain'].strip(), bool(site['ssl_enabled']))
+    except ValueError:
+        raise SiteConfigError(f"站点域名格式错误: {site['domain']}")
+    # 域名会被写进配置文件，只允许主机名字符，防止注入配置指令
+    if not (HOST_PATTERN.match(host) or (':' in host and IPV6_PATTERN.match(host))):
+        raise SiteConfigError(f"站点域名格式错误: {site['domain']}")
+    if not 0 < port < 65536:
+        raise SiteConfigError(f"站点端口错误: {site['domain']}")
+    return host, port, scheme == 'https'
+
+
+def cert_name(host: str) -> str:
+    return host[2:] if host.startswith('*.') else host
+
+
+def cert_files(site: Dict[str, Any], cert_dir: str = '/etc/letsencrypt/live') -> List[str]:
+    """SSL站点引用的证书和私钥路径，未启用SSL时为空"""
+    host, _, ssl_enabled = site_host(site)
+    if not ssl_enabled:
+        return []
+    name = cert_name(host)
+    return [f"{cert_dir}/{name}/fullchain.pem", f"{cert_dir}/{name}/privkey.pem"]
+
+
+def render_site(site: Dict[str, Any], site_root: str = '/var/www',
+                cert_dir: str = '/etc/letsencrypt/live') -> str:
+    """根据 sites 表中的一行生成 server 块"""
+    host, port, ssl_enabled = site_host(site)
+    name = cert_name(host)
+    server_name = f"[{host}]" if ':' in host else host
+    listen = [f"listen {port}{' ssl' if ssl_enabled else ''};",
+              f"listen [::]:{port}{' ssl' if ssl_enabled else ''};"]
+    lines = [f"{MANAGED_MARKER} (site {site['id']})", "# 此文件由系统根据站点列表生成，手动修改会被覆盖", ""]
+    if ssl_enabled and port == 443:
+        lines += [
+            "server {",
+            "    listen 80;",
+            "    listen [::]:80;",
+            f"    server_name {server_name};",
+            "    return 301 https://$host$request_uri;",
+            "}",
+            "",
+        ]
+    lines += ["server {"]
+    lines += [f"    {line}" for line in listen]
+    lines += [
+        f"    server_name {server_name};",
+        f"    root {site_root}/{name};",
+        "    index index.html index.htm;",
+    ]
+    if ssl_enabled:
+        certificate, key = cert_files(site, cert_dir)
+        lines += [
+            f"    ssl_certificate {certificate};",
+            f"    ssl_certificate_key {key};",
+            "    ssl_protocols TLSv1.2 TLSv1.3;",
+        ]
+    lines += [
+        "",
+        "    location / {",
+        "        try_files $uri $uri/ =404;",
+        "    }",
+        "}",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def atomic_write(path: str, content: str) -> None:
+    """写入临时文件后 rename 覆盖，nginx 任何时候读到的都是完整文件"""
+    directory = os.path.dirname(path) or '.'
+    # 临时文件不以 .conf 结尾，不会被 include *.conf 读到
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def read_file(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def managed_site_id(path: str) -> Optional[int]:
+    """托管配置文件首行记录的站点ID，读取失败或不是托管文件时返回 None"""
+    try:
+        with open(path) as f:
+            line = f.readline()
+    except (OSError, UnicodeDecodeError):
+        return None
+    match = re.match(re.escape(MANAGED_MARKER) + r' \(site (\d+)\)', line)
+    return int(match.group(1)) if match else None
+
+
+def is_managed(path: str) -> bool:
+    try:
+        with open(path) as f:
+            return f.readline().startswith(MANAGED_MARKER)
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+class NginxConfigEngine:
+    """把 sites 表渲染成 nginx 配置文件并批量生效
+
+    - 每个站点一个文件（默认 conf_dir/<域名>.conf，站点设置了 config_path 时使用该文件名，必须位于 conf_dir 下），
+      只有内容哈希变化的文件才会重写，写入用临时文件 + rename 原子替换
+    - 一批变更只执行一次 nginx -t，校验失败时恢复这一批文件的旧内容，不会 reload
+    - request_sync() 只做标记：最后一次请求后安静 debounce 秒（最多等待 max_delay 秒）才执行一次同步，
+      连续添加几百个站点只触发一次校验和 reload
+    - push() 把同一份配置推送到远程服务器：通过连接池中的同一个SSH会话读取远程文件哈希，
+      只上传变化的文件，最后一次性替换、nginx -t、reload，校验失败时在远程恢复旧文件
+    - 已存在但不是本系统生成的配置文件不会被覆盖或删除
+    """
+
+    def __init__(self, db, conf_dir: str = '/etc/nginx/conf.d',
+                 resolve_binary: Callable[[], Optional[str]] = lambda: None,
+                 executor=None, transport=None,
+                 debounce: float = 2.0, max_delay: float = 30.0,
+                 site_root: str = '/var/www', cert_dir: str = '/etc/letsencrypt/live',
+                 remote_conf_dir: Optional[str] = None, remote_sudo: bool = False,
+                 command_timeout: float = 60, script_bytes: int = 65536):
+        self.db = db
+        self.conf_dir = conf_dir
+        self.resolve_binary = resolve_binary
+        self.executor = executor
+        self.transport = transport
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.site_root = site_root
+        self.cert_dir = cert_dir
+        self.remote_conf_dir = (remote_conf_dir or conf_dir).rstrip('/') or '/'
+        self.remote_sudo = remote_sudo
+        self.command_timeout = command_timeout
+        self.script_bytes = script_bytes
+
+        # 已知文件的 (内容哈希, mtime_ns, 大小)，stat 未变化时不需要重新读取文件
+        self._files: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = asyncio.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._first_request: Optional[float] = None
+        self._last_request = 0.0
+
+        self.requests = 0
+        self.syncs = 0
+        self.reloads = 0
+        self.files_written = 0
+        self.files_removed = 0
+        self.test_failures = 0
+        self.pushes = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    # ---- 渲染 ----
+
+    def config_file(self, config_path: str) -> str:
+        """站点自定义的配置文件路径：可以是文件名或绝对路径，但必须直接位于 conf_dir 下
+
+        解析符号链接和 .. 后不在 conf_dir 中的路径会被拒绝，
+        否则文件会写到任意位置，也不会被 _managed_paths 找到而无法清理。
+        """
+        name = os.path.basename(config_path)
+        if not name.endswith('.conf'):
+            raise SiteConfigError(f"配置文件路径必须以 .conf 结尾: {config_path}")
+        if name.startswith('.'):
+            # 以 . 开头的是推送和写入时使用的临时、备份文件
+            raise SiteConfigError(f"配置文件名不能以 . 开头: {config_path}")
+        conf_dir = os.path.realpath(self.conf_dir)
+        resolved = os.path.realpath(os.path.join(conf_dir, config_path))
+        if os.path.dirname(resolved) != conf_dir or os.path.basename(resolved) != name:
+            raise SiteConfigError(f"配置文件必须位于 {self.conf_dir} 目录下: {config_path}")
+        return os.path.join(self.conf_dir, name)
+
+    def site_path(self, site: Dict[str, Any], conf_dir: Optional[str] = None) -> str:
+        if conf_dir is None and site.get('config_path'):
+            return self.config_file(site['config_path'])
+        host, _, _ = site_host(site)
+        name = host.replace('*', '_').replace(':', '_')
+        return os.path.join(conf_dir or self.conf_dir, f"{name}.conf")
+
+    def render(self, site: Dict[str, Any]) -> str:
+        return render_site(site, self.site_root, self.cert_dir)
+
+    def render_all(self, sites: Iterable[Dict[str, Any]], conf_dir: Optional[str] = None,
+                   check_certs: bool = False) -> Tuple[Dict[str, str], List[Dict[str, Any]], Dict[str, int]]:
+        """返回 ({路径: 内容}, 错误列表, {跳过的站点的路径: 站点ID})
+
+        域名不合法或路径冲突的站点跳过，不影响其它站点；跳过的站点保留现有的配置文件，不会被当作已删除的站点清理。
+        check_certs 时证书文件不存在的SSL站点也跳过：引用不存在的证书会让 nginx -t 失败，
+        导致同一批次所有站点的配置都无法生效；证书签发后下一次同步会自动写入。
+        """
+        desired: Dict[str, str] = {}
+        owners: Dict[str, int] = {}
+        skipped: Dict[str, int] = {}
+        errors = []
+        for site in sites:
+            path = None
+            try:
+                path = self.site_path(site, conf_dir)
+                content = self.render(site)
+                if check_certs:
+                    missing = [f for f in cert_files(site, self.cert_dir) if not os.path.isfile(f)]
+                    if missing:
+                        raise SiteConfigError(f"SSL证书文件不存在，暂不生成配置: {', '.join(missing)}")
+            except SiteConfigError as e:
+                errors.append({'site_id': site['id'], 'error': str(e)})
+                if path is not None:
+                    skipped[path] = site['id']
+                continue
+            if path in desired:
+                errors.append({'site_id': site['id'],
+                               'error': f"配置文件路径与站点 {owners[path]} 冲突: {path}"})
+                continue
+            desired[path] = content
+            owners[path] = site['id']
+        return desired, errors, skipped
+
+    # ---- 本机同步（在线程池中执行） ----
+
+    def _current_hash(self, path: str) -> Optional[str]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._files.pop(path, None)
+            return None
+        cached = self._files.get(path)
+        if cached is not None and cached[1:] == (st.st_mtime_ns, st.st_size):
+            return cached[0]
+        content = read_file(path)
+        if content is None:
+            return None
+        digest = content_hash(content)
+        self._files[path] = (digest, st.st_mtime_ns, st.st_size)
+        return digest
+
+    def _remember(self, path: str, digest: str) -> None:
+        st = os.stat(path)
+        self._files[path] = (digest, st.st_mtime_ns, st.st_size)
+
+    def _managed_paths(self) -> List[str]:
+        paths = set(glob.glob(os.path.join(self.conf_dir, '*.conf')))
+        paths.update(self._files)
+        return [path for path in paths if is_managed(path)]
+
+    def _nginx(self, binary: str, *args: str) -> Tuple[bool, str]:
+        try:
+            proc = subprocess.run([binary, *args], capture_output=True, text=True,
+                                  timeout=self.command_timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return False, str(e)
+        return proc.returncode == 0, (proc.stdout + proc.stderr).strip()
+
+    def apply(self, sites: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """写入变化的配置文件，校验一次，成功后 reload 一次"""
+        desired, errors, skipped = self.render_all(sites, check_certs=True)
+        result: Dict[str, Any] = {'sites': len(desired), 'errors': errors, 'written': [], 'removed': []}
+        if not os.path.isdir(self.conf_dir):
+            return {**result, 'status': 'skipped', 'message': f"配置目录不存在: {self.conf_dir}"}
+
+        # (路径, 旧内容, 新内容)，新内容为 None 表示删除
+        changes: List[Tuple[str, Optional[str], Optional[str]]] = []
+        for path, content in desired.items():
+            if self._current_hash(path) == content_hash(content):
+                continue
+            old = read_file(path)
+            if old is not None and not old.startswith(MANAGED_MARKER):
+                # 不覆盖手工维护的配置
+                errors.append({'path': path, 'error': f"已存在非本系统生成的配置文件: {path}"})
+                continue
+            changes.append((path, old, content))
+        # 只删除站点已不存在的托管文件；本次跳过的站点（证书暂缺、域名错误等）保留原配置继续服务
+        skipped_ids = {error['site_id'] for error in errors if 'site_id' in error}
+        for path in self._managed_paths():
+            if path in desired or path in skipped or managed_site_id(path) in skipped_ids:
+                continue
+            changes.append((path, read_file(path), None))
+        if not changes:
+            return {**result, 'status': 'unchanged'}
+
+        done = []
+        try:
+            for path, old, content in changes:
+                if content is None:
+                    os.unlink(path)
+                    self._files.pop(path, None)
+                else:
+                    atomic_write(path, content)
+                    self._remember(path, content_hash(content))
+                done.append((path, old, content))
+        except OSError as e:
+            self._rollback(done)
+            return {**result, 'status': 'error', 'message': f"写入配置文件失败: {str(e)}"}
+
+        binary = self.resolve_binary()
+        if binary:
+            ok, output = self._nginx(binary, '-t')
+            if not ok:
+                self.test_failures += 1
+                self._rollback(done)
+                return {**result, 'status': 'invalid', 'message': "nginx -t 校验失败，已恢复原配置",
+                        'output': output}
+
+        result['written'] = [path for path, _, content in changes if content is not None]
+        result['removed'] = [path for path, _, content in changes if content is None]
+        self.files_written += len(result['written'])
+        self.files_removed += len(result['removed'])
+        if not binary:
+            return {**result, 'status': 'written', 'message': "未找到 nginx，配置已写入但未校验和重载"}
+
+        ok, output = self._nginx(binary, '-s', 'reload')
+        if not ok:
+            return {**result, 'status': 'written', 'message': "配置已写入，但 nginx 重载失败", 'output': output}
+        self.reloads += 1
+        return {**result, 'status': 'reloaded'}
+
+    def _rollback(self, done: List[Tuple[str, Optional[str], Optional[str]]]) -> None:
+        for path, old, _ in reversed(done):
+            try:
+                if old is None:
+                    if os.path.exists(path):
+                        os.unlink(path)
+                    self._files.pop(path, None)
+                else:
+                    atomic_write(path, old)
+                    self._remember(path, content_hash(old))
+            except OSError as e:
+                logger.error(f"恢复配置文件失败 {path}: {str(e)}")
+
+    # ---- 调度 ----
+
+    async def sync(self) -> Dict[str, Any]:
+        """立即同步一次（与后台同步互斥）"""
+        async with self._lock:
+            self._first_request = None
+            if self._wake is not None:
+                self._wake.clear()
+            sites = await self.db.afetch_all("SELECT * FROM sites ORDER BY id")
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(self.executor, self.apply, sites)
+            self.syncs += 1
+            result['finished_at'] = time.time()
+            self.last_result = result
+            if result['status'] in ('invalid', 'error'):
+                logger.error(f"Nginx 配置同步失败: {result.get('message')} {result.get('output', '')}")
+            elif result['status'] != 'unchanged':
+                logger.info(f"Nginx 配置同步: {result['status']}，写入 {len(result['written'])} 个，"
+                            f"删除 {len(result['removed'])} 个")
+            return result
+
+    def request_sync(self) -> None:
+        """站点变化后调用；多次调用合并为一次同步"""
+        self.requests += 1
+        now = time.monotonic()
+        if self._first_request is None:
+            self._first_request = now
+        self._last_request = now
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            await self._wake.wait()
+            # 去抖：等到最后一次请求后安静 debounce 秒，但从第一次请求算起最多等 max_delay 秒
+            while self._first_request is not None:
+                deadline = min(self._last_request + self.debounce, self._first_request + self.max_delay)
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            if self._first_request is None:
+                # 等待期间已经被 sync() 处理
+                self._wake.clear()
+                continue
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Nginx 配置同步出错: {str(e)}")
+
+    def start(self) -> None:
+        self._wake = asyncio.Event()
+        if self._first_request is not None:
+            self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---- 远程推送 ----
+
+    def _remote(self, script: str) -> str:
+        return f"sudo -n sh -c {shlex.quote(script)}" if self.remote_sudo else script
+
+    def _list_script(self) -> str:
+        conf_dir = shlex.quote(self.remote_conf_dir)
+        marker = shlex.quote(MANAGED_MARKER)
+        return (f"test -d {conf_dir} || exit 3; "
+                f"for f in {conf_dir}/*.conf; do "
+                f"[ -f \"$f\" ] && head -n 1 \"$f\" | grep -qF {marker} && sha256sum \"$f\"; "
+                f"done; exit 0")
+
+    def _stage_scripts(self, staging: str, changes: List[Tuple[str, Optional[str]]]) -> List[str]:
+        """把变更写到远程临时目录的脚本，按 script_bytes 分段（单个命令参数在远程受 ARG_MAX 限制）"""
+        head = f"set -e; cd {shlex.quote(self.remote_conf_dir)}; mkdir -p {staging}"
+        scripts, lines, size = [], [head], len(head)
+        for path, content in changes:
+            name = os.path.basename(path)
+            if content is None:
+                block = [f"echo {shlex.quote(name)} >> {staging}/.remove"]
+            else:
+                encoded = base64.b64encode(content.encode()).decode()
+                block = [f"base64 -d > {staging}/{shlex.quote(name)} <<'__NGINX_CONF__'"]
+                block += [encoded[i:i + 76] for i in range(0, len(encoded), 76)]
+                block.append("__NGINX_CONF__")
+            block_size = sum(len(line) + 1 for line in block)
+            if len(lines) > 1 and size + block_size > self.script_bytes:
+                scripts.append("\n".join(lines))
+                lines, size = [head], len(head)
+            lines += block
+            size += block_size
+        scripts.append("\n".join(lines))
+        return scripts
+
+    def _commit_script(self, staging: str) -> str:
+        """把临时目录中的文件替换到位（旧文件先备份）、nginx -t，校验失败时恢复；与站点数量无关的固定脚本"""
+        marker = shlex.quote(MANAGED_MARKER)
+        return "\n".join([
+            f"cd {shlex.quote(self.remote_conf_dir)} || exit 3",
+            f"s={staging}",
+            "created=''; backups=''",
+            "for p in \"$s\"/*.conf; do",
+            "    [ -f \"$p\" ] || continue",
+            "    f=${p##*/}",
+            # 不覆盖手工维护的配置
+            f"    if [ -f \"$f\" ] && ! head -n 1 \"$f\" | grep -qF {marker}; then echo \"skip $f\"; continue; fi",
+            # 证书还没签发的SSL站点不替换，避免 nginx -t 失败导致整批配置都无法生效
+            "    missing=''",
+            "    for c in $(awk '$1 == \"ssl_certificate\" || $1 == \"ssl_certificate_key\" { sub(/;$/, \"\", $2); print $2 }' \"$p\"); do",
+            "        [ -f \"$c\" ] || missing=\"$missing $c\"",
+            "    done",
+            "    if [ -n \"$missing\" ]; then echo \"nocert $f$missing\"; rm -f \"$p\"; continue; fi",
+            "    if [ -f \"$f\" ]; then cp -p \"$f\" \".$f.bak\"; backups=\"$backups $f\"; else created=\"$created $f\"; fi",
+            "    chmod 644 \"$p\" && mv -f \"$p\" \"$f\"",
+            "done",
+            "if [ -f \"$s/.remove\" ]; then",
+            "    while read -r f; do",
+            f"        [ -f \"$f\" ] && head -n 1 \"$f\" | grep -qF {marker} || continue",
+            "        mv -f \"$f\" \".$f.bak\"; backups=\"$backups $f\"",
+            "    done < \"$s/.remove\"",
+            "fi",
+            "rm -rf \"$s\"",
+            "if nginx -t 2>&1; then",
+            "    for f in $backups; do rm -f \".$f.bak\"; done",
+            "    nginx -s reload 2>&1 || systemctl reload nginx 2>&1 || exit 5",
+            "else",
+            "    for f in $created; do rm -f \"$f\"; done",
+            "    for f in $backups; do mv -f \".$f.bak\" \"$f\"; done",
+            "    exit 4",
+            "fi",
+        ])
+
+    async def push(self, server: Dict[str, Any], sites: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """把站点配置推送到远程服务器，所有命令复用连接池中的同一个会话
+
+        先读取远程托管文件的哈希，只上传变化的文件到临时目录，最后一个命令替换到位、校验并 reload。
+        """
+        if sites is None:
+            sites = await self.db.afetch_all("SELECT * FROM sites ORDER BY id")
+        # 站点的 config_path 是本机路径，远程统一写到 remote_conf_dir
+        desired, errors, skipped = self.render_all(sites, self.remote_conf_dir)
+        result: Dict[str, Any] = {'server_id': server['id'], 'sites': len(desired), 'errors': errors,
+                                  'written': [], 'removed': []}
+
+        async def run(script: str) -> Tuple[str, str, int]:
+            return await self.transport.exec(server, self._remote(script), timeout=self.command_timeout)
+
+        stdout, stderr, code = await run(self._list_script())
+        if code == 3:
+            return {**result, 'status': 'skipped', 'message': f"远程配置目录不存在: {self.remote_conf_dir}"}
+        if code != 0:
+            return {**result, 'status': 'error', 'message': f"读取远程配置失败: {stderr.strip()}"}
+        remote: Dict[str, str] = {}
+        for line in stdout.splitlines():
+            digest, _, path = line.strip().partition('  ')
+            if path:
+                remote[path] = digest
+
+        changes: List[Tuple[str, Optional[str]]] = [
+            (path, content) for path, content in desired.items() if remote.get(path) != content_hash(content)
+        ]
+        changes += [(path, None) for path in remote if path not in desired and path not in skipped]
+        self.pushes += 1
+        if not changes:
+            return {**result, 'status': 'unchanged'}
+
+        staging = f".copy-www-admin-staging-{uuid.uuid4().hex[:12]}"
+        for script in self._stage_scripts(staging, changes):
+            stdout, stderr, code = await run(script)
+            if code != 0:
+                await run(f"rm -rf {shlex.quote(self.remote_conf_dir)}/{staging}")
+                return {**result, 'status': 'error', 'message': "上传配置文件失败",
+                        'output': (stdout + stderr).strip()}
+
+        stdout, stderr, code = await run(self._commit_script(staging))
+        output = (stdout + stderr).strip()
+        if code == 4:
+            return {**result, 'status': 'invalid', 'message': "远程 nginx -t 校验失败，已恢复原配置", 'output': output}
+        if code != 0:
+            return {**result, 'status': 'error', 'message': "远程配置更新失败", 'output': output}
+        skipped = {line[5:] for line in stdout.splitlines() if line.startswith('skip ')}
+        missing_certs = {}
+        for line in stdout.splitlines():
+            if line.startswith('nocert '):
+                name, _, files = line[7:].partition(' ')
+                missing_certs[name] = files.replace(' ', ', ')
+        for path, content in changes:
+            name = os.path.basename(path)
+            if content is None:
+                continue
+            if name in skipped:
+                result['errors'].append({'path': path, 'error': f"已存在非本系统生成的配置文件: {path}"})
+            elif name in missing_certs:
+                result['errors'].append({'path': path, 'error': f"SSL证书文件不存在，暂不生成配置: {missing_certs[name]}"})
+        result['written'] = [path for path, content in changes if content is not None
+                             and os.path.basename(path) not in skipped and os.path.basename(path) not in missing_certs]
+        result['removed'] = [path for path, content in changes if content is None]
+        return {**result, 'status': 'reloaded'}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'conf_dir': self.conf_dir,
+            'pending': self._first_request is not None,
+            'requests': self.requests,
+            'syncs': self.syncs,
+            'reloads': self.reloads,
+            'files_written': self.files_written,
+            'files_removed': self.files_removed,
+            'test_failures': self.test_failures,
+            'pushes': self.pushes,
+            'tracked_files': len(self._files),
+            'last_result': self.last_result,
+        }
@@ -0,0 +1,204 @@
+from typing import Dict, Any, Optional, Tuple, List
+from datetime import datetime
+import asyncio
+import logging
+import os
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+def read_proc_counts() -> Tuple[int, int]:
+    """从/proc直接得到 (进程数, 线程数)，无需为每个进程构造Process对象
+
+    /proc/loadavg 第四列的分母是当前内核调度实体（线程）总数。
+    """
+    with open('/proc/loadavg') as f:
+        threads = int(f.read().split()[3].split('/')[1])
+    processes = sum(1 for name in os.listdir('/proc') if name.isdigit())
+    return processes, threads
+
+
+class LocalMetricsSampler:
+    """本机指标后台采样器
+
+    在后台任务中按固定间隔刷新一份共享快照，接口直接读取快照，
+    不在请求路径上做任何阻塞采样。CPU使用率使用 cpu_percent(interval=None)，
+    即两次采样之间的差值。
+    """
+
+    def __init__(self, interval: float = 1.0, executor=None,
+                 process_scan_ttl: float = 30.0, top_n: int = 0, top_interval: float = 5.0):
+        self.interval = interval
+        self.executor = executor
+        # 没有/proc时退化为逐进程扫描，扫描结果在TTL内复用
+        self.process_scan_ttl = process_scan_ttl
+        self._proc_fast_path = os.path.exists('/proc/loadavg')
+        self._process_counts: Tuple[int, int] = (0, 0)
+        self._process_scanned_at: Optional[float] = None
+        # 可选的Top-N进程视图（按CPU/内存），0表示关闭
+        self.top_n = top_n
+        self.top_interval = top_interval
+        self._tracked: Dict[int, psutil.Process] = {}
+        self._top: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._top_at: Optional[float] = None
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._sampled_at: Optional[float] = None
+        self._sampled_wall: Optional[datetime] = None
+        self._last_net_io = None
+        self._last_time: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            # 第一次调用 cpu_percent(interval=None) 只用于建立基准
+            psutil.cpu_percent(interval=None)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                self._snapshot = await loop.run_in_executor(self.executor, self.sample)
+                self._sampled_at = time.monotonic()
+                self._sampled_wall = datetime.now()
+            except Exception as e:
+                logger.error(f"采集本机指标失败: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def sample(self) -> Dict[str, Any]:
+        cpu_usage = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        load_average = psutil.getloadavg()
+        net_io = psutil.net_io_counters()
+
+        # 计算速率（与上次采样的差值）
+        current_time = time.monotonic()
+        if self._last_net_io is not None and current_time > self._last_time:
+            time_delta = current_time - self._last_time
+            rx_speed = (net_io.bytes_recv - self._last_net_io.bytes_recv) / time_delta
+            tx_speed = (net_io.bytes_sent - self._last_net_io.bytes_sent) / time_delta
+        else:
+            rx_speed = 0
+            tx_speed = 0
+        self._last_net_io = net_io
+        self._last_time = current_time
+
+        try:
+            total, threads = self.process_counts()
+            processes = {'total': total, 'threads': threads}
+        except Exception as e:
+            logger.error(f"获取进程信息失败: {str(e)}")
+            processes = {'total': 0, 'threads': 0}
+
+        metrics = {
+            'cpu_usage': round(cpu_usage, 2),
+            'memory_usage': round(memory.percent, 2),
+            'memory_total': round(memory.total / (1024 * 1024 * 1024), 2),
+            'memory_used': round(memory.used / (1024 * 1024 * 1024), 2),
+            'disk_usage': round(disk.percent, 2),
+            'disk_total': round(disk.total / (1024 * 1024 * 1024), 2),
+            'disk_used': round(disk.used / (1024 * 1024 * 1024), 2),
+            'load_average': load_average,
+            'network': {
+                'rx_bytes': round(rx_speed, 1),  # 当前接收速率
+                'tx_bytes': round(tx_speed, 1),  # 当前发送速率
+                'rx_bytes_total': net_io.bytes_recv,  # 总接收量
+                'tx_bytes_total': net_io.bytes_sent   # 总发送量
+            },
+            'processes': processes,
+            'timestamp': datetime.now().isoformat()
+        }
+        if self.top_n:
+            metrics['top_processes'] = self.top_processes()
+        return metrics
+
+    def process_counts(self) -> Tuple[int, int]:
+        if self._proc_fast_path:
+            try:
+                return read_proc_counts()
+            except (OSError, ValueError, IndexError):
+                self._proc_fast_path = False
+
+        now = time.monotonic()
+        if self._process_scanned_at is None or now - self._process_scanned_at >= self.process_scan_ttl:
+            threads = sum(p.info['num_threads'] or 0 for p in psutil.process_iter(['num_threads']))
+            self._process_counts = (len(psutil.pids()), threads)
+            self._process_scanned_at = now
+        return self._process_counts
+
+    def top_processes(self) -> Dict[str, List[Dict[str, Any]]]:
+        """增量维护Top-N进程视图
+
+        Process对象按pid缓存复用，每轮只为新出现的进程构造对象，
+        cpu_percent(None) 基于同一对象上次调用以来的差值，不会阻塞。
+        """
+        now = time.monotonic()
+        if self._top is not None and now - self._top_at < self.top_interval:
+            return self._top
+
+        pids = set(psutil.pids())
+        for pid in list(self._tracked):
+            if pid not in pids:
+                del self._tracked[pid]
+
+        rows = []
+        for pid in pids:
+            proc = self._tracked.get(pid)
+            if proc is None:
+                try:
+                    proc = psutil.Process(pid)
+                    # 首次调用只建立CPU基准
+                    proc.cpu_percent(None)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+                self._tracked[pid] = proc
+                continue
+            try:
+                with proc.oneshot():
+                    rows.append({
+                        'pid': pid,
+                        'name': proc.name(),
+                        'cpu_percent': round(proc.cpu_percent(None), 2),
+                        'rss': proc.memory_info().rss
+                    })
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self._tracked.pop(pid, None)
+
+        self._top = {
+            'by_cpu': sorted(rows, key=lambda r: r['cpu_percent'], reverse=True)[:self.top_n],
+            'by_rss': sorted(rows, key=lambda r: r['rss'], reverse=True)[:self.top_n]
+        }
+        self._top_at = now
+        return self._top
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回最近一次采样结果及其新鲜度信息"""
+        if self._snapshot is None:
+            return {
+                'server_info': {'status': 'pending'},
+                'metrics': None,
+                'sampled_at': None,
+                'age': None,
+                'stale': True
+            }
+        age = time.monotonic() - self._sampled_at
+        return {
+            'server_info': {'status': 'active'},
+            'metrics': self._snapshot,
+            'sampled_at': self._sampled_wall.isoformat(),
+            'age': round(age, 3),
+            'stale': age > self.interval * 3
+        }
@@ -0,0 +1,255 @@
+from typing import Dict, Any, Optional, Callable
+from concurrent.futures import Executor, Future
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道：数值越小越先执行
+PRIORITY_INTERACTIVE = 0   # 用户发起的请求（执行命令、测试连接等）
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2    # 后台采集、回收等周期任务
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+
+class SchedulerClosed(RuntimeError):
+    """调度器已关闭，不再接受新任务"""
+
+
+class _LaneStats:
+    __slots__ = ('queued', 'submitted', 'completed', 'failed', 'wait_total', 'wait_max', 'run_total')
+
+    def __init__(self):
+        self.queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        done = self.completed + self.failed
+        return {
+            'queued': self.queued,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_ms': round(self.wait_total / done * 1000, 3) if done else 0,
+            'max_wait_ms': round(self.wait_max * 1000, 3),
+            'avg_run_ms': round(self.run_total / done * 1000, 3) if done else 0,
+        }
+
+
+class WorkerPool(Executor):
+    """有界线程池，任务按优先级出队
+
+    线程按需创建，最多 max_workers 个；同一优先级内先进先出。
+    实现了 concurrent.futures.Executor 接口，可以直接传给 run_in_executor，
+    此时使用 default_priority；lane(priority) 返回绑定了其它优先级的执行器。
+    """
+
+    def __init__(self, name: str, max_workers: int, default_priority: int = PRIORITY_NORMAL):
+        self.name = name
+        self.max_workers = max_workers
+        self.default_priority = default_priority
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+        self._active = 0
+        self._closed = False
+        self._lanes: Dict[int, _LaneStats] = {}
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        return self.submit_with_priority(self.default_priority, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority: int, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise SchedulerClosed(f"{self.name} 线程池已关闭")
+            lane = self._lanes.setdefault(priority, _LaneStats())
+            lane.queued += 1
+            lane.submitted += 1
+            self._queue.put((priority, next(self._seq), time.monotonic(), future, fn, args, kwargs))
+            if self._idle == 0 and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, name=f"{self.name}-{len(self._threads)}",
+                                          daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            else:
+                self._idle = max(self._idle - 1, 0)
+        return future
+
+    def lane(self, priority: int) -> "_Lane":
+        return _Lane(self, priority)
+
+    def _worker(self) -> None:
+        while True:
+            priority, _, queued_at, future, fn, args, kwargs = self._queue.get()
+            if fn is None:
+                return
+            started = time.monotonic()
+            with self._lock:
+                lane = self._lanes[priority]
+                lane.queued -= 1
+                wait = started - queued_at
+                lane.wait_total += wait
+                lane.wait_max = max(lane.wait_max, wait)
+                self._active += 1
+
+            ok = False
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                    ok = True
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._lock:
+                self._active -= 1
+                lane.run_total += time.monotonic() - started
+                if ok:
+                    lane.completed += 1
+                else:
+                    lane.failed += 1
+                self._idle += 1
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return sum(lane.queued for lane in self._lanes.values()) + self._active
+
+    def close(self) -> None:
+        """停止接受新任务，已排队的任务继续执行"""
+        with self._lock:
+            self._closed = True
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.close()
+        if cancel_futures:
+            self.cancel_pending()
+        with self._lock:
+            threads = list(self._threads)
+        # 退出信号排在所有任务之后
+        for _ in threads:
+            self._queue.put((float('inf'), next(self._seq), 0, None, None, None, None))
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def cancel_pending(self) -> int:
+        """取消尚未开始执行的任务"""
+        cancelled = 0
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[3] is None:
+                remaining.append(item)
+                continue
+            priority, future = item[0], item[3]
+            with self._lock:
+                self._lanes[priority].queued -= 1
+            if future.cancel():
+                cancelled += 1
+        for item in remaining:
+            self._queue.put(item)
+        return cancelled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'threads': len(self._threads),
+                'active': self._active,
+                'queued': sum(lane.queued for lane in self._lanes.values()),
+                'lanes': {PRIORITY_NAMES.get(p, str(p)): lane.as_dict()
+                          for p, lane in sorted(self._lanes.items())},
+            }
+
+
+class _Lane(Executor):
+    """WorkerPool 上绑定固定优先级的执行器视图"""
+
+    def __init__(self, pool: WorkerPool, priority: int):
+        self.pool = pool
+        self.priority = priority
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        return self.pool.submit_with_priority(self.priority, fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        # 生命周期由所属线程池管理
+        pass
+
+
+class Scheduler:
+    """所有阻塞操作的统一调度器
+
+    按工作类型划分独立的有界线程池（ssh / subprocess / db），互不挤占；
+    每个池内按优先级通道出队，交互请求排在后台任务之前。
+    """
+
+    def __init__(self, pools: Dict[str, int]):
+        self.pools: Dict[str, WorkerPool] = {
+            name: WorkerPool(name, workers) for name, workers in pools.items()
+        }
+
+    def pool(self, name: str) -> WorkerPool:
+        return self.pools[name]
+
+    def executor(self, name: str, priority: int = PRIORITY_NORMAL) -> Executor:
+        return self.pools[name].lane(priority)
+
+    async def run(self, pool: str, func: Callable, *args,
+                  priority: int = PRIORITY_NORMAL, **kwargs) -> Any:
+        future = self.pools[pool].submit_with_priority(priority, functools.partial(func, *args, **kwargs))
+        return await asyncio.wrap_future(future)
+
+    async def drain(self, timeout: float = 10.0) -> bool:
+        """停止接受新任务并等待已排队的任务完成，超时后取消剩余任务
+
+        返回是否在超时前全部完成。
+        """
+        for pool in self.pools.values():
+            pool.close()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while any(pool.pending for pool in self.pools.values()):
+            if loop.time() >= deadline:
+                break
+            await asyncio.sleep(0.05)
+        drained = not any(pool.pending for pool in self.pools.values())
+        if not drained:
+            cancelled = sum(pool.cancel_pending() for pool in self.pools.values())
+            logger.warning(f"调度器关闭超时，取消了 {cancelled} 个未执行的任务")
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+        return drained
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+# 进程内共享的调度器，线程数可通过环境变量配置
+scheduler = Scheduler({
+    'ssh': int(os.getenv("SCHED_SSH_WORKERS", "64")),
+    'subprocess': int(os.getenv("SCHED_SUBPROCESS_WORKERS", "4")),
+    'db': int(os.getenv("SCHED_DB_WORKERS", "5")),
+})
@@ -0,0 +1,163 @@
+from typing import Dict, Any, Optional, Iterable, Tuple, List
+from datetime import timedelta
+import asyncio
+import logging
+
+from services.timeseries import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+# 上报行的列顺序：(server_id, service_name, status, port, pid, memory_usage, cpu_usage)
+ROW_SERVER_ID = 0
+ROW_SERVICE_NAME = 1
+ROW_STATUS = 2
+
+SERVICE_CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS service_status_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id INTEGER NOT NULL,
+    service_name TEXT NOT NULL,
+    old_status TEXT,
+    new_status TEXT,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+);
+CREATE INDEX IF NOT EXISTS idx_service_status_changes_server_time
+    ON service_status_changes (server_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_service_status_changes_time
+    ON service_status_changes (changed_at);
+"""
+
+UPSERT_SQL = """
+    INSERT INTO service_status
+    (server_id, service_name, status, port, pid, memory_usage, cpu_usage, updated_at, changed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (server_id, service_name) DO UPDATE SET
+    status = excluded.status,
+    port = excluded.port,
+    pid = excluded.pid,
+    memory_usage = excluded.memory_usage,
+    cpu_usage = excluded.cpu_usage,
+    updated_at = excluded.updated_at,
+    changed_at = CASE WHEN service_status.status IS excluded.status
+                      THEN service_status.changed_at ELSE excluded.changed_at END
+"""
+
+
+class ServiceStateStore:
+    """服务状态存储
+
+    service_status 只保存每个 (server_id, service_name) 的当前状态，上报时原地更新，
+    读取当前服务列表只与服务数量有关；状态发生变化时才向 service_status_changes 追加一条记录，
+    变更记录按 retention_days 单独清理。
+    """
+
+    def __init__(self, db, retention_days: int = 90, prune_batch: int = 1000, prune_pause: float = 0.05):
+        self.db = db
+        self.retention_days = retention_days
+        self.prune_batch = prune_batch
+        self.prune_pause = prune_pause
+
+    def create_schema(self) -> None:
+        """创建变更记录表，并把旧的追加式 service_status 迁移为当前状态表"""
+        with self.db.transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(service_status)")}
+            if 'changed_at' not in columns:
+                conn.execute("ALTER TABLE service_status ADD COLUMN changed_at TIMESTAMP")
+            for statement in SERVICE_CHANGES_SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+
+            indexes = {row[1] for row in conn.execute("PRAGMA index_list(service_status)")}
+            if 'idx_service_status_server_service' in indexes:
+                return
+
+            # 历史行中的状态变化写入变更记录，然后每个服务只保留最新一行
+            conn.execute("""
+                INSERT INTO service_status_changes (server_id, service_name, old_status, new_status, changed_at)
+                SELECT server_id, service_name, previous, status, updated_at FROM (
+                    SELECT server_id, service_name, status, updated_at,
+                           LAG(status) OVER (PARTITION BY server_id, service_name ORDER BY id) AS previous,
+                           ROW_NUMBER() OVER (PARTITION BY server_id, service_name ORDER BY id) AS n
+                    FROM service_status
+                    WHERE server_id IS NOT NULL AND service_name IS NOT NULL
+                ) WHERE n = 1 OR previous IS NOT status
+            """)
+            conn.execute("""
+                UPDATE service_status SET changed_at = (
+                    SELECT MAX(c.changed_at) FROM service_status_changes c
+                    WHERE c.server_id = service_status.server_id
+                      AND c.service_name = service_status.service_name
+                )
+            """)
+            conn.execute("""
+                DELETE FROM service_status WHERE id NOT IN (
+                    SELECT MAX(id) FROM service_status GROUP BY server_id, service_name
+                )
+            """)
+            conn.execute("""
+                CREATE UNIQUE INDEX idx_service_status_server_service
+                ON service_status (server_id, service_name)
+            """)
+
+    # ---- 写入 ----
+
+    def apply(self, conn, rows: Iterable[Tuple]) -> None:
+        """IngestPipeline 的写入钩子：更新当前状态并记录状态变化（同一事务）"""
+        rows = list(rows)
+        server_ids = sorted({row[ROW_SERVER_ID] for row in rows})
+        placeholders = ','.join('?' * len(server_ids))
+        current: Dict[Tuple[int, str], Optional[str]] = {
+            (server_id, name): status for server_id, name, status in conn.execute(
+                f"SELECT server_id, service_name, status FROM service_status WHERE server_id IN ({placeholders})",
+                server_ids,
+            )
+        }
+
+        now = utc_now().strftime(TIME_FORMAT)
+        latest: Dict[Tuple[int, str], Tuple] = {}
+        changes: List[Tuple] = []
+        for row in rows:
+            key = (row[ROW_SERVER_ID], row[ROW_SERVICE_NAME])
+            previous = current.get(key, ...)
+            if previous is ... or previous != row[ROW_STATUS]:
+                changes.append((*key, None if previous is ... else previous, row[ROW_STATUS], now))
+                current[key] = row[ROW_STATUS]
+            # 同一批次内同一服务的多次上报只写最后一次
+            latest[key] = row
+
+        conn.executemany(UPSERT_SQL, [(*row, now, now) for row in latest.values()])
+        if changes:
+            conn.executemany("""
+                INSERT INTO service_status_changes (server_id, service_name, old_status, new_status, changed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, changes)
+
+    # ---- 清理 ----
+
+    def _prune_batch(self, cutoff: str) -> int:
+        return self.db.execute_rowcount("""
+            DELETE FROM service_status_changes WHERE id IN (
+                SELECT id FROM service_status_changes WHERE changed_at < ? LIMIT ?
+            )
+        """, (cutoff, self.prune_batch))
+
+    async def prune(self) -> int:
+        cutoff = (utc_now() - timedelta(days=self.retention_days)).strftime(TIME_FORMAT)
+        total = 0
+        while True:
+            count = await self.db.run(self._prune_batch, cutoff)
+            total += count
+            if count < self.prune_batch:
+                return total
+            await asyncio.sleep(self.prune_pause)
+
+    async def run_retention(self, interval: float = 3600) -> None:
+        while True:
+            try:
+                removed = await self.prune()
+                if removed:
+                    logger.info(f"清理过期服务状态变更记录: {removed}")
+            except Exception as e:
+                logger.error(f"清理服务状态变更记录失败: {str(e)}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,406 @@
+from typing import Dict, Any, Optional, Tuple, Callable
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+
+class SSHConnectError(Exception):
+    """SSH连接建立失败"""
+
+
+class CommandTimeout(Exception):
+    """命令执行超时"""
+
+
+class CommandCancelled(Exception):
+    """命令被取消"""
+
+
+# 已解析的私钥缓存：key_path -> (mtime, PKey)，避免每次连接都重新读取和解析密钥文件
+_key_cache: Dict[str, Tuple[float, paramiko.PKey]] = {}
+_key_cache_lock = threading.Lock()
+
+
+def load_private_key(key_path: str) -> paramiko.PKey:
+    mtime = os.path.getmtime(key_path)
+    with _key_cache_lock:
+        cached = _key_cache.get(key_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    private_key = paramiko.RSAKey.from_private_key_file(key_path)
+    with _key_cache_lock:
+        _key_cache[key_path] = (mtime, private_key)
+    return private_key
+
+
+def open_ssh_client(server_data: Dict[str, Any], timeout: Optional[float] = None) -> paramiko.SSHClient:
+    """建立一个新的SSH连接（不经过连接池）"""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    if server_data['auth_type'] == 'key':
+        key_path = server_data['key_path']
+        if not key_path or not os.path.exists(key_path):
+            raise SSHConnectError("SSH密钥文件不存在")
+        ssh.connect(
+            server_data['ip'],
+            port=server_data.get('port') or 22,
+            username=server_data['username'],
+            pkey=load_private_key(key_path),
+            timeout=timeout,
+        )
+    else:
+        ssh.connect(
+            server_data['ip'],
+            port=server_data.get('port') or 22,
+            username=server_data['username'],
+            password=server_data.get('password'),
+            timeout=timeout,
+        )
+    return ssh
+
+
+def session_key(server_data: Dict[str, Any]) -> Tuple:
+    """连接池键：服务器ID + 连接凭据，凭据变更后自动使用新会话"""
+    secret = server_data.get('password') or ''
+    return (
+        server_data.get('id'),
+        server_data['ip'],
+        server_data.get('port') or 22,
+        server_data['username'],
+        server_data['auth_type'],
+        server_data.get('key_path'),
+        hashlib.sha256(secret.encode()).hexdigest(),
+    )
+
+
+class _PooledSession:
+    def __init__(self, client: paramiko.SSHClient, max_channels: int):
+        self.client = client
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.in_use = 0
+        # sshd 默认 MaxSessions=10，同一连接上并发channel超过上限会被拒绝
+        self.channels = threading.BoundedSemaphore(max_channels)
+
+    @property
+    def transport(self) -> Optional[paramiko.Transport]:
+        return self.client.get_transport()
+
+    def is_alive(self) -> bool:
+        transport = self.transport
+        return transport is not None and transport.is_active()
+
+    def ping(self) -> bool:
+        """对空闲会话做一次保活探测"""
+        transport = self.transport
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class _ConnectLock:
+    """按键串行化建连的锁；users 为已取得但尚未用完该锁的线程数，为0时才能从字典中移除"""
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class SSHSessionPool:
+    """按服务器和凭据复用已认证SSH传输的连接池
+
+    每个键只保持一个Transport，多条命令通过同一Transport上的不同channel并发执行，
+    单个会话的并发channel数不超过 max_channels（低于sshd默认的MaxSessions=10）；
+    空闲超过 idle_timeout 或超过 max_sessions（LRU）的会话会被回收，
+    失效的会话在下一次使用时透明重连。
+    """
+
+    def __init__(self, max_sessions: int = 64, idle_timeout: float = 300,
+                 keepalive_interval: int = 30, connect_timeout: float = 10,
+                 max_channels: int = 8):
+        self.max_sessions = max_sessions
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+
+        self._sessions: "OrderedDict[Tuple, _PooledSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connect_locks: Dict[Tuple, _ConnectLock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self.channel_waits = 0
+        self.channel_rejects = 0
+
+    def _connect(self, server_data: Dict[str, Any]) -> _PooledSession:
+        client = open_ssh_client(server_data, timeout=self.connect_timeout)
+        transport = client.get_transport()
+        if transport is not None and self.keepalive_interval:
+            transport.set_keepalive(self.keepalive_interval)
+        return _PooledSession(client, self.max_channels)
+
+    def _checkout(self, server_data: Dict[str, Any]) -> Tuple[Tuple, _PooledSession]:
+        key = session_key(server_data)
+        self.evict_idle()
+
+        with self._lock:
+            connect_lock = self._connect_locks.get(key)
+            if connect_lock is None:
+                connect_lock = self._connect_locks[key] = _ConnectLock()
+            connect_lock.users += 1
+        try:
+            return self._checkout_locked(server_data, key, connect_lock.lock)
+        finally:
+            with self._lock:
+                connect_lock.users -= 1
+                if key not in self._sessions:
+                    self._drop_connect_lock(key)
+
+    def _checkout_locked(self, server_data: Dict[str, Any], key: Tuple,
+                         connect_lock: threading.Lock) -> Tuple[Tuple, _PooledSession]:
+        # 同一个键的建连串行化，避免并发请求同时握手
+        overflow = []
+        with connect_lock:
+            stale = None
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is not None:
+                    idle = time.monotonic() - session.last_used
+                    healthy = session.is_alive() and (
+                        idle < self.keepalive_interval or session.in_use or session.ping()
+                    )
+                    if healthy:
+                        self.hits += 1
+                        session.in_use += 1
+                        self._sessions.move_to_end(key)
+                        return key, session
+                    stale = self._sessions.pop(key)
+                    self.reconnects += 1
+                else:
+                    self.misses += 1
+
+            if stale is not None:
+                logger.info(f"SSH会话已失效，重新连接: {server_data['ip']}")
+                stale.close()
+
+            session = self._connect(server_data)
+            duplicate = None
+            with self._lock:
+                existing = self._sessions.get(key)
+                if existing is not None and existing.is_alive():
+                    # 键下已有可用会话时复用它，新建的连接关闭，不覆盖导致旧会话泄漏
+                    duplicate, session = session, existing
+                else:
+                    if existing is not None:
+                        overflow.append(existing)
+                    self._sessions[key] = session
+                    overflow += self._pop_lru()
+                session.in_use += 1
+
+        if duplicate is not None:
+            duplicate.close()
+        for old in overflow:
+            old.close()
+        return key, session
+
+    def _release(self, session: _PooledSession) -> None:
+        with self._lock:
+            session.in_use -= 1
+            session.last_used = time.monotonic()
+
+    def _discard(self, key: Tuple, session: _PooledSession) -> None:
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+                self._drop_connect_lock(key)
+        session.close()
+
+    def _drop_connect_lock(self, key: Tuple) -> None:
+        """会话移出连接池后清理对应的建连锁，避免凭据变更等场景下锁字典无限增长（调用方需持有 self._lock）
+
+        有线程已取得该锁（即使还没有加锁）时保留，否则后来者会新建一把锁，同一个键并发建连。
+        """
+        connect_lock = self._connect_locks.get(key)
+        if connect_lock is not None and not connect_lock.users:
+            del self._connect_locks[key]
+
+    def _pop_lru(self) -> list:
+        """超出容量时按LRU顺序淘汰空闲会话（调用方需持有 self._lock）"""
+        evicted = []
+        if len(self._sessions) <= self.max_sessions:
+            return evicted
+        for key in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if self._sessions[key].in_use:
+                continue
+            evicted.append(self._sessions.pop(key))
+            self._drop_connect_lock(key)
+            self.evictions += 1
+        return evicted
+
+    def evict_idle(self) -> int:
+        """回收空闲超时的会话，返回回收数量"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for key in list(self._sessions):
+                session = self._sessions[key]
+                if session.in_use:
+                    continue
+                if now - session.last_used >= self.idle_timeout or not session.is_alive():
+                    evicted.append(self._sessions.pop(key))
+                    self._drop_connect_lock(key)
+                    self.evictions += 1
+        for session in evicted:
+            session.close()
+        return len(evicted)
+
+    def stream_command(self, server_data: Dict[str, Any], command: str,
+                       on_output: Callable[[str, bytes], None],
+                       cancel: Optional[threading.Event] = None,
+                       timeout: Optional[float] = None,
+                       chunk_size: int = 32768) -> int:
+        """在池化会话上执行命令，stdout/stderr 数据一到就交给 on_output(stream, data)
+
+        两个流交替读取，不会因为一个流的缓冲区写满而死锁。返回退出码；
+        超时抛出 CommandTimeout，cancel 被设置时抛出 CommandCancelled，两种情况都会关闭channel。
+        会话上的并发channel已满时等待空位；打开channel失败且传输已断开时自动重连并重试一次，
+        服务端拒绝打开channel（ChannelException）时传输仍然可用，不丢弃会话，直接抛出。
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        for attempt in range(2):
+            key, session = self._checkout(server_data)
+            try:
+                self._acquire_channel(session, cancel, deadline)
+                try:
+                    try:
+                        channel = session.transport.open_session()
+                    except paramiko.ChannelException as e:
+                        with self._lock:
+                            self.channel_rejects += 1
+                        logger.warning(f"服务器拒绝打开SSH channel: {server_data['ip']}: {e}")
+                        raise
+                    except (paramiko.SSHException, EOFError, socket.error, AttributeError):
+                        transport = session.transport
+                        if transport is not None and transport.is_active():
+                            raise
+                        self._discard(key, session)
+                        if attempt:
+                            raise
+                        with self._lock:
+                            self.reconnects += 1
+                        continue
+                    try:
+                        channel.exec_command(command)
+                        remaining = deadline - time.monotonic() if deadline is not None else None
+                        return self._pump(channel, on_output, cancel, remaining, chunk_size)
+                    finally:
+                        channel.close()
+                finally:
+                    session.channels.release()
+            finally:
+                self._release(session)
+        raise SSHConnectError("SSH会话重连失败")
+
+    def _acquire_channel(self, session: _PooledSession, cancel: Optional[threading.Event],
+                         deadline: Optional[float]) -> None:
+        """占用会话的一个channel名额，名额用完时等待，期间响应取消和超时"""
+        if session.channels.acquire(blocking=False):
+            return
+        with self._lock:
+            self.channel_waits += 1
+        while not session.channels.acquire(timeout=0.1):
+            if cancel is not None and cancel.is_set():
+                raise CommandCancelled("命令已取消")
+            if deadline is not None and time.monotonic() > deadline:
+                raise CommandTimeout("等待SSH channel超时")
+
+    def _pump(self, channel: paramiko.Channel, on_output: Callable[[str, bytes], None],
+              cancel: Optional[threading.Event], timeout: Optional[float], chunk_size: int) -> int:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            progressed = False
+            while channel.recv_ready():
+                data = channel.recv(chunk_size)
+                if not data:
+                    break
+                on_output('stdout', data)
+                progressed = True
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(chunk_size)
+                if not data:
+                    break
+                on_output('stderr', data)
+                progressed = True
+
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                return channel.recv_exit_status()
+            if cancel is not None and cancel.is_set():
+                raise CommandCancelled("命令已取消")
+            if deadline is not None and time.monotonic() > deadline:
+                raise CommandTimeout("命令执行超时")
+            if not progressed:
+                # channel.fileno() 在stdout或stderr有数据时可读
+                select.select([channel], [], [], 0.1)
+
+    def exec_command(self, server_data: Dict[str, Any], command: str,
+                     timeout: Optional[float] = None) -> Tuple[str, str]:
+        """在池化会话上执行命令，返回 (stdout, stderr)
+
+        打开channel失败时（传输已断开）自动重连并重试一次；
+        命令已经开始执行后的错误不会重试，避免命令被执行两次。
+        """
+        buffers = {'stdout': [], 'stderr': []}
+        self.stream_command(server_data, command, lambda stream, data: buffers[stream].append(data),
+                            timeout=timeout)
+        # 输出不一定是UTF-8（如采集脚本读取的 /proc 内容），无法解码的字节用替换字符代替
+        return (b''.join(buffers['stdout']).decode(errors='replace'),
+                b''.join(buffers['stderr']).decode(errors='replace'))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'in_use': sum(1 for s in self._sessions.values() if s.in_use),
+                'max_sessions': self.max_sessions,
+                'max_channels': self.max_channels,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'evictions': self.evictions,
+                'channel_waits': self.channel_waits,
+                'channel_rejects': self.channel_rejects,
+            }
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._connect_locks.clear()
+        for session in sessions:
+            session.close()
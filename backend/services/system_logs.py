@@ -0,0 +1,337 @@
+from typing import Dict, Any, Optional, List, Tuple, Iterable, AsyncIterator
+from datetime import timedelta
+import asyncio
+import json
+import logging
+import zlib
+
+from services.timeseries import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+# 写入行的列顺序：(server_id, log_type, message, severity, created_at)
+INSERT_SQL = """
+    INSERT INTO system_logs (server_id, log_type, message, severity, created_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+LOG_COLUMNS = ('id', 'server_id', 'log_type', 'message', 'severity', 'created_at')
+
+SYSTEM_LOGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS system_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id INTEGER,
+    log_type TEXT,
+    message TEXT,
+    severity TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+);
+CREATE INDEX IF NOT EXISTS idx_system_logs_server_time ON system_logs (server_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_system_logs_server_severity ON system_logs (server_id, severity, created_at);
+CREATE TABLE IF NOT EXISTS system_log_segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id INTEGER NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    start_at TIMESTAMP,
+    end_at TIMESTAMP,
+    line_count INTEGER NOT NULL,
+    severities TEXT,
+    raw_bytes INTEGER,
+    data BLOB NOT NULL,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+);
+CREATE INDEX IF NOT EXISTS idx_system_log_segments_server ON system_log_segments (server_id, last_id);
+"""
+
+
+def log_row(log: Dict[str, Any], created_at: str) -> Tuple:
+    """单条日志转换为写入行，字段类型不对时抛出 ValueError（只拒绝这一条，不影响同批其它日志）"""
+    server_id = log.get('server_id')
+    if not isinstance(server_id, int) or isinstance(server_id, bool):
+        raise ValueError("server_id 必须是整数")
+    for field in ('log_type', 'message', 'severity'):
+        if log.get(field) is not None and not isinstance(log[field], str):
+            raise ValueError(f"{field} 必须是字符串")
+    if log.get('message') is None:
+        raise ValueError("缺少 message")
+    return (
+        server_id, log.get('log_type'), log['message'],
+        (log.get('severity') or 'info').lower(), created_at,
+    )
+
+
+class _Tail:
+    __slots__ = ('queue', 'severity', 'dropped')
+
+    def __init__(self, max_queue: int, severity: Optional[str]):
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.severity = severity
+        self.dropped = 0
+
+
+class SystemLogStore:
+    """系统日志存储
+
+    - 写入经独立的 IngestPipeline 批量合并（见 main.log_ingest），不占用监控数据的写入队列
+    - 超过 compress_after 秒的日志按服务器分段（每段最多 segment_lines 行）压缩进 system_log_segments
+    - 每台服务器最多保留 max_lines_per_server 行（明细 + 压缩段），超出时先删最旧的段；
+      超过 retention_days 的日志整体删除
+    - 查询按 id 倒序分页，最近的日志来自明细表，更早的从压缩段中解压
+    - tail() 订阅实时日志，每个订阅者一个有界队列，消费慢时丢弃并计数
+    """
+
+    def __init__(self, db, retention_days: float = 30, max_lines_per_server: int = 1000000,
+                 compress_after: float = 86400, segment_lines: int = 2000, compress_level: int = 6,
+                 prune_batch: int = 5000, batch_pause: float = 0.05, tail_queue: int = 1000):
+        self.db = db
+        self.retention_days = retention_days
+        self.max_lines_per_server = max_lines_per_server
+        self.compress_after = compress_after
+        self.segment_lines = segment_lines
+        self.compress_level = compress_level
+        self.prune_batch = prune_batch
+        self.batch_pause = batch_pause
+        self.tail_queue = tail_queue
+        self._tails: Dict[int, set] = {}
+
+        self.published = 0
+        self.tail_dropped = 0
+        self.segments_written = 0
+        self.lines_compressed = 0
+        self.lines_pruned = 0
+
+    def create_schema(self) -> None:
+        with self.db.transaction() as conn:
+            for statement in SYSTEM_LOGS_SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+
+    # ---- 实时订阅 ----
+
+    def publish(self, rows: Iterable[Tuple]) -> None:
+        """把已入队的日志行推送给订阅者（入队即推送，不等待写入数据库）"""
+        if not self._tails:
+            return
+        for row in rows:
+            tails = self._tails.get(row[0])
+            if not tails:
+                continue
+            entry = dict(zip(LOG_COLUMNS[1:], row))
+            for tail in tails:
+                if tail.severity and tail.severity != entry['severity']:
+                    continue
+                try:
+                    tail.queue.put_nowait(entry)
+                    self.published += 1
+                except asyncio.QueueFull:
+                    tail.dropped += 1
+                    self.tail_dropped += 1
+
+    async def tail(self, server_id: int, backlog: int = 50,
+                   severity: Optional[str] = None, keepalive: float = 15) -> AsyncIterator[Dict[str, Any]]:
+        """先产出最近 backlog 条日志，再持续产出新日志
+
+        先订阅再读取历史，刚写入的日志可能重复出现一次，但不会遗漏。
+        超过 keepalive 秒没有日志时产出 {'type': 'keepalive'}，用于发现已断开的客户端。
+        """
+        # 写入时级别统一为小写（见 log_row），过滤条件同样处理
+        severity = severity.lower() if severity else None
+        tail = _Tail(self.tail_queue, severity)
+        self._tails.setdefault(server_id, set()).add(tail)
+        try:
+            if backlog:
+                page = await self.page(server_id, limit=backlog, severity=severity)
+                for item in reversed(page['items']):
+                    yield {'type': 'log', **item}
+            while True:
+                if tail.dropped:
+                    yield {'type': 'dropped', 'count': tail.dropped}
+                    tail.dropped = 0
+                try:
+                    entry = await asyncio.wait_for(tail.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield {'type': 'keepalive'}
+                    continue
+                yield {'type': 'log', **entry}
+        finally:
+            tails = self._tails.get(server_id)
+            if tails is not None:
+                tails.discard(tail)
+                if not tails:
+                    del self._tails[server_id]
+
+    # ---- 查询 ----
+
+    async def page(self, server_id: int, limit: int = 100, before_id: Optional[int] = None,
+                   severity: Optional[str] = None, log_type: Optional[str] = None) -> Dict[str, Any]:
+        severity = severity.lower() if severity else None
+        return await self.db.run(self._page, server_id, limit, before_id, severity, log_type)
+
+    def _page(self, server_id: int, limit: int, before_id: Optional[int],
+              severity: Optional[str], log_type: Optional[str]) -> Dict[str, Any]:
+        wanted = limit + 1
+        conditions = ["server_id = ?"]
+        params: List[Any] = [server_id]
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if severity:
+            conditions.append("severity = ?")
+            params.append(severity)
+        if log_type:
+            conditions.append("log_type = ?")
+            params.append(log_type)
+
+        with self.db.get_connection() as conn:
+            items = [dict(row) for row in conn.execute(f"""
+                SELECT {', '.join(LOG_COLUMNS)} FROM system_logs
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id DESC LIMIT ?
+            """, (*params, wanted))]
+
+            # 压缩段按 last_id 倒序合并，已凑够且段内都比第 wanted 条旧时停止
+            segment_conditions = ["server_id = ?"]
+            segment_params: List[Any] = [server_id]
+            if before_id is not None:
+                segment_conditions.append("first_id < ?")
+                segment_params.append(before_id)
+            if severity:
+                segment_conditions.append("severities LIKE ?")
+                segment_params.append(f"%,{severity},%")
+            segments = conn.execute(f"""
+                SELECT last_id, data FROM system_log_segments
+                WHERE {' AND '.join(segment_conditions)}
+                ORDER BY last_id DESC
+            """, segment_params)
+            for last_id, data in segments:
+                if len(items) >= wanted and last_id < items[wanted - 1]['id']:
+                    break
+                for values in json.loads(zlib.decompress(data)):
+                    item = dict(zip(LOG_COLUMNS, (values[0], server_id, *values[1:])))
+                    if before_id is not None and item['id'] >= before_id:
+                        continue
+                    if (severity and item['severity'] != severity) or (log_type and item['log_type'] != log_type):
+                        continue
+                    items.append(item)
+                items.sort(key=lambda item: item['id'], reverse=True)
+                del items[wanted:]
+
+        next_cursor = items[limit - 1]['id'] if len(items) > limit else None
+        return {'items': items[:limit], 'next_cursor': next_cursor}
+
+    # ---- 压缩与清理 ----
+
+    def _server_ids(self) -> List[int]:
+        with self.db.get_connection() as conn:
+            return [row[0] for row in conn.execute("""
+                SELECT DISTINCT server_id FROM system_logs WHERE server_id IS NOT NULL
+                UNION SELECT DISTINCT server_id FROM system_log_segments
+            """)]
+
+    def _compact_batch(self, server_id: int, cutoff: str) -> int:
+        """把一批早于 cutoff 的明细日志压缩成一个段，返回压缩的行数"""
+        with self.db.transaction() as conn:
+            rows = conn.execute("""
+                SELECT id, log_type, message, severity, created_at FROM system_logs
+                WHERE server_id = ? AND created_at < ?
+                ORDER BY created_at, id LIMIT ?
+            """, (server_id, cutoff, self.segment_lines)).fetchall()
+            if not rows:
+                return 0
+            rows = sorted((tuple(row) for row in rows), key=lambda row: row[0])
+            raw = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode()
+            severities = sorted({row[3] for row in rows if row[3]})
+            conn.execute("""
+                INSERT INTO system_log_segments
+                (server_id, first_id, last_id, start_at, end_at, line_count, severities, raw_bytes, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (server_id, rows[0][0], rows[-1][0], min(row[4] for row in rows),
+                  max(row[4] for row in rows), len(rows), f",{','.join(severities)},", len(raw),
+                  zlib.compress(raw, self.compress_level)))
+            conn.executemany("DELETE FROM system_logs WHERE id = ?", [(row[0],) for row in rows])
+        self.segments_written += 1
+        self.lines_compressed += len(rows)
+        return len(rows)
+
+    def _prune_expired(self, server_id: int, cutoff: str) -> int:
+        with self.db.transaction() as conn:
+            removed = conn.execute("""
+                DELETE FROM system_logs WHERE id IN (
+                    SELECT id FROM system_logs WHERE server_id = ? AND created_at < ? LIMIT ?
+                )
+            """, (server_id, cutoff, self.prune_batch)).rowcount
+            segments = conn.execute("""
+                SELECT id, line_count FROM system_log_segments WHERE server_id = ? AND end_at < ?
+            """, (server_id, cutoff)).fetchall()
+            conn.executemany("DELETE FROM system_log_segments WHERE id = ?", [(row[0],) for row in segments])
+        return removed + sum(row[1] for row in segments)
+
+    def _enforce_quota(self, server_id: int) -> int:
+        """超出配额时先删除最旧的压缩段，仍超出再删除最旧的明细，单次最多删除 prune_batch 行明细"""
+        with self.db.transaction() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM system_logs WHERE server_id = ?",
+                                 (server_id,)).fetchone()[0]
+            segments = conn.execute("""
+                SELECT id, line_count FROM system_log_segments WHERE server_id = ? ORDER BY last_id
+            """, (server_id,)).fetchall()
+            total += sum(row[1] for row in segments)
+            excess = total - self.max_lines_per_server
+            if excess <= 0:
+                return 0
+            removed = 0
+            for segment_id, line_count in segments:
+                if removed >= excess:
+                    break
+                conn.execute("DELETE FROM system_log_segments WHERE id = ?", (segment_id,))
+                removed += line_count
+            if removed < excess:
+                removed += conn.execute("""
+                    DELETE FROM system_logs WHERE id IN (
+                        SELECT id FROM system_logs WHERE server_id = ? ORDER BY id LIMIT ?
+                    )
+                """, (server_id, min(excess - removed, self.prune_batch))).rowcount
+        return removed
+
+    async def _repeat(self, func, *args) -> int:
+        """分批执行直到没有可处理的行，批次之间让出写连接"""
+        total = 0
+        while True:
+            count = await self.db.run(func, *args)
+            total += count
+            if not count:
+                return total
+            await asyncio.sleep(self.batch_pause)
+
+    async def maintain(self) -> Dict[str, int]:
+        now = utc_now()
+        expire_cutoff = (now - timedelta(days=self.retention_days)).strftime(TIME_FORMAT)
+        compress_cutoff = (now - timedelta(seconds=self.compress_after)).strftime(TIME_FORMAT)
+        result = {'expired': 0, 'compressed': 0, 'over_quota': 0}
+        for server_id in await self.db.run(self._server_ids):
+            result['expired'] += await self._repeat(self._prune_expired, server_id, expire_cutoff)
+            result['compressed'] += await self._repeat(self._compact_batch, server_id, compress_cutoff)
+            result['over_quota'] += await self._repeat(self._enforce_quota, server_id)
+        self.lines_pruned += result['expired'] + result['over_quota']
+        return result
+
+    async def run_maintenance(self, interval: float = 600) -> None:
+        while True:
+            try:
+                result = await self.maintain()
+                if any(result.values()):
+                    logger.info(f"系统日志压缩与清理: {result}")
+            except Exception as e:
+                logger.error(f"系统日志压缩与清理失败: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tails': sum(len(tails) for tails in self._tails.values()),
+            'published': self.published,
+            'tail_dropped': self.tail_dropped,
+            'segments_written': self.segments_written,
+            'lines_compressed': self.lines_compressed,
+            'lines_pruned': self.lines_pruned,
+        }
@@ -0,0 +1,296 @@
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 参与汇总的数值指标（与 server_metrics 表的列一致）
+METRIC_FIELDS = ('cpu_usage', 'memory_usage', 'disk_usage', 'network_in', 'network_out')
+
+# metrics 写入行中各列的位置，见 main.metrics_row
+ROW_SERVER_ID = 0
+ROW_FIELDS = {'cpu_usage': 1, 'memory_usage': 2, 'disk_usage': 3, 'network_in': 4, 'network_out': 5}
+ROW_COLLECTED_AT = 9
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 汇总级别：名称 -> (表名, 桶长度秒数)
+ROLLUP_LEVELS = {
+    '1m': ('server_metrics_1m', 60),
+    '1h': ('server_metrics_1h', 3600),
+    '1d': ('server_metrics_1d', 86400),
+}
+
+# 默认保留时长（秒）
+DEFAULT_RETENTION = {
+    'raw': 2 * 86400,
+    '1m': 14 * 86400,
+    '1h': 180 * 86400,
+    '1d': 5 * 365 * 86400,
+}
+
+
+def bucket_start(level: str, timestamp: str) -> str:
+    """按字符串截断得到桶起始时间，timestamp 为 'YYYY-MM-DD HH:MM:SS'"""
+    if level == '1m':
+        return timestamp[:16] + ':00'
+    if level == '1h':
+        return timestamp[:13] + ':00:00'
+    return timestamp[:10] + ' 00:00:00'
+
+
+def shift(timestamp: str, seconds: int) -> str:
+    return (datetime.strptime(timestamp, TIME_FORMAT) + timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def percentile(values: List[float], pct: float = 95) -> Optional[float]:
+    """最近秩法计算百分位"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(int(-(-len(values) * pct // 100)) - 1, 0)
+    return values[rank]
+
+
+def rollup_schema() -> str:
+    columns = ',\n'.join(
+        f"    {field}_min FLOAT, {field}_max FLOAT, {field}_sum FLOAT, {field}_p95 FLOAT"
+        for field in METRIC_FIELDS
+    )
+    return '\n'.join(f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    server_id INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    samples INTEGER NOT NULL,
+{columns},
+    PRIMARY KEY (server_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket);""" for table, _ in ROLLUP_LEVELS.values())
+
+
+def _upsert_sql(table: str) -> str:
+    names = ', '.join(f"{f}_min, {f}_max, {f}_sum" for f in METRIC_FIELDS)
+    marks = ', '.join('?, ?, ?' for _ in METRIC_FIELDS)
+    updates = ',\n'.join(
+        f"{f}_min = min({f}_min, excluded.{f}_min), "
+        f"{f}_max = max({f}_max, excluded.{f}_max), "
+        f"{f}_sum = {f}_sum + excluded.{f}_sum"
+        for f in METRIC_FIELDS
+    )
+    return f"""
+        INSERT INTO {table} (server_id, bucket, samples, {names})
+        VALUES (?, ?, ?, {marks})
+        ON CONFLICT (server_id, bucket) DO UPDATE SET
+        samples = samples + excluded.samples,
+        {updates}
+    """
+
+
+class MetricsStore:
+    """server_metrics 的时序存储层
+
+    - 写入时在同一事务内增量维护 1分钟/1小时/1天 汇总表（min/max/avg/p95）
+    - 原始数据和各级汇总按保留策略分小批删除，不长时间占用写锁
+    - 聚合查询按步长自动选择数据源（原始数据或某一级汇总表）
+    1分钟桶的p95由该分钟的原始样本精确计算；1小时/1天桶的p95取下一级各桶p95的p95，为近似值。
+    """
+
+    def __init__(self, db, retention: Optional[Dict[str, int]] = None,
+                 prune_batch: int = 1000, prune_pause: float = 0.05):
+        self.db = db
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        self.prune_batch = prune_batch
+        self.prune_pause = prune_pause
+        self._upserts = {level: _upsert_sql(table) for level, (table, _) in ROLLUP_LEVELS.items()}
+
+    def create_schema(self) -> None:
+        self.db.executescript(rollup_schema())
+
+    # ---- 写入 ----
+
+    def apply_rollups(self, conn, rows: Iterable[Tuple]) -> None:
+        """IngestPipeline 的写入钩子：与原始数据在同一事务中更新汇总表"""
+        groups: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        for row in rows:
+            key = (row[ROW_SERVER_ID], bucket_start('1m', row[ROW_COLLECTED_AT]))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {'samples': 0}
+                for field in METRIC_FIELDS:
+                    group[field] = []
+            group['samples'] += 1
+            for field, index in ROW_FIELDS.items():
+                group[field].append(row[index])
+
+        if not groups:
+            return
+
+        # 三个级别使用相同的增量（计数/最小/最大/求和可直接合并）
+        params = []
+        for (server_id, minute), group in groups.items():
+            values = []
+            for field in METRIC_FIELDS:
+                series = [v for v in group[field] if v is not None]
+                if series:
+                    values.extend((min(series), max(series), sum(series)))
+                else:
+                    values.extend((None, None, 0))
+            params.append((server_id, minute, group['samples'], *values))
+
+        for level in ROLLUP_LEVELS:
+            conn.executemany(self._upserts[level], [
+                (p[0], bucket_start(level, p[1]), *p[2:]) for p in params
+            ])
+
+        minutes = set(groups)
+        self._refresh_p95(conn, minutes)
+
+    def _refresh_p95(self, conn, minutes: set) -> None:
+        table_1m = ROLLUP_LEVELS['1m'][0]
+        columns = ', '.join(METRIC_FIELDS)
+        for server_id, minute in minutes:
+            raw = conn.execute(f"""
+                SELECT {columns} FROM server_metrics
+                WHERE server_id = ? AND collected_at >= ? AND collected_at < ?
+            """, (server_id, minute, shift(minute, 60))).fetchall()
+            self._store_p95(conn, table_1m, server_id, minute, raw)
+
+        # 上一级桶的p95由下一级各桶的p95再求p95
+        for child, parent in (('1m', '1h'), ('1h', '1d')):
+            child_table, _ = ROLLUP_LEVELS[child]
+            parent_table, parent_seconds = ROLLUP_LEVELS[parent]
+            p95_columns = ', '.join(f"{f}_p95" for f in METRIC_FIELDS)
+            for server_id, bucket in {(s, bucket_start(parent, m)) for s, m in minutes}:
+                children = conn.execute(f"""
+                    SELECT {p95_columns} FROM {child_table}
+                    WHERE server_id = ? AND bucket >= ? AND bucket < ?
+                """, (server_id, bucket, shift(bucket, parent_seconds))).fetchall()
+                self._store_p95(conn, parent_table, server_id, bucket, children)
+
+    def _store_p95(self, conn, table: str, server_id: int, bucket: str, rows: list) -> None:
+        values = [percentile([row[i] for row in rows]) for i in range(len(METRIC_FIELDS))]
+        assignments = ', '.join(f"{f}_p95 = ?" for f in METRIC_FIELDS)
+        conn.execute(
+            f"UPDATE {table} SET {assignments} WHERE server_id = ? AND bucket = ?",
+            (*values, server_id, bucket)
+        )
+
+    # ---- 保留策略 ----
+
+    def _prune_batch(self, table: str, column: str, cutoff: str) -> int:
+        if table == 'server_metrics':
+            sql = """
+                DELETE FROM server_metrics WHERE id IN (
+                    SELECT id FROM server_metrics WHERE collected_at < ? LIMIT ?
+                )
+            """
+        else:
+            # 汇总表是 WITHOUT ROWID 表，按主键删除
+            sql = f"""
+                DELETE FROM {table} WHERE (server_id, {column}) IN (
+                    SELECT server_id, {column} FROM {table} WHERE {column} < ? LIMIT ?
+                )
+            """
+        return self.db.execute_rowcount(sql, (cutoff, self.prune_batch))
+
+    async def prune(self) -> Dict[str, int]:
+        """按保留策略分批删除过期数据，每批一个短事务，批次之间让出写锁"""
+        now = utc_now()
+        targets = [('raw', 'server_metrics', 'collected_at')] + [
+            (level, table, 'bucket') for level, (table, _) in ROLLUP_LEVELS.items()
+        ]
+        removed = {}
+        for level, table, column in targets:
+            cutoff = (now - timedelta(seconds=self.retention[level])).strftime(TIME_FORMAT)
+            total = 0
+            while True:
+                count = await self.db.run(self._prune_batch, table, column, cutoff)
+                total += count
+                if count < self.prune_batch:
+                    break
+                await asyncio.sleep(self.prune_pause)
+            removed[level] = total
+        return removed
+
+    async def run_retention(self, interval: float = 600) -> None:
+        while True:
+            try:
+                removed = await self.prune()
+                if any(removed.values()):
+                    logger.info(f"清理过期监控数据: {removed}")
+            except Exception as e:
+                logger.error(f"清理过期监控数据失败: {str(e)}")
+            await asyncio.sleep(interval)
+
+    # ---- 查询 ----
+
+    def source_level(self, start: str, step: int, aggs: Iterable[str]) -> str:
+        """按步长选择数据源：步长不小于某级桶长度时直接聚合该级汇总表，越粗数据量越小"""
+        start_dt = datetime.strptime(start, TIME_FORMAT)
+        now = utc_now()
+        candidates = ['1d', '1h', '1m']
+        if 'p95' not in aggs:
+            candidates.append('raw')
+        retained = [
+            level for level in candidates
+            if start_dt >= now - timedelta(seconds=self.retention[level])
+        ] or ['1d']
+        for level in retained:
+            if level == 'raw' or step >= ROLLUP_LEVELS[level][1]:
+                return level
+        return retained[-1]
+
+    def aggregate(self, server_id: int, start: str, end: str, step: int,
+                  fields: Iterable[str] = METRIC_FIELDS, aggs: Iterable[str] = ('avg',)) -> Dict[str, Any]:
+        """在SQL中按 step 秒分桶聚合，只返回请求的字段
+
+        返回 {'columns': ['time', 'cpu_usage_avg', ...], 'points': [[epoch, value, ...], ...]}，
+        time 为桶起始的Unix时间戳。汇总表数据源上的p95取各子桶p95的最大值（偏保守的上界）。
+        """
+        fields, aggs = list(fields), list(aggs)
+        source = self.source_level(start, step, aggs)
+        start_epoch = int(datetime.strptime(start, TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+        origin = start_epoch - start_epoch % step
+
+        if source == 'raw':
+            table, time_column = 'server_metrics', 'collected_at'
+            expressions = {
+                'avg': 'avg({f})', 'min': 'min({f})', 'max': 'max({f})',
+            }
+            range_start = start
+        else:
+            table, time_column = ROLLUP_LEVELS[source][0], 'bucket'
+            expressions = {
+                'avg': 'sum({f}_sum) * 1.0 / sum(samples)', 'min': 'min({f}_min)',
+                'max': 'max({f}_max)', 'p95': 'max({f}_p95)',
+            }
+            range_start = bucket_start(source, start)
+
+        columns = ['time']
+        selects = []
+        for field in fields:
+            for agg in aggs:
+                columns.append(f"{field}_{agg}")
+                selects.append(expressions[agg].format(f=field))
+
+        sql = f"""
+            SELECT CAST((strftime('%s', {time_column}) - ?) / ? AS INTEGER) AS slot, {', '.join(selects)}
+            FROM {table}
+            WHERE server_id = ? AND {time_column} >= ? AND {time_column} < ?
+            GROUP BY slot
+            ORDER BY slot
+        """
+        with self.db.get_connection() as conn:
+            rows = conn.execute(sql, (origin, step, server_id, range_start, end)).fetchall()
+
+        points = []
+        for row in rows:
+            point = [origin + row[0] * step]
+            point.extend(round(v, 3) if isinstance(v, float) else v for v in row[1:])
+            points.append(point)
+        return {'resolution': source, 'step': step, 'columns': columns, 'points': points}
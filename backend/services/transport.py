@@ -0,0 +1,305 @@
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+import time
+
+from services.ssh_pool import SSHSessionPool, SSHConnectError, CommandTimeout, session_key
+from services.scheduler import PRIORITY_NORMAL
+
+try:
+    import asyncssh
+except ImportError:  # 可选依赖，未安装时使用 paramiko
+    asyncssh = None
+
+logger = logging.getLogger(__name__)
+
+# on_output(stream, data)：stream 为 'stdout' 或 'stderr'，data 为原始字节
+OutputCallback = Callable[[str, bytes], Awaitable[None]]
+
+
+class SSHTransport:
+    """远程命令执行后端的统一接口
+
+    run() 在事件循环中调用，输出块通过 await on_output(stream, data) 逐块交给调用方，
+    调用方处理得慢时读取随之暂停；超时抛出 CommandTimeout，取消通过取消任务实现。
+    priority 为调度器优先级通道，占用线程的后端据此排队。
+    """
+
+    name = 'base'
+
+    async def run(self, server_data: Dict[str, Any], command: str, on_output: OutputCallback,
+                  timeout: Optional[float] = None, priority: int = PRIORITY_NORMAL) -> int:
+        raise NotImplementedError
+
+    async def exec(self, server_data: Dict[str, Any], command: str,
+                   timeout: Optional[float] = None,
+                   priority: int = PRIORITY_NORMAL) -> Tuple[str, str, int]:
+        """执行命令并返回 (stdout, stderr, exit_code)"""
+        buffers = {'stdout': [], 'stderr': []}
+
+        async def collect(stream: str, data: bytes) -> None:
+            buffers[stream].append(data)
+
+        exit_code = await self.run(server_data, command, collect, timeout, priority)
+        return (b''.join(buffers['stdout']).decode(errors='replace'),
+                b''.join(buffers['stderr']).decode(errors='replace'),
+                exit_code)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+    async def close(self) -> None:
+        pass
+
+
+class ParamikoTransport(SSHTransport):
+    """paramiko 实现：命令在线程池中执行，每条执行中的命令占用一个线程
+
+    executor 为调度器的 WorkerPool 时按 priority 排队。
+    """
+
+    name = 'paramiko'
+
+    def __init__(self, pool: SSHSessionPool, executor=None, max_workers: int = 64):
+        self.pool = pool
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ssh")
+        self.running = 0
+
+    async def run(self, server_data: Dict[str, Any], command: str, on_output: OutputCallback,
+                  timeout: Optional[float] = None, priority: int = PRIORITY_NORMAL) -> int:
+        loop = asyncio.get_event_loop()
+        cancel = threading.Event()
+
+        def emit(stream: str, data: bytes) -> None:
+            # 在读取线程中等待事件循环处理完这一块，实现背压
+            future = asyncio.run_coroutine_threadsafe(on_output(stream, data), loop)
+            while not cancel.is_set():
+                try:
+                    future.result(0.5)
+                    return
+                except concurrent.futures.TimeoutError:
+                    continue
+            future.cancel()
+
+        executor = self.executor.lane(priority) if hasattr(self.executor, 'lane') else self.executor
+        self.running += 1
+        try:
+            return await loop.run_in_executor(executor, functools.partial(
+                self.pool.stream_command, server_data, command, emit, cancel=cancel, timeout=timeout))
+        finally:
+            # 任务被取消时通知读取线程关闭channel
+            cancel.set()
+            self.running -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.name, 'running': self.running, **self.pool.stats()}
+
+    async def close(self) -> None:
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close_all()
+
+
+class _AsyncSession:
+    def __init__(self, conn, max_channels: int):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        # 与 SSHSessionPool 一致，并发channel数低于sshd默认的MaxSessions=10
+        self.channels = asyncio.Semaphore(max_channels)
+
+
+class AsyncSSHTransport(SSHTransport):
+    """asyncssh 实现：所有会话和channel都在事件循环中，并发命令只占用协程
+
+    与 SSHSessionPool 相同，每个服务器/凭据只保持一个连接，命令在其上复用channel，
+    单个连接的并发channel数不超过 max_channels；空闲超过 idle_timeout 的连接被回收，断开的连接在下次使用时重连。
+    """
+
+    name = 'asyncssh'
+
+    def __init__(self, idle_timeout: float = 300, keepalive_interval: int = 30,
+                 connect_timeout: float = 10, chunk_size: int = 32768, max_channels: int = 8):
+        if asyncssh is None:
+            raise RuntimeError("未安装 asyncssh")
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+        self.chunk_size = chunk_size
+        self.max_channels = max_channels
+        self._sessions: Dict[Tuple, _AsyncSession] = {}
+        self._connect_locks: Dict[Tuple, asyncio.Lock] = {}
+        self.running = 0
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self.channel_rejects = 0
+
+    async def _connect(self, server_data: Dict[str, Any]):
+        options = dict(
+            port=server_data.get('port') or 22,
+            username=server_data['username'],
+            known_hosts=None,
+            connect_timeout=self.connect_timeout,
+            keepalive_interval=self.keepalive_interval,
+        )
+        if server_data['auth_type'] == 'key':
+            key_path = server_data['key_path']
+            if not key_path or not os.path.exists(key_path):
+                raise SSHConnectError("SSH密钥文件不存在")
+            options.update(client_keys=[key_path], password=None)
+        else:
+            options.update(password=server_data.get('password'), client_keys=None)
+        return await asyncssh.connect(server_data['ip'], **options)
+
+    async def _checkout(self, server_data: Dict[str, Any]) -> Tuple[Tuple, _AsyncSession]:
+        key = session_key(server_data)
+        self.evict_idle()
+        lock = self._connect_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                if not session.conn.is_closed():
+                    self.hits += 1
+                    session.in_use += 1
+                    return key, session
+                del self._sessions[key]
+                self.reconnects += 1
+            else:
+                self.misses += 1
+            session = _AsyncSession(await self._connect(server_data), self.max_channels)
+            session.in_use += 1
+            self._sessions[key] = session
+            return key, session
+
+    def _release(self, session: _AsyncSession) -> None:
+        session.in_use -= 1
+        session.last_used = time.monotonic()
+
+    def _discard(self, key: Tuple, session: _AsyncSession) -> None:
+        if self._sessions.get(key) is session:
+            del self._sessions[key]
+            self._drop_connect_lock(key)
+        session.conn.close()
+
+    def _drop_connect_lock(self, key: Tuple) -> None:
+        lock = self._connect_locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._connect_locks[key]
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        evicted = [key for key, session in self._sessions.items()
+                   if not session.in_use and (now - session.last_used >= self.idle_timeout
+                                              or session.conn.is_closed())]
+        for key in evicted:
+            self._sessions.pop(key).conn.close()
+            self._drop_connect_lock(key)
+        self.evictions += len(evicted)
+        return len(evicted)
+
+    async def run(self, server_data: Dict[str, Any], command: str, on_output: OutputCallback,
+                  timeout: Optional[float] = None, priority: int = PRIORITY_NORMAL) -> int:
+        for attempt in range(2):
+            key, session = await self._checkout(server_data)
+            try:
+                async with session.channels:
+                    try:
+                        process = await session.conn.create_process(command, encoding=None)
+                    except asyncssh.ChannelOpenError as e:
+                        if not session.conn.is_closed():
+                            # 服务端拒绝这个channel，连接本身仍可用：只让这条命令失败
+                            self.channel_rejects += 1
+                            logger.warning(f"服务器拒绝打开SSH channel: {server_data['ip']}: {e}")
+                            raise
+                        self._discard(key, session)
+                        if attempt:
+                            raise
+                        self.reconnects += 1
+                        continue
+                    except (asyncssh.DisconnectError, ConnectionError):
+                        # 连接已断开，重连后重试一次（命令尚未开始执行）
+                        self._discard(key, session)
+                        if attempt:
+                            raise
+                        self.reconnects += 1
+                        continue
+                    self.running += 1
+                    try:
+                        return await self._pump(process, on_output, timeout)
+                    finally:
+                        self.running -= 1
+                        process.close()
+            finally:
+                self._release(session)
+        raise SSHConnectError("SSH会话重连失败")
+
+    async def _pump(self, process, on_output: OutputCallback, timeout: Optional[float]) -> int:
+        async def read(stream_name: str, reader) -> None:
+            while True:
+                data = await reader.read(self.chunk_size)
+                if not data:
+                    return
+                await on_output(stream_name, data)
+
+        async def drain() -> int:
+            await asyncio.gather(read('stdout', process.stdout), read('stderr', process.stderr))
+            completed = await process.wait(check=False)
+            return completed.exit_status if completed.exit_status is not None else -1
+
+        try:
+            return await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            raise CommandTimeout("命令执行超时")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.name,
+            'running': self.running,
+            'sessions': len(self._sessions),
+            'in_use': sum(1 for s in self._sessions.values() if s.in_use),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reconnects': self.reconnects,
+            'evictions': self.evictions,
+            'max_channels': self.max_channels,
+            'channel_rejects': self.channel_rejects,
+        }
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        self._connect_locks.clear()
+        for session in sessions:
+            session.conn.close()
+        for session in sessions:
+            try:
+                await session.conn.wait_closed()
+            except Exception:
+                pass
+
+
+def create_transport(backend: str, pool: SSHSessionPool, **kwargs) -> SSHTransport:
+    """按配置创建传输后端：'asyncssh'、'paramiko' 或 'auto'
+
+    'auto' 使用 paramiko：基准测试中短命令（本项目的绝大多数调用）paramiko 更快，
+    asyncssh 只在大量长时间并发命令时占优，需要时显式配置为 'asyncssh'。
+    """
+    backend = (backend or 'auto').lower()
+    if backend == 'asyncssh' and asyncssh is not None:
+        return AsyncSSHTransport(
+            idle_timeout=pool.idle_timeout,
+            keepalive_interval=pool.keepalive_interval,
+            connect_timeout=pool.connect_timeout,
+            max_channels=pool.max_channels,
+        )
+    if backend == 'asyncssh':
+        logger.warning("未安装 asyncssh，回退到 paramiko 传输")
+    return ParamikoTransport(pool, **kwargs)
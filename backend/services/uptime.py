@@ -0,0 +1,570 @@
+from typing import Dict, Any, Optional, List, Tuple
+from collections import deque
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import ssl
+import time
+
+from services.ingest import IngestQueueFull
+from services.timeseries import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+# 写入行的列顺序：(site_id, status_code, response_time, error, checked_at)
+CHECK_INSERT_SQL = """
+    INSERT INTO monitoring_logs (site_id, status_code, response_time, error, checked_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+USER_AGENT = "copy-www-admin-uptime/1.0"
+
+
+def site_target(domain: str, ssl_enabled: bool) -> Tuple[str, str, int, str]:
+    """站点域名转换为 (scheme, host, port, path)，域名中可以带端口和路径"""
+    scheme = 'https' if ssl_enabled else 'http'
+    if '://' in domain:
+        scheme, domain = domain.split('://', 1)
+    host, slash, path = domain.partition('/')
+    path = slash + path if slash else '/'
+    port = 443 if scheme == 'https' else 80
+    if host.startswith('['):
+        # IPv6 字面量：[::1]:8080
+        address, _, rest = host[1:].partition(']')
+        host = address
+        if rest.startswith(':'):
+            port = int(rest[1:])
+    elif ':' in host:
+        host, port_text = host.rsplit(':', 1)
+        port = int(port_text)
+    return scheme, host, port, path
+
+
+class ProbeError(Exception):
+    pass
+
+
+class _Connection:
+    __slots__ = ('reader', 'writer', 'last_used', 'cert_expires')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.cert_expires: Optional[float] = None
+        cert = writer.get_extra_info('peercert')
+        if cert and cert.get('notAfter'):
+            self.cert_expires = ssl.cert_time_to_seconds(cert['notAfter'])
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class HTTPProber:
+    """基于 asyncio 流的 HTTP/1.1 探测客户端
+
+    - 每个 (scheme, host, port) 保持最多 per_host 个 keep-alive 连接，并发请求数同样受 per_host 限制
+    - 空闲超过 idle_timeout 的连接被回收；复用的连接已被服务端关闭时换新连接重试一次
+    - 响应体只读取 max_body 字节以内（超出时不复用该连接），探测只关心状态码和耗时
+    - HTTPS 默认校验证书，证书过期时间随结果返回
+    """
+
+    def __init__(self, connect_timeout: float = 5, timeout: float = 10, per_host: int = 4,
+                 idle_timeout: float = 30, max_body: int = 65536, verify_tls: bool = True):
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.per_host = per_host
+        self.idle_timeout = idle_timeout
+        self.max_body = max_body
+        self.ssl_context = ssl.create_default_context()
+        if not verify_tls:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._idle: Dict[Tuple, deque] = {}
+        self._limits: Dict[Tuple, asyncio.Semaphore] = {}
+
+        self.probes = 0
+        self.connects = 0
+        self.reused = 0
+        self.retries = 0
+
+    async def _connect(self, scheme: str, host: str, port: int) -> _Connection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port,
+                ssl=self.ssl_context if scheme == 'https' else None,
+                server_hostname=host if scheme == 'https' else None,
+            ),
+            self.connect_timeout,
+        )
+        self.connects += 1
+        return _Connection(reader, writer)
+
+    def _checkout(self, key: Tuple) -> Optional[_Connection]:
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            if now - conn.last_used < self.idle_timeout and not conn.reader.at_eof():
+                self.reused += 1
+                return conn
+            conn.close()
+        return None
+
+    def _release(self, key: Tuple, conn: _Connection) -> None:
+        conn.last_used = time.monotonic()
+        idle = self._idle.setdefault(key, deque())
+        idle.append(conn)
+        while len(idle) > self.per_host:
+            idle.popleft().close()
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        evicted = 0
+        for key in list(self._idle):
+            idle = self._idle[key]
+            alive = deque()
+            for conn in idle:
+                if now - conn.last_used < self.idle_timeout:
+                    alive.append(conn)
+                else:
+                    conn.close()
+                    evicted += 1
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        return evicted
+
+    async def probe(self, scheme: str, host: str, port: int, path: str = '/') -> Dict[str, Any]:
+        """返回 {'status_code', 'response_time'(毫秒), 'error', 'cert_expires'(epoch秒)}"""
+        key = (scheme, host, port)
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.per_host)
+        self.probes += 1
+        async with limit:
+            start = time.perf_counter()
+            try:
+                status, conn = await asyncio.wait_for(self._request(key, host, port, path), self.timeout)
+            except asyncio.TimeoutError:
+                return self._failure(start, "请求超时")
+            except ssl.SSLCertVerificationError as e:
+                return self._failure(start, f"证书校验失败: {e.verify_message}")
+            except (OSError, ssl.SSLError, asyncio.IncompleteReadError, ProbeError) as e:
+                return self._failure(start, str(e) or type(e).__name__)
+            return {
+                'status_code': status,
+                'response_time': round((time.perf_counter() - start) * 1000, 1),
+                'error': None,
+                'cert_expires': conn.cert_expires,
+            }
+
+    @staticmethod
+    def _failure(start: float, error: str) -> Dict[str, Any]:
+        return {
+            'status_code': None,
+            'response_time': round((time.perf_counter() - start) * 1000, 1),
+            'error': error,
+            'cert_expires': None,
+        }
+
+    async def _request(self, key: Tuple, host: str, port: int, path: str) -> Tuple[int, _Connection]:
+        scheme = key[0]
+        default_port = 443 if scheme == 'https' else 80
+        name = f"[{host}]" if ':' in host else host
+        host_header = name if port == default_port else f"{name}:{port}"
+        request = (
+            f"GET {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: {USER_AGENT}\r\n"
+            f"Accept: */*\r\nConnection: keep-alive\r\n\r\n"
+        ).encode()
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        if conn is None:
+            conn = await self._connect(scheme, host, port)
+        try:
+            try:
+                status, reusable = await self._exchange(conn, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # 复用的连接已被服务端关闭，换新连接重试一次
+                conn.close()
+                self.retries += 1
+                conn = await self._connect(scheme, host, port)
+                status, reusable = await self._exchange(conn, request)
+        except BaseException:
+            conn.close()
+            raise
+        if reusable:
+            self._release(key, conn)
+        else:
+            conn.close()
+        return status, conn
+
+    async def _exchange(self, conn: _Connection, request: bytes) -> Tuple[int, bool]:
+        conn.writer.write(request)
+        await conn.writer.drain()
+        try:
+            head = await conn.reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise ProbeError("响应头过大")
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise ProbeError(f"无效的HTTP响应: {lines[0][:100]}")
+        status = int(parts[1])
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        reusable = parts[0] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if status in (204, 304) or status < 200:
+            return status, reusable
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            return status, reusable and await self._skip_chunked(conn.reader)
+        length = headers.get('content-length')
+        if length is None or not length.isdigit():
+            # 以关闭连接结束的响应体，不读取
+            return status, False
+        if int(length) > self.max_body:
+            return status, False
+        await conn.reader.readexactly(int(length))
+        return status, reusable
+
+    async def _skip_chunked(self, reader) -> bool:
+        total = 0
+        while True:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b';')[0].strip(), 16)
+            except ValueError:
+                raise ProbeError("无效的chunked响应")
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return True
+            total += size
+            if total > self.max_body:
+                return False
+            await reader.readexactly(size + 2)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'probes': self.probes,
+            'connects': self.connects,
+            'reused': self.reused,
+            'retries': self.retries,
+            'idle_connections': sum(len(idle) for idle in self._idle.values()),
+            'hosts': len(self._limits),
+        }
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+
+class _Site:
+    def __init__(self, site: Dict[str, Any], interval: float):
+        self.site = site
+        self.interval = interval
+        self.target = site_target(site['domain'], bool(site.get('ssl_enabled')))
+        self.next_due = 0.0
+        self.state = 'unknown'
+        self.failures = 0
+        self.successes = 0
+        self.down_since: Optional[float] = None
+        self.open_alert: Optional[int] = None
+        self.last_alert_at: Optional[float] = None
+        self.cert_alerted: Optional[float] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+
+
+class UptimeChecker:
+    """站点可用性检查
+
+    - sites 表中的每个站点按 interval 秒（±jitter）定时探测，首次探测在一个间隔内随机分布
+    - 全局并发由 max_concurrency 限制，单个主机的并发和连接复用由 HTTPProber 负责
+    - 每次探测结果经批量写入管道写入 monitoring_logs
+    - 告警去抖：连续 fail_threshold 次失败才判定为故障，连续 recover_threshold 次成功才判定为恢复；
+      距上一条告警不足 alert_cooldown 秒的故障不再新建告警（站点反复波动时只产生一条）
+    - HTTPS 证书剩余有效期少于 cert_warn_days 天时产生一条 ssl_expiring 告警
+    """
+
+    def __init__(self, db, ingest, prober: HTTPProber, interval: float = 60, jitter: float = 0.1,
+                 max_concurrency: int = 500, fail_threshold: int = 2, recover_threshold: int = 2,
+                 alert_cooldown: float = 600, cert_warn_days: float = 14, refresh_interval: float = 60):
+        self.db = db
+        self.ingest = ingest
+        self.prober = prober
+        self.interval = interval
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.fail_threshold = fail_threshold
+        self.recover_threshold = recover_threshold
+        self.alert_cooldown = alert_cooldown
+        self.cert_warn_days = cert_warn_days
+        self.refresh_interval = refresh_interval
+
+        self._sites: Dict[int, _Site] = {}
+        self._due: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._tasks: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._refresh_now = False
+
+        self.checks = 0
+        self.failures = 0
+        self.dropped = 0
+        self.alerts_raised = 0
+        self.alerts_suppressed = 0
+        self.max_lag = 0.0
+
+    def create_schema(self) -> None:
+        with self.db.transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(monitoring_logs)")}
+            if 'error' not in columns:
+                conn.execute("ALTER TABLE monitoring_logs ADD COLUMN error TEXT")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_monitoring_logs_site_time
+                ON monitoring_logs (site_id, checked_at)
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_site_status ON alerts (site_id, status)")
+
+    # ---- 调度 ----
+
+    def _schedule(self, site: _Site, now: float, delay: Optional[float] = None) -> None:
+        if delay is None:
+            delay = site.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        site.next_due = now + delay
+        heapq.heappush(self._due, (site.next_due, next(self._seq), site.site['id']))
+
+    async def refresh(self) -> None:
+        """同步站点列表，新站点加入调度；已有未恢复的故障告警时从故障状态开始"""
+        sites = await self.db.afetch_all("SELECT id, domain, ssl_enabled FROM sites")
+        open_alerts = {row['site_id']: row['id'] for row in await self.db.afetch_all("""
+            SELECT site_id, MAX(id) AS id FROM alerts
+            WHERE type = 'site_down' AND status = 'active' GROUP BY site_id
+        """)}
+        now = time.monotonic()
+        seen = set()
+        for row in sites:
+            seen.add(row['id'])
+            site = self._sites.get(row['id'])
+            if site is not None and (site.site['domain'], site.site['ssl_enabled']) == (
+                    row['domain'], row['ssl_enabled']):
+                continue
+            try:
+                site = _Site(row, self.interval)
+            except ValueError:
+                logger.warning(f"站点 {row['id']} 域名无效，跳过: {row['domain']}")
+                continue
+            if row['id'] in open_alerts:
+                site.state = 'down'
+                site.open_alert = open_alerts[row['id']]
+                site.down_since = now
+            self._sites[row['id']] = site
+            self._schedule(site, now, delay=random.uniform(0, self.interval))
+        for site_id in list(self._sites):
+            if site_id not in seen:
+                del self._sites[site_id]
+
+    def request_refresh(self) -> None:
+        """站点增删后尽快同步"""
+        self._refresh_now = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.prober.close()
+
+    async def _run(self) -> None:
+        limit = asyncio.Semaphore(self.max_concurrency)
+        next_refresh = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_refresh or self._refresh_now:
+                self._refresh_now = False
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"刷新站点列表失败: {str(e)}")
+                next_refresh = now + self.refresh_interval
+                self.prober.evict_idle()
+
+            while self._due:
+                due, _, site_id = self._due[0]
+                site = self._sites.get(site_id)
+                if site is not None and site.next_due == due:
+                    break
+                heapq.heappop(self._due)
+
+            wait_until = min(self._due[0][0], next_refresh) if self._due else next_refresh
+            delay = wait_until - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not self._due or self._due[0][0] > time.monotonic():
+                continue
+            due, _, site_id = heapq.heappop(self._due)
+            await limit.acquire()
+            self.max_lag = max(self.max_lag, time.monotonic() - due)
+            site = self._sites[site_id]
+            self._schedule(site, time.monotonic())
+            task = asyncio.create_task(self._check(site, limit))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # ---- 探测与告警 ----
+
+    async def check(self, site: _Site) -> Dict[str, Any]:
+        result = await self.prober.probe(*site.target)
+        site.last_result = result
+        self.checks += 1
+        try:
+            await self.ingest.submit('site_checks', [(
+                site.site['id'], result['status_code'], result['response_time'], result['error'],
+                utc_now().strftime(TIME_FORMAT),
+            )])
+        except IngestQueueFull:
+            self.dropped += 1
+        await self._transition(site, result)
+        return result
+
+    async def _check(self, site: _Site, limit: asyncio.Semaphore) -> None:
+        try:
+            await self.check(site)
+        except Exception as e:
+            logger.error(f"检查站点 {site.site['id']} 失败: {str(e)}")
+        finally:
+            limit.release()
+
+    @staticmethod
+    def is_up(result: Dict[str, Any]) -> bool:
+        return result['error'] is None and 200 <= result['status_code'] < 400
+
+    async def _transition(self, site: _Site, result: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        domain = site.site['domain']
+        if self.is_up(result):
+            site.successes += 1
+            site.failures = 0
+            if site.state == 'unknown' or (site.state == 'down' and site.successes >= self.recover_threshold):
+                recovered = site.state == 'down'
+                site.state = 'up'
+                # 被冷却期抑制的故障没有告警，恢复时也不产生记录
+                if recovered and site.open_alert is not None:
+                    downtime = int(now - site.down_since) if site.down_since else 0
+                    await self._resolve(site, f"站点 {domain} 已恢复，故障持续约 {downtime} 秒")
+                site.down_since = None
+        else:
+            self.failures += 1
+            site.failures += 1
+            site.successes = 0
+            cooling = site.last_alert_at is not None and now - site.last_alert_at < self.alert_cooldown
+            if site.state != 'down' and site.failures >= self.fail_threshold:
+                site.state = 'down'
+                site.down_since = now
+                if cooling:
+                    self.alerts_suppressed += 1
+            # 冷却期内被抑制的故障在冷却结束后仍未恢复时补发告警
+            if site.state == 'down' and site.open_alert is None and not cooling:
+                reason = result['error'] or f"HTTP {result['status_code']}"
+                site.open_alert = await self._raise(site, 'site_down', f"站点 {domain} 无法访问: {reason}")
+
+        if result['cert_expires'] and site.cert_alerted != result['cert_expires']:
+            days_left = (result['cert_expires'] - time.time()) / 86400
+            if days_left < self.cert_warn_days:
+                site.cert_alerted = result['cert_expires']
+                await self._raise(site, 'ssl_expiring',
+                                  f"站点 {domain} 的证书将在 {max(days_left, 0):.1f} 天后过期")
+
+    async def _raise(self, site: _Site, alert_type: str, message: str) -> int:
+        site.last_alert_at = time.monotonic()
+        self.alerts_raised += 1
+        logger.warning(message)
+        return await self.db.aexecute("""
+            INSERT INTO alerts (site_id, type, message, status, created_at) VALUES (?, ?, ?, 'active', ?)
+        """, (site.site['id'], alert_type, message, utc_now().strftime(TIME_FORMAT)))
+
+    async def _resolve(self, site: _Site, message: str) -> None:
+        site.last_alert_at = time.monotonic()
+        logger.info(message)
+
+        def write():
+            with self.db.transaction() as conn:
+                conn.execute("UPDATE alerts SET status = 'resolved' WHERE id = ?", (site.open_alert,))
+                conn.execute("""
+                    INSERT INTO alerts (site_id, type, message, status, created_at)
+                    VALUES (?, 'site_recovered', ?, 'resolved', ?)
+                """, (site.site['id'], message, utc_now().strftime(TIME_FORMAT)))
+
+        await self.db.run(write)
+        site.open_alert = None
+
+    # ---- 状态 ----
+
+    def get_site(self, site_id: int) -> Optional[_Site]:
+        return self._sites.get(site_id)
+
+    def site_state(self, site_id: int) -> Optional[Dict[str, Any]]:
+        site = self._sites.get(site_id)
+        if site is None:
+            return None
+        return {
+            'state': site.state,
+            'url': f"{site.target[0]}://{site.target[1]}:{site.target[2]}{site.target[3]}",
+            'failures': site.failures,
+            'next_in': round(site.next_due - time.monotonic(), 3),
+            'open_alert': site.open_alert,
+            'last_result': site.last_result,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for site in self._sites.values():
+            states[site.state] = states.get(site.state, 0) + 1
+        return {
+            'sites': len(self._sites),
+            'states': states,
+            'in_flight': len(self._tasks),
+            'checks': self.checks,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'alerts_raised': self.alerts_raised,
+            'alerts_suppressed': self.alerts_suppressed,
+            'max_lag_ms': round(self.max_lag * 1000, 3),
+            'prober': self.prober.stats(),
+        }
@@ -0,0 +1,74 @@
+from typing import Dict, Any, List, Optional, Sequence
+from datetime import datetime, timezone
+import gzip
+import json
+
+from fastapi import Request, Response
+
+# 小于该大小的响应压缩收益不大，直接返回
+GZIP_MIN_BYTES = 1024
+
+
+def delta_encode(values: Sequence[int]) -> List[int]:
+    """[t0, t1, t2] -> [t0, t1-t0, t2-t1]，等间隔时间戳压缩为大量相同的小整数"""
+    encoded = []
+    previous = 0
+    for value in values:
+        encoded.append(value - previous)
+        previous = value
+    return encoded
+
+
+def delta_decode(values: Sequence[int]) -> List[int]:
+    decoded = []
+    total = 0
+    for value in values:
+        total += value
+        decoded.append(total)
+    return decoded
+
+
+def to_epoch(value: Any) -> Optional[int]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    # 数据库中为UTC的 'YYYY-MM-DD HH:MM:SS'，fromisoformat 比 strptime 快得多
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+
+
+def quantize(value: Any, precision: int) -> Any:
+    return round(value, precision) if isinstance(value, float) else value
+
+
+def columnar(columns: Sequence[str], points: Sequence[Sequence[Any]], time_column: str,
+             precision: int = 2) -> Dict[str, Any]:
+    """行数组转换为列式格式
+
+    {"columns": [...], "time": [t0, dt1, dt2, ...], "values": {"cpu_usage": [...], ...}}
+    时间列为增量编码的epoch秒，其它列每列一个数组，浮点数按 precision 位小数取整。
+    """
+    time_index = list(columns).index(time_column)
+    others = [(i, name) for i, name in enumerate(columns) if i != time_index]
+    return {
+        'columns': [name for _, name in others],
+        'time': delta_encode([to_epoch(point[time_index]) for point in points]),
+        'values': {name: [quantize(point[i], precision) for point in points] for i, name in others},
+    }
+
+
+def rows_to_columnar(rows: Sequence[Dict[str, Any]], time_column: str,
+                     exclude: Sequence[str] = (), precision: int = 2) -> Dict[str, Any]:
+    """字典行列表（数据库查询结果）转换为列式格式"""
+    if not rows:
+        return {'columns': [], 'time': [], 'values': {}}
+    columns = [name for name in rows[0] if name not in exclude]
+    return columnar(columns, [[row[name] for name in columns] for row in rows], time_column, precision)
+
+
+def json_response(request: Request, content: Any) -> Response:
+    """紧凑JSON响应；客户端声明 Accept-Encoding: gzip 且响应足够大时压缩"""
+    body = json.dumps(content, separators=(',', ':'), ensure_ascii=False, default=str).encode()
+    headers = {'Vary': 'Accept-Encoding'}
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in request.headers.get('accept-encoding', ''):
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, media_type='application/json', headers=headers)
@@ -1,5 +1,6 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set, Any, Optional
+from typing import Dict, Set, Any, Optional, Hashable
+from collections import deque
 import asyncio
 import logging
 import json
@@ -7,65 +8,253 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+
+def merge_messages(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """合并同一键下尚未发送的两条消息（最新值优先）
+
+    delta 合并到之前的 snapshot/delta 中，保持客户端最终状态一致；其它类型直接用新消息替换。
+    """
+    if new.get('type') != 'delta' or not isinstance(old.get('data'), dict):
+        return new
+
+    def merge(target: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+        result = dict(target)
+        for key, value in delta.items():
+            if isinstance(value, dict) and isinstance(result.get(key), dict):
+                result[key] = merge(result[key], value)
+            else:
+                result[key] = value
+        return result
+
+    return {**old, **{k: v for k, v in new.items() if k not in ('type', 'data')},
+            'data': merge(old['data'], new['data'])}
+
+
+class _PendingMessage:
+    __slots__ = ('message', 'payload')
+
+    def __init__(self, message: Dict[str, Any], payload: Optional[str]):
+        self.message = message
+        self.payload = payload
+
+
+class ClientConnection:
+    """单个客户端连接：有界发送队列 + 独立发送任务
+
+    可合并的消息（conflate_key 不为空）在队列中只保留一条，新消息合并进去；
+    不可合并的消息超出队列上限时判定为慢消费者并断开。
+    """
+
+    def __init__(self, manager: "WebSocketManager", websocket: WebSocket,
+                 max_queue: int, send_timeout: float):
+        self.manager = manager
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.topics: Set[Hashable] = set()
+        self._queue: deque = deque()
+        self._conflated: Dict[Hashable, _PendingMessage] = {}
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.conflated = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._sender())
+
+    def enqueue(self, message: Dict[str, Any], payload: Optional[str] = None,
+                conflate_key: Optional[Hashable] = None) -> bool:
+        if self.closed:
+            return False
+        if conflate_key is not None:
+            pending = self._conflated.get(conflate_key)
+            if pending is not None:
+                pending.message = merge_messages(pending.message, message)
+                pending.payload = None
+                self.conflated += 1
+                return True
+            self._conflated[conflate_key] = _PendingMessage(message, payload)
+            self._queue.append((conflate_key, None))
+        else:
+            self._queue.append((None, _PendingMessage(message, payload)))
+
+        if len(self._queue) > self.max_queue:
+            logger.warning("WebSocket client too slow, disconnecting")
+            self.manager.drop(self.websocket, slow=True)
+            return False
+        self._ready.set()
+        return True
+
+    async def _sender(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    key, pending = self._queue.popleft()
+                    if key is not None:
+                        pending = self._conflated.pop(key)
+                    payload = pending.payload or json.dumps(pending.message, default=str)
+                    await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+                    self.sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send WebSocket message: {str(e)}")
+            self.manager.drop(self.websocket)
+
+    async def close(self) -> None:
+        self.closed = True
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-        self.connection_locks: Dict[int, asyncio.Lock] = {}
+    """按主题订阅的WebSocket管理器
+
+    一个主题（如服务器ID）可以有任意多个订阅连接；广播时消息只序列化一次，
+    放入各连接自己的发送队列后立即返回，慢客户端不会拖慢其它客户端。
+    """
+
+    def __init__(self, max_queue: int = 100, send_timeout: float = 10.0):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.subscriptions: Dict[Hashable, Set[ClientConnection]] = {}
         self.retry_intervals = [1, 2, 5, 10, 30]  # 重试间隔（秒）
+        self.slow_disconnects = 0
 
-    async def connect(self, server_id: int, websocket: WebSocket) -> None:
+    async def connect(self, websocket: WebSocket, topics=()) -> ClientConnection:
         try:
             await websocket.accept()
-            self.active_connections[server_id] = websocket
-            self.connection_locks[server_id] = asyncio.Lock()
-            logger.info(f"WebSocket connected for server {server_id}")
         except Exception as e:
-            logger.error(f"WebSocket connection failed for server {server_id}: {str(e)}")
+            logger.error(f"WebSocket connection failed: {str(e)}")
             raise
+        client = ClientConnection(self, websocket, self.max_queue, self.send_timeout)
+        self.clients[websocket] = client
+        client.start()
+        self.subscribe(websocket, topics)
+        logger.info(f"WebSocket connected, topics={list(topics)}")
+        return client
 
-    async def disconnect(self, server_id: int) -> None:
-        if server_id in self.active_connections:
-            try:
-                await self.active_connections[server_id].close()
-            except Exception:
-                pass
-            del self.active_connections[server_id]
-            if server_id in self.connection_locks:
-                del self.connection_locks[server_id]
-            logger.info(f"WebSocket disconnected for server {server_id}")
+    def drop(self, websocket: WebSocket, slow: bool = False) -> None:
+        """在同步上下文中移除连接，实际关闭放到后台执行"""
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        if slow:
+            self.slow_disconnects += 1
+        self._remove_subscriptions(client)
+        client.closed = True
+        asyncio.get_event_loop().create_task(client.close())
 
-    async def send_message(self, server_id: int, message: Dict[str, Any]) -> bool:
-        if server_id not in self.active_connections:
-            return False
+    async def disconnect(self, websocket: WebSocket) -> None:
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        self._remove_subscriptions(client)
+        await client.close()
+        logger.info("WebSocket disconnected")
 
-        lock = self.connection_locks.get(server_id)
-        if not lock:
+    def _remove_subscriptions(self, client: ClientConnection) -> None:
+        for topic in list(client.topics):
+            subscribers = self.subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscriptions[topic]
+        client.topics.clear()
+
+    def subscribe(self, websocket: WebSocket, topics) -> list:
+        client = self.clients.get(websocket)
+        if client is None:
+            return []
+        added = []
+        for topic in topics:
+            if topic not in client.topics:
+                client.topics.add(topic)
+                self.subscriptions.setdefault(topic, set()).add(client)
+                added.append(topic)
+        return added
+
+    def unsubscribe(self, websocket: WebSocket, topics=None) -> None:
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        for topic in list(client.topics if topics is None else topics):
+            if topic not in client.topics:
+                continue
+            client.topics.discard(topic)
+            subscribers = self.subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscriptions[topic]
+
+    def subscriber_count(self, topic: Hashable) -> int:
+        return len(self.subscriptions.get(topic, ()))
+
+    async def send_message(self, websocket: WebSocket, message: Dict[str, Any],
+                           conflate_key: Optional[Hashable] = None) -> bool:
+        client = self.clients.get(websocket)
+        if client is None:
             return False
+        return client.enqueue({**message, 'timestamp': datetime.now().isoformat()},
+                              conflate_key=conflate_key)
 
-        async with lock:
-            try:
-                await self.active_connections[server_id].send_json({
-                    **message,
-                    'timestamp': datetime.now().isoformat()
-                })
-                return True
-            except Exception as e:
-                logger.error(f"Failed to send message to server {server_id}: {str(e)}")
-                await self.disconnect(server_id)
-                return False
+    async def publish(self, topic: Hashable, message: Dict[str, Any],
+                      conflate_key: Optional[Hashable] = None) -> int:
+        """推送给主题的所有订阅者，JSON只编码一次，返回入队的连接数"""
+        subscribers = self.subscriptions.get(topic)
+        if not subscribers:
+            return 0
+        payload = json.dumps(message, default=str)
+        return sum(1 for client in list(subscribers) if client.enqueue(message, payload, conflate_key))
 
     async def broadcast(self, message: Dict[str, Any]) -> None:
-        disconnected_servers = []
-        for server_id in self.active_connections:
-            if not await self.send_message(server_id, message):
-                disconnected_servers.append(server_id)
-        
-        # 清理断开的连接
-        for server_id in disconnected_servers:
-            await self.disconnect(server_id)
+        payload = json.dumps({**message, 'timestamp': datetime.now().isoformat()}, default=str)
+        for client in list(self.clients.values()):
+            client.enqueue(message, payload)
+
+    async def handle_subscriber(self, websocket: WebSocket, on_subscribe=None) -> None:
+        """处理浏览器端的订阅连接
+
+        客户端消息格式：{"type": "subscribe" | "unsubscribe", "server_ids": [1, 2]}
+        """
+        await self.connect(websocket)
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except WebSocketDisconnect:
+                    break
+                except Exception as e:
+                    logger.error(f"Invalid subscriber message: {str(e)}")
+                    break
+                try:
+                    server_ids = [int(x) for x in message.get('server_ids', [])]
+                except (AttributeError, TypeError, ValueError):
+                    continue
+                if message.get('type') == 'subscribe':
+                    added = self.subscribe(websocket, server_ids)
+                    if on_subscribe and added:
+                        await on_subscribe(websocket, added)
+                elif message.get('type') == 'unsubscribe':
+                    self.unsubscribe(websocket, server_ids)
+        finally:
+            await self.disconnect(websocket)
 
     async def handle_connection(self, server_id: int, websocket: WebSocket) -> None:
-        await self.connect(server_id, websocket)
+        await self.connect(websocket, topics=[server_id])
         try:
             while True:
                 try:
@@ -79,7 +268,7 @@ class WebSocketManager:
                     logger.error(f"Error handling WebSocket message: {str(e)}")
                     break
         finally:
-            await self.disconnect(server_id)
+            await self.disconnect(websocket)
 
     async def handle_message(self, server_id: int, message: Dict[str, Any]) -> None:
         try:
@@ -104,4 +293,13 @@ class WebSocketManager:
 
     async def handle_error(self, server_id: int, data: Dict[str, Any]) -> None:
         # 处理错误信息
-        logger.error(f"Error from server {server_id}: {data}") 
\ No newline at end of file
+        logger.error(f"Error from server {server_id}: {data}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'clients': len(self.clients),
+            'topics': len(self.subscriptions),
+            'sent': sum(client.sent for client in self.clients.values()),
+            'conflated': sum(client.conflated for client in self.clients.values()),
+            'slow_disconnects': self.slow_disconnects,
+        }
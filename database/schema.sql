@@ -29,8 +29,15 @@ CREATE TABLE command_logs (
     result TEXT,
     status TEXT,
     executed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    output_bytes INTEGER,
+    preview TEXT,
+    result_compressed BLOB,
     FOREIGN KEY (server_id) REFERENCES servers (id)
 );
+CREATE INDEX idx_command_logs_server_time ON command_logs (server_id, executed_at);
+
+-- 命令和输出的全文索引（rowid 对应 command_logs.id）
+CREATE VIRTUAL TABLE command_logs_fts USING fts5(command, output, content='');
 
 -- SSL证书表
 CREATE TABLE certificates (
@@ -49,8 +56,10 @@ CREATE TABLE monitoring_logs (
     site_id INTEGER REFERENCES sites(id),
     status_code INTEGER,
     response_time FLOAT,
-    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    error TEXT
 );
+CREATE INDEX idx_monitoring_logs_site_time ON monitoring_logs (site_id, checked_at);
 
 -- 告警记录表
 CREATE TABLE alerts (
@@ -59,7 +68,30 @@ CREATE TABLE alerts (
     type VARCHAR(50),
     message TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    status VARCHAR(50)
+    status VARCHAR(50),
+    server_id INTEGER,
+    rule_id INTEGER,
+    severity TEXT,
+    value FLOAT,
+    resolved_at TIMESTAMP
+);
+CREATE INDEX idx_alerts_site_status ON alerts (site_id, status);
+CREATE INDEX idx_alerts_rule_server ON alerts (rule_id, server_id, status);
+
+-- 指标告警规则（threshold / sustained / rate / anomaly）
+CREATE TABLE alert_rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'threshold',
+    operator TEXT NOT NULL DEFAULT '>',
+    value FLOAT NOT NULL,
+    duration INTEGER DEFAULT 0,
+    server_id INTEGER,
+    severity TEXT DEFAULT 'warning',
+    enabled INTEGER DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
 );
 
 -- 添加服务器监控数据表
@@ -89,8 +121,23 @@ CREATE TABLE service_status (
     memory_usage FLOAT,
     cpu_usage FLOAT,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    changed_at TIMESTAMP,
     FOREIGN KEY (server_id) REFERENCES servers (id)
 );
+CREATE UNIQUE INDEX idx_service_status_server_service ON service_status (server_id, service_name);
+
+-- 服务状态变更记录（只记录状态变化）
+CREATE TABLE service_status_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id INTEGER NOT NULL,
+    service_name TEXT NOT NULL,
+    old_status TEXT,
+    new_status TEXT,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+);
+CREATE INDEX idx_service_status_changes_server_time ON service_status_changes (server_id, changed_at);
+CREATE INDEX idx_service_status_changes_time ON service_status_changes (changed_at);
 
 -- 添加系统日志表
 CREATE TABLE system_logs (
@@ -101,4 +148,24 @@ CREATE TABLE system_logs (
     severity TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (server_id) REFERENCES servers (id)
-); 
\ No newline at end of file
+);
+CREATE INDEX idx_system_logs_server_time ON system_logs (server_id, created_at);
+CREATE INDEX idx_system_logs_server_severity ON system_logs (server_id, severity, created_at);
+
+-- 压缩后的旧系统日志，每段为一台服务器的一批日志（zlib压缩的JSON行数组）
+CREATE TABLE system_log_segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id INTEGER NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    start_at TIMESTAMP,
+    end_at TIMESTAMP,
+    line_count INTEGER NOT NULL,
+    severities TEXT,
+    raw_bytes INTEGER,
+    data BLOB NOT NULL,
+    FOREIGN KEY (server_id) REFERENCES servers (id)
+);
+CREATE INDEX idx_system_log_segments_server ON system_log_segments (server_id, last_id);
+-- 监控数据按服务器和时间查询的索引
+CREATE INDEX idx_server_metrics_server_time ON server_metrics (server_id, collected_at);
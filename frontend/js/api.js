@@ -71,7 +71,7 @@ const API = {
 
     // 获取服务器系统日志
     async getServerLogs(serverId) {
-        const response = await fetch(`${this.baseUrl}/servers/${serverId}/logs`)
+        const response = await fetch(`${this.baseUrl}/servers/${serverId}/system-logs`)
         return await response.json()
     }
 } 
\ No newline at end of file
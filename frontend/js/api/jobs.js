@@ -0,0 +1,34 @@
+import { API } from './index.js'
+
+export const JobsAPI = {
+    // 获取任务列表
+    async list(params = {}) {
+        const query = new URLSearchParams(params).toString()
+        return API.get(`/jobs${query ? `?${query}` : ''}`)
+    },
+
+    // 获取任务状态和进度
+    async get(jobId) {
+        return API.get(`/jobs/${jobId}`)
+    },
+
+    // 增量获取任务日志，after 为上一次返回的 next_seq
+    async getLogs(jobId, after = 0) {
+        return API.get(`/jobs/${jobId}/logs?after=${after}`)
+    },
+
+    // 取消任务
+    async cancel(jobId) {
+        return API.post(`/jobs/${jobId}/cancel`)
+    },
+
+    // 在本机安装 Nginx（返回任务 id）
+    async installNginx() {
+        return API.post('/install-nginx')
+    },
+
+    // 在多台服务器上并行安装 Nginx（返回任务 id）
+    async installNginxOnServers(data) {
+        return API.post('/servers/install-nginx', data)
+    }
+}
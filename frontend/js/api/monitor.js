@@ -6,25 +6,49 @@ export const MonitorAPI = {
         return API.get(`/servers/${serverId}/metrics`)
     },
 
+    // 获取历史指标（列式紧凑格式），解码为 [{time, cpu_usage, ...}] 行数组
+    async getMetricsHistory(serverId, params = {}) {
+        const query = new URLSearchParams({ ...params, format: 'columnar' })
+        const result = await API.get(`/servers/${serverId}/metrics?${query}`)
+        let time = 0
+        const rows = result.time.map((delta, i) => {
+            time += delta
+            const row = { time }
+            result.columns.forEach(column => {
+                row[column] = result.values[column][i]
+            })
+            return row
+        })
+        return { ...result, rows }
+    },
+
     // 获取服务状态
     async getServices(serverId) {
         return API.get(`/servers/${serverId}/services`)
     },
 
-    // 获取系统日志
-    async getLogs(serverId) {
-        return API.get(`/servers/${serverId}/logs`)
+    // 获取系统日志（分页：{ items, next_cursor }，next_cursor 作为 before_id 获取更早的日志）
+    async getLogs(serverId, params = {}) {
+        const query = new URLSearchParams(params).toString()
+        return API.get(`/servers/${serverId}/system-logs${query ? `?${query}` : ''}`)
     },
 
     // 获取实时监控数据
     async getRealtimeData(serverId) {
         return new Promise((resolve, reject) => {
-            const ws = new WebSocket(`ws://${window.location.host}/ws/${serverId}`)
+            const ws = new WebSocket(`ws://${window.location.host}/ws/metrics`)
+
+            ws.onopen = () => {
+                ws.send(JSON.stringify({ type: 'subscribe', server_ids: [serverId] }))
+            }
             
             ws.onmessage = (event) => {
                 try {
-                    const data = JSON.parse(event.data)
-                    resolve(data)
+                    const message = JSON.parse(event.data)
+                    if (message.type === 'snapshot') {
+                        ws.close()
+                        resolve(message.data)
+                    }
                 } catch (error) {
                     reject(error)
                 }
@@ -22,9 +22,15 @@ export const ServersAPI = {
         })
     },
 
-    // 获取命令日志
-    getCommandLogs(serverId) {
-        return request(`/servers/${serverId}/logs`)
+    // 获取命令日志（摘要分页：{ items, next_cursor }，params 可含 limit/cursor/status/q）
+    getCommandLogs(serverId, params = {}) {
+        const query = new URLSearchParams(params).toString()
+        return request(`/servers/${serverId}/logs${query ? `?${query}` : ''}`)
+    },
+
+    // 获取单条命令日志的完整输出
+    getCommandLog(serverId, logId) {
+        return request(`/servers/${serverId}/logs/${logId}`)
     },
 
     // 上传SSH密钥
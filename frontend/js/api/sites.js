@@ -21,6 +21,21 @@ export const SitesAPI = {
         return API.delete(`/sites/${siteId}`)
     },
 
+    // 预览站点生成的 Nginx 配置
+    async getConfig(siteId) {
+        return API.get(`/sites/${siteId}/config`)
+    },
+
+    // 立即同步 Nginx 配置（写入变化的文件、校验并重载）
+    async syncConfig() {
+        return API.post('/nginx/config/sync')
+    },
+
+    // 推送站点配置到远程服务器
+    async pushConfig(serverIds) {
+        return API.post('/nginx/config/push', { server_ids: serverIds })
+    },
+
     // 上传SSL证书
     async uploadCert(siteId, certFile, keyFile) {
         const formData = new FormData()
@@ -20,6 +20,9 @@ const App = {
         nginxInstalled: false  // 添加 Nginx 安装状态
     },
 
+    // 正在监控（已订阅实时指标）的服务器ID
+    monitoredServers: new Set(),
+
     // 初始化应用
     async init() {
         console.log('初始化应用');
@@ -272,8 +275,16 @@ const App = {
 
     // 切换标签页
     switchTab(tabName) {
+        const previousTab = this.data.activeTab;
         this.data.activeTab = tabName;
         this.updateActiveTab();
+
+        // 只在服务器管理页可见时订阅实时指标，离开时取消订阅
+        if (previousTab === 'servers' && tabName !== 'servers') {
+            this.stopAllServerMonitoring();
+        } else if (tabName === 'servers' && previousTab !== 'servers') {
+            this.data.servers.forEach(server => this.startServerMonitoring(server.id));
+        }
     },
 
     // 更新活动标签页
@@ -399,10 +410,15 @@ const App = {
             </div>
         `;
 
+        // 重新渲染后旧的图表已移除，先停止全部监控（包括已删除的服务器）
+        this.stopAllServerMonitoring();
+
         // 为每个服务器初始化图表
         this.data.servers.forEach(server => {
             this.initServerCharts(server.id);
-            this.startServerMonitoring(server.id);
+            if (this.data.activeTab === 'servers') {
+                this.startServerMonitoring(server.id);
+            }
         });
     },
 
@@ -759,6 +775,14 @@ const App = {
 
     // 开始监控服务器
     startServerMonitoring(serverId) {
+        // 重新渲染时先移除旧的监听和定时器，避免重复更新
+        const previousListener = this[`statusListener-${serverId}`];
+        if (previousListener) {
+            WebSocketManager.removeListener(serverId, previousListener);
+        }
+        clearInterval(this[`statusInterval-${serverId}`]);
+        this.monitoredServers.add(serverId);
+
         const updateServerStatus = async () => {
             try {
                 const response = await fetch(`/api/servers/${serverId}/status`);
@@ -775,13 +799,43 @@ const App = {
             }
         };
 
+        // 优先使用WebSocket推送，不支持时退回到定时轮询
+        if (window.WebSocketManager && WebSocketManager.isSupported()) {
+            const listener = (metrics) => this.updateServerCharts(serverId, metrics);
+            this[`statusListener-${serverId}`] = listener;
+            WebSocketManager.addListener(serverId, listener);
+            WebSocketManager.connect(serverId);
+            return;
+        }
+
         // 立即更新一次
         updateServerStatus();
 
-        // 每30秒更新一次
+        // 每秒更新一次
         this[`statusInterval-${serverId}`] = setInterval(updateServerStatus, 1000);
     },
 
+    // 停止监控服务器
+    stopServerMonitoring(serverId) {
+        const listener = this[`statusListener-${serverId}`];
+        if (listener) {
+            WebSocketManager.removeListener(serverId, listener);
+            WebSocketManager.disconnect(serverId);
+            delete this[`statusListener-${serverId}`];
+        }
+        const interval = this[`statusInterval-${serverId}`];
+        if (interval) {
+            clearInterval(interval);
+            delete this[`statusInterval-${serverId}`];
+        }
+        this.monitoredServers.delete(serverId);
+    },
+
+    // 停止所有服务器的监控
+    stopAllServerMonitoring() {
+        [...this.monitoredServers].forEach(serverId => this.stopServerMonitoring(serverId));
+    },
+
     // 更新服务器图表数据
     updateServerCharts(serverId, metrics) {
         // 更新CPU图表和数据显示
@@ -804,8 +858,11 @@ const App = {
                 100 - metrics.memory_usage
             ];
             memoryChart.update();
-            document.getElementById(`memory-value-${serverId}`).textContent = 
-                `${metrics.memory_used.toFixed(1)}GB / ${metrics.memory_total.toFixed(1)}GB`;
+            // 远程服务器的指标只有使用率，没有内存容量
+            document.getElementById(`memory-value-${serverId}`).textContent =
+                metrics.memory_used !== undefined && metrics.memory_total !== undefined
+                    ? `${metrics.memory_used.toFixed(1)}GB / ${metrics.memory_total.toFixed(1)}GB`
+                    : `${metrics.memory_usage.toFixed(1)}%`;
             document.getElementById(`memory-total-${serverId}`).textContent = 
                 `${metrics.memory_usage.toFixed(1)}%`;
         }
@@ -997,13 +1054,14 @@ const App = {
             method: 'POST'
         })
             .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
+            .then(data => App.waitForJob(data.job_id))
+            .then(job => {
+                if (job.status === 'success') {
                     Message.success('Nginx 安装成功');
                     // 安装成功后显示添加站点对话框
                     this.showAddSiteDialogContent();
                 } else {
-                    Message.error('Nginx 安装失败：' + data.message);
+                    Message.error('Nginx 安装失败：' + job.message);
                 }
             })
             .catch(error => {
@@ -1012,6 +1070,30 @@ const App = {
             });
     },
 
+    // 轮询后台任务直到结束，返回最终的任务状态
+    waitForJob(jobId, interval = 2000) {
+        return new Promise((resolve, reject) => {
+            const poll = () => {
+                fetch(`/api/jobs/${jobId}`)
+                    .then(response => {
+                        if (!response.ok) {
+                            throw new Error(`HTTP error! status: ${response.status}`);
+                        }
+                        return response.json();
+                    })
+                    .then(job => {
+                        if (['success', 'error', 'cancelled', 'interrupted'].includes(job.status)) {
+                            resolve(job);
+                        } else {
+                            setTimeout(poll, interval);
+                        }
+                    })
+                    .catch(reject);
+            };
+            poll();
+        });
+    },
+
     // 将原来的 showAddSiteDialog 方法改名为 showAddSiteDialogContent
     showAddSiteDialogContent() {
         // 检查是否已存在模态框
@@ -1,59 +1,121 @@
 // WebSocket管理器
+// 所有服务器共用一条 /ws/metrics 连接，通过订阅消息选择要接收的服务器
 const WebSocketManager = {
-    connections: new Map(),
+    socket: null,
+    subscribed: new Set(),
     listeners: new Map(),
+    state: new Map(),   // 每台服务器合并后的最新指标
+    retryCount: 0,
     retryIntervals: [1000, 2000, 5000, 10000, 30000], // 重试间隔（毫秒）
 
-    connect(serverId) {
-        if (this.connections.has(serverId)) {
-            return;
+    isSupported() {
+        return typeof window.WebSocket !== 'undefined';
+    },
+
+    ensureSocket() {
+        if (this.socket) {
+            return this.socket;
         }
 
-        const ws = new WebSocket(`ws://${window.location.host}/ws/${serverId}`);
-        
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const ws = new WebSocket(`${protocol}://${window.location.host}/ws/metrics`);
+
         ws.onopen = () => {
-            console.log(`WebSocket connected for server ${serverId}`);
+            console.log('WebSocket connected');
+            this.retryCount = 0;
+            if (this.subscribed.size) {
+                this.send({ type: 'subscribe', server_ids: [...this.subscribed] });
+            }
         };
 
         ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            this.notifyListeners(serverId, data);
+            const message = JSON.parse(event.data);
+            this.handleMessage(message);
         };
 
         ws.onerror = (error) => {
-            console.error(`WebSocket error for server ${serverId}:`, error);
+            console.error('WebSocket error:', error);
         };
 
         ws.onclose = () => {
-            console.log(`WebSocket closed for server ${serverId}`);
-            this.connections.delete(serverId);
-            // 尝试重新连接
-            this.retryConnection(serverId);
+            console.log('WebSocket closed');
+            this.socket = null;
+            this.state.clear();
+            // 仍有订阅时尝试重新连接
+            if (this.subscribed.size) {
+                this.retryConnection();
+            }
         };
 
-        this.connections.set(serverId, ws);
+        this.socket = ws;
+        return ws;
+    },
+
+    send(message) {
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify(message));
+        }
+    },
+
+    connect(serverId) {
+        if (this.subscribed.has(serverId)) {
+            return;
+        }
+        this.subscribed.add(serverId);
+        this.ensureSocket();
+        this.send({ type: 'subscribe', server_ids: [serverId] });
     },
 
     disconnect(serverId) {
-        const ws = this.connections.get(serverId);
-        if (ws) {
-            ws.close();
-            this.connections.delete(serverId);
+        if (!this.subscribed.delete(serverId)) {
+            return;
+        }
+        this.state.delete(serverId);
+        this.send({ type: 'unsubscribe', server_ids: [serverId] });
+        if (!this.subscribed.size && this.socket) {
+            this.socket.close();
+            this.socket = null;
         }
     },
 
-    retryConnection(serverId) {
-        let retryCount = 0;
-        const tryConnect = () => {
-            if (retryCount < this.retryIntervals.length) {
-                setTimeout(() => {
-                    console.log(`Retrying connection for server ${serverId}...`);
-                    this.connect(serverId);
-                    retryCount++;
-                }, this.retryIntervals[retryCount]);
+    retryConnection() {
+        const delay = this.retryIntervals[Math.min(this.retryCount, this.retryIntervals.length - 1)];
+        this.retryCount++;
+        setTimeout(() => {
+            if (this.subscribed.size && !this.socket) {
+                console.log('Retrying WebSocket connection...');
+                this.ensureSocket();
             }
-        };
-        tryConnect();
+        }, delay);
+    },
+
+    // 将增量合并到已有状态中
+    merge(target, delta) {
+        Object.entries(delta).forEach(([key, value]) => {
+            if (value && typeof value === 'object' && !Array.isArray(value)
+                && target[key] && typeof target[key] === 'object' && !Array.isArray(target[key])) {
+                this.merge(target[key], value);
+            } else {
+                target[key] = value;
+            }
+        });
+        return target;
+    },
+
+    handleMessage(message) {
+        const serverId = message.server_id;
+        if (message.type === 'snapshot') {
+            this.state.set(serverId, message.data);
+        } else if (message.type === 'delta') {
+            const current = this.state.get(serverId);
+            if (!current) {
+                return;
+            }
+            this.merge(current, message.data);
+        } else {
+            return;
+        }
+        this.notifyListeners(serverId, this.state.get(serverId));
     },
 
     addListener(serverId, callback) {
@@ -79,4 +141,4 @@ const WebSocketManager = {
 };
 
 // 导出工具类
-window.WebSocketManager = WebSocketManager; 
\ No newline at end of file
+window.WebSocketManager = WebSocketManager;